@@ -5,6 +5,7 @@ import stripe
 from datetime import datetime, timedelta
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key, Attr
+from lambda_functions.user_index import recent_users
 
 # Initialize AWS services
 dynamodb = boto3.resource('dynamodb')
@@ -82,10 +83,7 @@ def get_dashboard_stats(event, context):
 def get_recent_users(event, context):
     """Get list of recent users with their subscription status"""
     try:
-        users = users_table.scan(
-            Limit=10,
-            ScanIndexForward=False
-        )['Items']
+        users = recent_users(users_table, limit=10)
 
         # Enrich user data with subscription info
         for user in users:
@@ -5,6 +5,12 @@ import stripe
 from datetime import datetime, timedelta
 from decimal import Decimal
 from boto3.dynamodb.conditions import Attr
+from lambda_functions.feedback_metrics import read_metrics, GLOBAL_SCOPE
+from lambda_functions.stripe_customers import find_subscription, forget_customer
+from lambda_functions.revenue_ledger import daily_totals, monthly_totals
+from lambda_functions.user_index import recent_users, search_by_email
+from lambda_functions.admin_listings import list_users, list_subscriptions, InvalidCursor
+from lambda_functions.etags import bump_version
 
 # --- Initialization ---
 dynamodb = boto3.resource('dynamodb')
@@ -13,6 +19,9 @@ secrets_client = boto3.client('secretsmanager')
 USERS_TABLE = os.environ.get('USERS_TABLE')
 SUBSCRIPTIONS_TABLE = os.environ.get('SUBSCRIPTIONS_TABLE')
 USAGE_TABLE = os.environ.get('USAGE_TABLE')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'threatalytics-documents')
+# Written by lambda_functions/feedback_clusters.py (offline job)
+FEEDBACK_CLUSTERS_KEY = 'analytics/feedback-clusters/latest.json'
 STRIPE_SECRET_NAME = os.environ.get('STRIPE_SECRET_NAME')
 
 users_table = dynamodb.Table(USERS_TABLE)
@@ -50,6 +59,15 @@ def verify_admin_auth(event):
     return True
 
 # --- Admin Functions ---
+def get_feedback_clusters():
+    """Latest comment clustering report, or an empty result if the job has not run"""
+    try:
+        obj = boto3.client('s3').get_object(Bucket=S3_BUCKET, Key=FEEDBACK_CLUSTERS_KEY)
+        return json.loads(obj['Body'].read())
+    except Exception as e:
+        print(f"No feedback cluster report: {e}")
+        return {'generated_at': None, 'clusters': []}
+
 def get_dashboard_stats():
     total_users = users_table.scan(Select='COUNT')['Count']
 
@@ -58,16 +76,8 @@ def get_dashboard_stats():
         Select='COUNT'
     )['Count']
 
-    # Revenue (safe if stripe not configured)
-    total_revenue = 0.0
-    if stripe.api_key:
-        now = datetime.utcnow()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        monthly_revenue = stripe.BalanceTransaction.list(
-            created={'gte': int(month_start.timestamp())},
-            type='charge'
-        )
-        total_revenue = sum(txn.amount for txn in monthly_revenue.auto_paging_iter()) / 100
+    # Revenue from the ledger (lambda_functions/revenue_ledger.py)
+    total_revenue = monthly_totals(dynamodb, 1).get(datetime.utcnow().strftime('%Y-%m'), 0.0)
 
     # Usage (last 24h)
     now = datetime.utcnow()
@@ -83,9 +93,7 @@ def get_dashboard_stats():
     }
 
 def get_recent_users():
-    users_response = users_table.scan()
-    users = sorted(users_response.get('Items', []),
-                   key=lambda x: x.get('created_at', ''), reverse=True)[:10]
+    users = recent_users(users_table, limit=10)
 
     # Enrich from Stripe only if available
     if stripe.api_key:
@@ -101,8 +109,9 @@ def get_recent_users():
 
 def get_all_users(event):
     """
-    Return users with a graceful fallback to dummy data for quick testing.
-    Supports ?limit=N (default 20).
+    Return users, newest first, with a graceful fallback to dummy data for quick testing.
+    Supports ?limit=N (default 20), ?plan=<plan>, ?cursor=<next_cursor of the
+    previous page> and ?search=<email or email prefix>.
     """
     limit = 20
     qs = get_qs(event)
@@ -112,13 +121,19 @@ def get_all_users(event):
     except Exception:
         pass
 
+    if qs.get('search'):
+        users = search_by_email(users_table, qs['search'], limit)
+        return {'users': users, 'source': 'dynamodb', 'count': len(users)}
+
     try:
-        resp = users_table.scan(Limit=limit)
-        users = resp.get('Items', [])
-        if users:
-            return {'users': users, 'source': 'dynamodb', 'count': len(users)}
+        page = list_users(users_table, limit, plan=qs.get('plan'), cursor=qs.get('cursor'))
+        users = page['users']
+        if users or qs.get('cursor') or qs.get('plan'):
+            return {'users': users, 'source': 'dynamodb', 'count': len(users), 'next_cursor': page['next_cursor']}
+    except InvalidCursor:
+        raise
     except Exception as e:
-        print(f"/admin/users scan failed: {e}")
+        print(f"/admin/users query failed: {e}")
 
     # Dummy fallback (visible when table empty or error)
     dummy = [
@@ -150,21 +165,7 @@ def get_all_users(event):
     return {'users': dummy, 'source': 'dummy', 'count': len(dummy)}
 
 def get_revenue_chart_data():
-    if not stripe.api_key:
-        return {'revenue_data': {}}
-    now = datetime.utcnow()
-    six_months_ago = now - timedelta(days=180)
-    revenue_data = stripe.BalanceTransaction.list(
-        created={'gte': int(six_months_ago.timestamp())},
-        type='charge'
-    )
-    monthly = {}
-    for txn in revenue_data.auto_paging_iter():
-        date = datetime.fromtimestamp(txn.created)
-        key = date.strftime('%Y-%m')
-        monthly.setdefault(key, 0)
-        monthly[key] += txn.amount / 100
-    return {'revenue_data': monthly}
+    return {'revenue_data': monthly_totals(dynamodb, 6)}
 
 def get_usage_chart_data():
     now = datetime.utcnow()
@@ -178,8 +179,9 @@ def get_usage_chart_data():
 
 def get_all_subscriptions(event):
     """
-    Get all subscriptions across all users.
-    Supports ?limit=N (default 50).
+    Get all subscriptions across all users, one page at a time.
+    Supports ?limit=N (default 50), ?plan=<plan>, ?status=<status> and
+    ?cursor=<next_cursor of the previous page>.
     """
     limit = 50
     qs = get_qs(event)
@@ -190,9 +192,10 @@ def get_all_subscriptions(event):
         pass
 
     try:
-        resp = subscriptions_table.scan(Limit=limit)
-        subscriptions = resp.get('Items', [])
-        
+        page = list_subscriptions(subscriptions_table, limit, plan=qs.get('plan'),
+                                  status=qs.get('status'), cursor=qs.get('cursor'))
+        subscriptions = page['subscriptions']
+
         # Format subscriptions for frontend
         formatted_subs = []
         for sub in subscriptions:
@@ -205,9 +208,11 @@ def get_all_subscriptions(event):
                 'created_at': sub.get('created_at', datetime.utcnow().isoformat())
             })
         
-        return {'subscriptions': formatted_subs, 'count': len(formatted_subs)}
+        return {'subscriptions': formatted_subs, 'count': len(formatted_subs), 'next_cursor': page['next_cursor']}
+    except InvalidCursor:
+        raise
     except Exception as e:
-        print(f"/admin/subscriptions scan failed: {e}")
+        print(f"/admin/subscriptions query failed: {e}")
         return {'subscriptions': [], 'count': 0, 'error': str(e)}
 
 def get_api_usage_analytics(event):
@@ -307,7 +312,13 @@ def get_revenue_data(event):
     except Exception:
         pass
 
-    if not stripe.api_key:
+    try:
+        revenue_array = daily_totals(dynamodb, days)
+    except Exception as e:
+        print(f"/admin/revenue failed: {e}")
+        return {'revenue': [], 'count': 0, 'error': str(e)}
+
+    if not revenue_array and not stripe.api_key:
         # Return dummy data if Stripe not configured
         dummy_data = []
         for i in range(min(days, 30)):
@@ -319,38 +330,7 @@ def get_revenue_data(event):
             })
         return {'revenue': dummy_data, 'count': len(dummy_data)}
 
-    try:
-        now = datetime.utcnow()
-        since = now - timedelta(days=days)
-        
-        # Get transactions from Stripe
-        transactions = stripe.BalanceTransaction.list(
-            created={'gte': int(since.timestamp())},
-            type='charge',
-            limit=100
-        )
-        
-        # Aggregate by date
-        daily_revenue = {}
-        for txn in transactions.auto_paging_iter():
-            date = datetime.fromtimestamp(txn.created).strftime('%Y-%m-%d')
-            if date not in daily_revenue:
-                daily_revenue[date] = {
-                    'date': date,
-                    'revenue': 0,
-                    'subscriptions': 0
-                }
-            daily_revenue[date]['revenue'] += txn.amount / 100
-            daily_revenue[date]['subscriptions'] += 1
-        
-        # Convert to array and sort by date
-        revenue_array = list(daily_revenue.values())
-        revenue_array.sort(key=lambda x: x['date'], reverse=True)
-        
-        return {'revenue': revenue_array, 'count': len(revenue_array)}
-    except Exception as e:
-        print(f"/admin/revenue failed: {e}")
-        return {'revenue': [], 'count': 0, 'error': str(e)}
+    return {'revenue': revenue_array, 'count': len(revenue_array)}
 
 def delete_user(event):
     """
@@ -375,6 +355,7 @@ def delete_user(event):
         if stripe.api_key and 'stripe_customer_id' in user:
             try:
                 stripe.Customer.delete(user['stripe_customer_id'])
+                forget_customer(dynamodb, user['stripe_customer_id'])
             except Exception as e:
                 print(f"Stripe customer deletion failed: {e}")
         
@@ -414,17 +395,11 @@ def cancel_subscription(event):
         return create_response(400, {'error': 'Subscription ID required'}, event)
     
     try:
-        # Get subscription from DynamoDB
-        sub_response = subscriptions_table.scan(
-            FilterExpression=Attr('subscription_id').eq(subscription_id)
-        )
-        
-        subscriptions = sub_response.get('Items', [])
-        if not subscriptions:
+        # Get subscription from DynamoDB (subscription-index GSI)
+        subscription = find_subscription(subscriptions_table, subscription_id)
+        if not subscription:
             return create_response(404, {'error': 'Subscription not found'}, event)
         
-        subscription = subscriptions[0]
-        
         # Cancel in Stripe if available
         if stripe.api_key:
             try:
@@ -446,6 +421,8 @@ def cancel_subscription(event):
                 ':updated': datetime.utcnow().isoformat()
             }
         )
+        # The user's /usage response lists this subscription
+        bump_version(dynamodb, subscription.get('user_id'), 'usage')
         
         return create_response(200, {
             'message': 'Subscription cancelled successfully',
@@ -558,6 +535,12 @@ def lambda_handler(event, context):
         elif path == '/admin/revenue' and method == 'GET':
             data = get_revenue_data(event)
         
+        # Feedback metrics across all users (counters kept by /feedback)
+        elif path == '/admin/feedback/metrics' and method == 'GET':
+            data = read_metrics(dynamodb, GLOBAL_SCOPE)
+        elif path == '/admin/feedback/clusters' and method == 'GET':
+            data = get_feedback_clusters()
+        
         # Charts endpoints (legacy)
         elif path == '/admin/charts/revenue':
             data = get_revenue_chart_data()
@@ -569,6 +552,8 @@ def lambda_handler(event, context):
 
         return create_response(200, data, event)
 
+    except InvalidCursor as e:
+        return create_response(400, {'error': str(e)}, event)
     except Exception as e:
         print(f"Unhandled error: {e}")
         import traceback
@@ -0,0 +1,35 @@
+"""
+Activity Log client index backfill
+Run once after deploying user-client-index: items written before the index
+existed have no user_client attribute and are invisible to client queries.
+"""
+
+import boto3
+from lambda_functions.activity_log import client_key
+
+dynamodb = boto3.resource('dynamodb')
+table = dynamodb.Table('ThreatalyticsActivityLog')
+
+scan_kwargs = {
+    'FilterExpression': 'attribute_exists(client_id) AND attribute_not_exists(user_client)',
+    'ProjectionExpression': 'user_id, activity_id, client_id'
+}
+updated = 0
+
+print("🔧 Backfilling user_client on ThreatalyticsActivityLog...")
+
+while True:
+    response = table.scan(**scan_kwargs)
+    for item in response.get('Items', []):
+        table.update_item(
+            Key={'user_id': item['user_id'], 'activity_id': item['activity_id']},
+            UpdateExpression='SET user_client = :uc',
+            ExpressionAttributeValues={':uc': client_key(item['user_id'], item['client_id'])}
+        )
+        updated += 1
+
+    if 'LastEvaluatedKey' not in response:
+        break
+    scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+print(f"✅ Updated {updated} activities")
@@ -0,0 +1,42 @@
+"""
+Feedback counters backfill
+Recomputes ThreatalyticsFeedbackStats from ThreatalyticsFeedback. Run once
+when the counters are first deployed; it overwrites existing counter items,
+so run it before feedback starts flowing through the new code.
+"""
+
+import boto3
+from lambda_functions.feedback_metrics import counter_deltas, STATS_TABLE
+
+dynamodb = boto3.resource('dynamodb')
+feedback_table = dynamodb.Table('ThreatalyticsFeedback')
+stats_table = dynamodb.Table(STATS_TABLE)
+
+scan_kwargs = {
+    'ProjectionExpression': 'user_id, #ts, helpful, #m',
+    'ExpressionAttributeNames': {'#ts': 'timestamp', '#m': 'mode'}
+}
+counters = {}
+scanned = 0
+
+print("🔧 Recomputing feedback counters...")
+
+while True:
+    response = feedback_table.scan(**scan_kwargs)
+    for item in response.get('Items', []):
+        entry = (item.get('helpful', False), item.get('mode'), item['timestamp'])
+        for key, deltas in counter_deltas(item['user_id'], [entry]).items():
+            totals = counters.setdefault(key, {})
+            for name, value in deltas.items():
+                totals[name] = totals.get(name, 0) + value
+        scanned += 1
+
+    if 'LastEvaluatedKey' not in response:
+        break
+    scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+with stats_table.batch_writer() as batch:
+    for (scope, bucket), totals in counters.items():
+        batch.put_item(Item={'scope': scope, 'bucket': bucket, **totals})
+
+print(f"✅ {scanned} feedback items -> {len(counters)} counter items")
@@ -0,0 +1,71 @@
+"""
+Microbenchmark: compiled KeywordPolicy vs the original substring loop.
+
+    python bench_image_validator.py [n]
+
+On one core with the built-in 24 keywords the loop is ~6us and the index
+~17us per 40-word description: 24 C-level `in` scans of a short string are
+hard to beat. At 510 rules the loop is ~49us and the index stays at ~18us.
+The index is kept for whole-word matching and for rule sets loaded from
+S3/DynamoDB, which are expected to grow.
+"""
+import random
+import sys
+import time
+
+from lambda_functions.image_validator import KeywordPolicy, APPROVED_KEYWORDS, RESTRICTED_KEYWORDS
+
+FILLER = ("show the escalation path for the north site team with clear labels and "
+          "timeline markers covering the incident review and follow up actions").split()
+
+def substring_loop(text):
+    """The validator before KeywordPolicy: one `in` scan per keyword"""
+    text = text.lower()
+    for keyword in RESTRICTED_KEYWORDS:
+        if keyword in text:
+            return keyword, []
+    return None, [k for k in APPROVED_KEYWORDS if k in text][:1]
+
+def make_descriptions(n, words=40, seed=0):
+    rng = random.Random(seed)
+    keywords = APPROVED_KEYWORDS + RESTRICTED_KEYWORDS
+    descriptions = []
+    for _ in range(n):
+        parts = [rng.choice(FILLER) for _ in range(words)]
+        parts.insert(rng.randrange(words), rng.choice(keywords))
+        descriptions.append(' '.join(parts))
+    return descriptions
+
+def timed(fn, descriptions):
+    started = time.perf_counter()
+    for d in descriptions:
+        fn(d)
+    return time.perf_counter() - started
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    descriptions = make_descriptions(n)
+
+    started = time.perf_counter()
+    policy = KeywordPolicy(APPROVED_KEYWORDS, RESTRICTED_KEYWORDS)
+    compile_ms = (time.perf_counter() - started) * 1000
+
+    for name, fn in (('substring loop', substring_loop), ('compiled index', policy.check)):
+        elapsed = timed(fn, descriptions)
+        print(f"{name:15s} {elapsed * 1e6 / n:7.2f} us/description  ({n} descriptions)")
+    print(f"compile        {compile_ms:7.2f} ms once per container")
+
+    # Rule-set size is where the loop falls behind: it rescans the text per keyword
+    rng = random.Random(1)
+    big = [f"term{rng.randrange(10 ** 6)} {b}" for b in ('grid', 'map', 'chart', 'matrix', 'view') for _ in range(100)]
+    big += APPROVED_KEYWORDS
+    big_policy = KeywordPolicy(big, RESTRICTED_KEYWORDS)
+    def big_loop(text):
+        text = text.lower()
+        for keyword in RESTRICTED_KEYWORDS:
+            if keyword in text:
+                return keyword
+        return [k for k in big if k in text]
+    for name, fn in ((f'loop, {len(big)} terms', big_loop), (f'index, {len(big)} terms', big_policy.check)):
+        elapsed = timed(fn, descriptions)
+        print(f"{name:15s} {elapsed * 1e6 / n:7.2f} us/description")
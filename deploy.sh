@@ -25,9 +25,30 @@ mkdir -p .serverless/admin
 cp admin/admin-api.py .serverless/admin/
 cp -r admin/index.html .serverless/admin/
 
+# DynamoDB creates one GSI per table update, so a stack from before the admin
+# indexes is brought up one wave at a time (custom.indexWave in serverless.yml).
+# The wave already deployed is read from the indexes on ThreatalyticsPlans.
+current_index_wave() {
+    local indexes
+    if ! indexes=$(aws dynamodb describe-table --table-name ThreatalyticsPlans \
+            --query 'Table.GlobalSecondaryIndexes[].IndexName' --output text 2>/dev/null); then
+        echo 3  # no table yet: the stack creates every index at once
+    elif [[ $indexes == *plan-index* ]]; then
+        echo 3
+    elif [[ $indexes == *status-index* ]]; then
+        echo 2
+    else
+        echo 1
+    fi
+}
+
 # Deploy to AWS
 echo "🏗️  Deploying to AWS..."
-serverless deploy
+for wave in $(seq "$(current_index_wave)" 3); do
+    echo "📇 Index wave $wave of 3"
+    # Returns once CloudFormation has finished creating this wave's indexes
+    serverless deploy --param="indexWave=$wave"
+done
 
 # Get API Gateway URL
 API_URL=$(serverless info --verbose | grep "ServiceEndpoint" | awk '{print $2}')
@@ -0,0 +1,252 @@
+"""
+Bulk activity import for ThreatalyticsActivityLog.
+
+Rows are parsed and validated one line at a time and handed to a
+BatchWriter, which sends 25-item BatchWriteItem chunks from a small thread
+pool. At most a few chunks are in flight at once, so memory use does not
+grow with the size of the file. The ids of each written chunk are passed
+to `on_written` as the chunk completes, e.g. to queue search reindexing.
+"""
+import base64
+import codecs
+import csv
+import io
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+BATCH_SIZE = 25          # DynamoDB BatchWriteItem limit
+MAX_WORKERS = 4
+MAX_IN_FLIGHT = 8        # chunks queued or being written
+MAX_ATTEMPTS = 6
+BASE_BACKOFF = 0.05      # seconds, doubled per attempt
+MAX_REPORTED_ERRORS = 100
+MAX_TEXT_LENGTH = 20000
+
+TEXT_FIELDS = ('client_id', 'case_name', 'mode', 'question', 'answer', 'tag', 'note', 'file_url')
+REQUIRED_FIELDS = ('client_id', 'timestamp')
+
+def iter_rows(lines, fmt):
+    """
+    Yield (row_number, record, error) for each non-blank row.
+    `lines` is any iterable of text lines, e.g. a file or a streaming S3 body.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            # line_num counts physical lines, so quoted newlines keep numbers accurate
+            if not any((value or '').strip() for value in record.values() if isinstance(value, str)):
+                continue
+            yield reader.line_num, record, None
+    elif fmt == 'ndjson':
+        for row_number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield row_number, None, 'Row must be a JSON object'
+                continue
+            yield row_number, record, None
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+def normalize_timestamp(value):
+    """
+    Accept ISO dates/datetimes (optionally with Z or an offset) and store
+    naive UTC, the same form as datetime.utcnow().isoformat() used by the
+    other activity writers, so imported and live timestamps sort together
+    """
+    value = str(value).strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+def build_item(user_id, record, imported_at):
+    """Validate one row and return the DynamoDB item; raises ValueError with a row-level message"""
+    missing = [f for f in REQUIRED_FIELDS if not str(record.get(f) or '').strip()]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+
+    try:
+        timestamp = normalize_timestamp(record['timestamp'])
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {record['timestamp']}")
+
+    client_id = str(record['client_id']).strip()
+    item = {
+        'user_id': user_id,
+        'activity_id': str(record.get('activity_id') or '').strip() or str(uuid.uuid4()),
+        'user_client': f"{user_id}#{client_id}",
+        'timestamp': timestamp,
+        'imported_at': imported_at
+    }
+
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if value is None or value == '':
+            continue
+        value = str(value)
+        if len(value) > MAX_TEXT_LENGTH:
+            raise ValueError(f"Field {field} exceeds {MAX_TEXT_LENGTH} characters")
+        item[field] = value
+    item['client_id'] = client_id
+
+    score = record.get('trs_score')
+    if score not in (None, ''):
+        try:
+            item['trs_score'] = Decimal(str(score))
+        except InvalidOperation:
+            raise ValueError(f"Invalid trs_score: {score}")
+
+    return item
+
+class BatchWriter:
+    """
+    Parallel BatchWriteItem writer with backoff on UnprocessedItems.
+    Call add() per item and close() once; failures are collected as (row, error).
+    on_written(activity_ids) is called on the caller's thread for each chunk.
+    """
+    def __init__(self, dynamodb, table_name, max_workers=MAX_WORKERS, sleep=time.sleep, on_written=None):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.sleep = sleep
+        self.on_written = on_written
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = set()
+        self.chunk = []
+        self.chunk_keys = set()
+        self.written = 0
+        self.failures = []
+
+    def add(self, item, row_number):
+        key = item['activity_id']
+        if key in self.chunk_keys:
+            # BatchWriteItem rejects duplicate keys within one request
+            self._flush_chunk()
+        self.chunk.append((row_number, item))
+        self.chunk_keys.add(key)
+        if len(self.chunk) >= BATCH_SIZE:
+            self._flush_chunk()
+
+    def close(self):
+        self._flush_chunk()
+        self._drain(0)
+        self.executor.shutdown(wait=True)
+
+    def _flush_chunk(self):
+        if not self.chunk:
+            return
+        self._drain(MAX_IN_FLIGHT - 1)
+        self.pending.add(self.executor.submit(self._write_chunk, self.chunk))
+        self.chunk = []
+        self.chunk_keys = set()
+
+    def _drain(self, limit):
+        while len(self.pending) > limit:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                written, failures = future.result()
+                self.written += len(written)
+                self.failures.extend(failures)
+                if written and self.on_written:
+                    self.on_written(written)
+
+    def _write_chunk(self, chunk):
+        """(ids written, [(row, error)]) for one chunk"""
+        rows = {item['activity_id']: row_number for row_number, item in chunk}
+        requests = [{'PutRequest': {'Item': item}} for _, item in chunk]
+
+        def written():
+            unwritten = {r['PutRequest']['Item']['activity_id'] for r in requests}
+            return [activity_id for activity_id in rows if activity_id not in unwritten]
+
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            except Exception as e:
+                # Throttling on the whole request; retry the same chunk
+                if attempt == MAX_ATTEMPTS - 1:
+                    return written(), [(rows[r['PutRequest']['Item']['activity_id']], str(e)) for r in requests]
+            if not requests:
+                return written(), []
+            self.sleep(BASE_BACKOFF * (2 ** attempt) * (0.5 + random.random()))
+
+        failures = [(rows[r['PutRequest']['Item']['activity_id']], 'Unprocessed after retries') for r in requests]
+        return written(), failures
+
+def import_activities(dynamodb, table_name, user_id, lines, fmt, writer=None, on_written=None):
+    """
+    Stream rows from `lines` into the activity table.
+    Returns {imported, failed, rows, elapsed_ms, rows_per_sec, errors}.
+    """
+    started = time.time()
+    imported_at = datetime.utcnow().isoformat()
+    writer = writer or BatchWriter(dynamodb, table_name, on_written=on_written)
+    errors = []
+    error_count = 0
+    rows = 0
+
+    try:
+        for row_number, record, error in iter_rows(lines, fmt):
+            rows += 1
+            if error is None:
+                try:
+                    writer.add(build_item(user_id, record, imported_at), row_number)
+                    continue
+                except ValueError as e:
+                    error = str(e)
+            error_count += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({'row': row_number, 'error': error})
+    finally:
+        writer.close()
+
+    for row_number, error in sorted(writer.failures):
+        error_count += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({'row': row_number, 'error': error})
+
+    elapsed = time.time() - started
+    return {
+        'rows': rows,
+        'imported': writer.written,
+        'failed': error_count,
+        'elapsed_ms': int(elapsed * 1000),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else rows,
+        'errors': errors,
+        'errors_truncated': error_count > len(errors)
+    }
+
+def detect_format(fmt, content_type):
+    """Explicit ?format= wins, then Content-Type; CSV is the default"""
+    fmt = (fmt or '').lower()
+    if fmt in ('csv', 'ndjson'):
+        return fmt
+    content_type = (content_type or '').lower()
+    if 'ndjson' in content_type or 'jsonl' in content_type or 'json-seq' in content_type:
+        return 'ndjson'
+    return 'csv'
+
+def body_lines(body, is_base64=False):
+    """Iterate an API Gateway body line by line without splitting it into a list"""
+    if is_base64:
+        return io.TextIOWrapper(io.BytesIO(base64.b64decode(body)), encoding='utf-8-sig', newline='')
+    return io.StringIO(body.lstrip('\ufeff'), newline='')
+
+def s3_lines(s3_client, bucket, key):
+    """Stream an uploaded file from S3; lines are decoded as they are read"""
+    response = s3_client.get_object(Bucket=bucket, Key=key)
+    return codecs.getreader('utf-8-sig')(response['Body'])
@@ -4,6 +4,22 @@ import boto3
 from datetime import datetime
 import uuid
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from lambda_functions.search_index import queue_reindex, queue_reindex_batch
+from lambda_functions.activity_import import import_activities, detect_format, body_lines, s3_lines
+
+# GSI keyed on (user_client, timestamp) so a client's case history is read directly
+CLIENT_INDEX = 'user-client-index'
+# GSI keyed on (user_id, timestamp) for the unfiltered, time-ordered history
+TIMESTAMP_INDEX = 'user-timestamp-index'
+ACTIVITY_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+MAX_NOTE_BATCH = 100
+NOTE_WORKERS = 8
+IMPORTS_BUCKET = os.environ.get('S3_BUCKET', 'threatalytics-documents')
+
+# Shared by the note-update threads (creating boto3 clients is not thread-safe)
+sqs = boto3.client('sqs')
 
 def get_user_id_from_token(event):
     """Extract user_id from JWT token in Authorization header (reused from conversations.py)"""
@@ -35,12 +51,153 @@ def get_user_id_from_token(event):
         print(f"Error extracting user_id: {str(e)}")
         return None
 
+def client_key(user_id, client_id):
+    """Value of the user_client attribute every activity item must carry"""
+    return f"{user_id}#{client_id}"
+
+def encode_cursor(last_evaluated_key, filters):
+    """
+    Wrap a DynamoDB LastEvaluatedKey into an opaque URL-safe token, bound to
+    the filters (and so the index) the page was read with
+    """
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps({'k': last_evaluated_key, 'f': filters}, default=str, sort_keys=True, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, user_id, filters):
+    """Unwrap a cursor token; rejects tokens of another user or other filters"""
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    payload = json.loads(base64.urlsafe_b64decode(padded))
+    key = payload.get('k') if isinstance(payload, dict) else None
+    if not isinstance(key, dict) or key.get('user_id') != user_id or payload.get('f') != filters:
+        raise ValueError('Invalid cursor')
+    return key
+
+def timestamp_range(date_from, date_to):
+    """
+    Build the timestamp condition for an optional from/to range.
+    Bare dates are widened to cover the whole day, since timestamps are ISO strings.
+    """
+    if date_to and len(date_to) == 10:
+        date_to += 'T23:59:59.999999'
+    if date_from and date_to:
+        return '#ts BETWEEN :from AND :to', {':from': date_from, ':to': date_to}
+    if date_from:
+        return '#ts >= :from', {':from': date_from}
+    if date_to:
+        return '#ts <= :to', {':to': date_to}
+    return None, {}
+
+def query_activities(activity_table, user_id, client_id=None, date_from=None, date_to=None,
+                     limit=ACTIVITY_PAGE_SIZE, cursor=None):
+    """
+    One page of activities, newest first.
+    The range condition is part of the key condition on the client index
+    (with a client_id) or the user's timestamp index, so only items in range
+    are read and a page is never cut short by a filter.
+    """
+    range_condition, values = timestamp_range(date_from, date_to)
+    filters = {'client_id': client_id, 'from': date_from, 'to': date_to}
+    params = {
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+
+    if client_id:
+        key_condition = 'user_client = :uc'
+        values[':uc'] = client_key(user_id, client_id)
+        params['IndexName'] = CLIENT_INDEX
+    else:
+        key_condition = 'user_id = :uid'
+        values[':uid'] = user_id
+        params['IndexName'] = TIMESTAMP_INDEX
+    if range_condition:
+        key_condition += ' AND ' + range_condition
+    params['KeyConditionExpression'] = key_condition
+
+    if range_condition:
+        params['ExpressionAttributeNames'] = {'#ts': 'timestamp'}
+    params['ExpressionAttributeValues'] = values
+
+    start_key = decode_cursor(cursor, user_id, filters)
+    if start_key:
+        params['ExclusiveStartKey'] = start_key
+
+    response = activity_table.query(**params)
+    return {
+        'activities': response.get('Items', []),
+        'next_cursor': encode_cursor(response.get('LastEvaluatedKey'), filters)
+    }
+
+def reindex_activity(dynamodb, user_id, activity):
+    """Queue the activity for the search indexer so its note is searchable; best effort"""
+    try:
+        if not queue_reindex(sqs, user_id, 'activity', activity['activity_id']):
+            from lambda_functions.search_indexer import reindex
+            reindex(dynamodb, None, user_id, 'activity', activity['activity_id'])
+    except Exception as e:
+        print(f"Error updating search index: {str(e)}")
+
+def reindex_imported(user_id, activity_ids):
+    """Queue one written import chunk for the search indexer; best effort"""
+    try:
+        if not queue_reindex_batch(sqs, user_id, 'activity', activity_ids):
+            print(f"No search queue; run search_indexer --rebuild --user {user_id} for imported activities")
+    except Exception as e:
+        print(f"Error queueing imported activities for search: {str(e)}")
+
+def update_note(dynamodb, activity_table, user_id, activity_id, note, updated_at):
+    """Set one activity's note; fails if the activity does not exist"""
+    response = activity_table.update_item(
+        Key={
+            'user_id': user_id,
+            'activity_id': activity_id
+        },
+        UpdateExpression='SET note = :note, updated_at = :updated',
+        ConditionExpression='attribute_exists(activity_id)',
+        ExpressionAttributeValues={
+            ':note': note,
+            ':updated': updated_at
+        },
+        ReturnValues='ALL_NEW'
+    )
+    reindex_activity(dynamodb, user_id, response.get('Attributes', {}))
+
+def update_notes(dynamodb, activity_table, user_id, updates):
+    """
+    Apply a batch of note edits in parallel.
+    BatchWriteItem can only replace whole items, so each edit stays a
+    conditional update_item; the calls just no longer wait on each other.
+    """
+    updated_at = datetime.utcnow().isoformat()
+    missing = activity_table.meta.client.exceptions.ConditionalCheckFailedException
+
+    def apply(update):
+        activity_id = update.get('id') or update.get('activity_id')
+        if not activity_id:
+            return {'id': None, 'ok': False, 'error': 'activity_id required'}
+        try:
+            update_note(dynamodb, activity_table, user_id, activity_id, update.get('note', ''), updated_at)
+            return {'id': activity_id, 'ok': True}
+        except missing:
+            return {'id': activity_id, 'ok': False, 'error': 'Activity not found'}
+        except Exception as e:
+            return {'id': activity_id, 'ok': False, 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=NOTE_WORKERS) as executor:
+        return list(executor.map(apply, updates))
+
 def lambda_handler(event, context):
     """
     Activity Log Lambda - manages user activity history and case notes
     Endpoints:
-    - GET /admin/activity?client_id={id} - Get all activities for a client
+    - GET /admin/activity?client_id={id}&from=&to=&limit=&cursor= - Page through activities
     - POST /admin/note/update - Update note for an activity
+    - POST /admin/note/batch - Update notes for up to 100 activities
+    - POST /admin/activity/import?format=csv|ndjson[&s3_key=] - Bulk import activities
     """
     dynamodb = boto3.resource('dynamodb')
     activity_table = dynamodb.Table('ThreatalyticsActivityLog')
@@ -60,26 +217,34 @@ def lambda_handler(event, context):
         }
     
     http_method = event['httpMethod']
+    path = event.get('path') or event.get('resource') or ''
     
     try:
         if http_method == 'GET':
-            # Get all activities for user
-            client_id = event.get('queryStringParameters', {}).get('client_id', user_id)
-            
-            # Query by user_id
-            response = activity_table.query(
-                KeyConditionExpression='user_id = :uid',
-                ExpressionAttributeValues={':uid': user_id},
-                ScanIndexForward=False,  # Most recent first
-                Limit=100
-            )
-            
-            activities = response.get('Items', [])
-            
-            # Filter by client_id if specified
-            if client_id != user_id:
-                activities = [a for a in activities if a.get('client_id') == client_id]
-            
+            params = event.get('queryStringParameters') or {}
+            client_id = params.get('client_id')
+            if client_id == user_id:
+                client_id = None
+
+            try:
+                limit = min(max(int(params.get('limit', ACTIVITY_PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+                page = query_activities(
+                    activity_table, user_id, client_id,
+                    date_from=params.get('from'), date_to=params.get('to'),
+                    limit=limit, cursor=params.get('cursor')
+                )
+            except ValueError:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                    },
+                    'body': json.dumps({'error': 'Invalid limit or cursor'})
+                }
+            page['count'] = len(page['activities'])
+
             return {
                 'statusCode': 200,
                 'headers': {
@@ -87,9 +252,83 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
                     'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
                 },
-                'body': json.dumps(activities, default=str)
+                'body': json.dumps(page, default=str)
             }
             
+        elif http_method == 'POST' and path.endswith('/activity/import'):
+            params = event.get('queryStringParameters') or {}
+            headers = event.get('headers') or {}
+            fmt = detect_format(params.get('format'), headers.get('Content-Type') or headers.get('content-type'))
+            s3_key = params.get('s3_key')
+
+            if s3_key:
+                # Large files are uploaded to S3 first and streamed from there
+                if not s3_key.startswith(f"imports/{user_id}/"):
+                    return {
+                        'statusCode': 403,
+                        'headers': {
+                            'Access-Control-Allow-Origin': '*',
+                            'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                            'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                        },
+                        'body': json.dumps({'error': 'Imports must be under your imports/ prefix'})
+                    }
+                lines = s3_lines(boto3.client('s3'), IMPORTS_BUCKET, s3_key)
+            elif event.get('body'):
+                lines = body_lines(event['body'], event.get('isBase64Encoded', False))
+            else:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                    },
+                    'body': json.dumps({'error': 'Request body or s3_key required'})
+                }
+
+            report = import_activities(dynamodb, 'ThreatalyticsActivityLog', user_id, lines, fmt,
+                                       on_written=lambda ids: reindex_imported(user_id, ids))
+            print(f"Activity import for {user_id}: {report['imported']}/{report['rows']} rows, {report['rows_per_sec']} rows/sec")
+
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                },
+                'body': json.dumps(report)
+            }
+
+        elif http_method == 'POST' and path.endswith('/note/batch'):
+            body = json.loads(event.get('body') or '{}')
+            updates = body.get('updates')
+
+            if not isinstance(updates, list) or not updates or len(updates) > MAX_NOTE_BATCH:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                    },
+                    'body': json.dumps({'error': f'updates must be a list of 1-{MAX_NOTE_BATCH} items'})
+                }
+
+            results = update_notes(dynamodb, activity_table, user_id, updates)
+            failed = sum(1 for r in results if not r['ok'])
+
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                },
+                'body': json.dumps({'ok': failed == 0, 'updated': len(results) - failed, 'failed': failed, 'results': results})
+            }
+
         elif http_method == 'POST':
             # Update note for an activity
             body = json.loads(event['body'])
@@ -108,7 +347,7 @@ def lambda_handler(event, context):
                 }
             
             # Update the note
-            activity_table.update_item(
+            response = activity_table.update_item(
                 Key={
                     'user_id': user_id,
                     'activity_id': activity_id
@@ -117,8 +356,12 @@ def lambda_handler(event, context):
                 ExpressionAttributeValues={
                     ':note': new_note,
                     ':updated': datetime.utcnow().isoformat()
-                }
+                },
+                ReturnValues='ALL_NEW'
             )
+
+            # Re-index the activity so the new note is searchable
+            reindex_activity(dynamodb, user_id, response.get('Attributes', {}))
             
             return {
                 'statusCode': 200,
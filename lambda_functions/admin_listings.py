@@ -0,0 +1,176 @@
+"""
+Cursor-paginated admin listings for /admin/users and /admin/subscriptions.
+
+Every page is a bounded Query (or Scan) that resumes from the previous
+page's LastEvaluatedKey, so a page costs the same at any table size. The
+key is returned as `next_cursor`, an opaque urlsafe-base64 token. A token
+is only valid for the filters it was issued under.
+
+Orders are fixed by the index being read:
+
+    users                newest first   signup-month-index, walking months back
+    users?plan=          newest first   Users plan-index (plan, created_at)
+    subscriptions?status newest first   Plans status-index (status, created_at)
+    subscriptions?plan=  newest first   Plans plan-index (plan, created_at);
+                                        with status too, plan is a filter on status-index
+    subscriptions        newest first   status-index, one Query per SUBSCRIPTION_STATUSES
+                                        partition, merged on created_at
+
+The unfiltered subscriptions page reads up to `limit` rows from each
+status and keeps the newest `limit`; its cursor holds one position per
+status. Rows without created_at are not in these indexes. Users are backfilled by
+`python -m lambda_functions.user_index --backfill`, Plans rows (and their
+`plan`) by a full `python -m lambda_functions.reconcile_subscriptions` run.
+"""
+import base64
+import heapq
+import json
+from datetime import datetime
+
+from lambda_functions.user_index import SIGNUP_INDEX, MAX_MONTHS_BACK, previous_month
+
+PLAN_INDEX = 'plan-index'
+STATUS_INDEX = 'status-index'
+# Every status written to Plans rows (reconcile_subscriptions.PLANS_ROW_STATUS)
+SUBSCRIPTION_STATUSES = ('active', 'payment_failed', 'cancelled', 'incomplete', 'paused')
+STATUS_INDEX_KEY = ('user_id', 'subscription_id', 'status', 'created_at')
+# The newest-first users walk ends after this many empty months in a row
+EMPTY_MONTHS_TO_STOP = MAX_MONTHS_BACK
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(position, filters):
+    if position is None:
+        return None
+    payload = json.dumps({'p': position, 'f': filters}, sort_keys=True, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(token, filters):
+    """The position stored in `token`, or None for the first page"""
+    if not token:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        position = payload['p']
+    except Exception:
+        raise InvalidCursor('Invalid cursor')
+    if payload.get('f') != filters:
+        raise InvalidCursor('Cursor does not match the current filters')
+    return position
+
+def query_page(table, limit, start_key=None, **kwargs):
+    """(items, LastEvaluatedKey) for one page of a Query"""
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = table.query(Limit=limit, **kwargs)
+    return response.get('Items', []), response.get('LastEvaluatedKey')
+
+def list_users(table, limit=20, plan=None, cursor=None, now=None):
+    """{'users', 'next_cursor'}; newest first, optionally for one plan"""
+    filters = {'plan': plan} if plan else {}
+    position = decode_cursor(cursor, filters)
+
+    if plan:
+        users, last_key = query_page(
+            table, limit, position,
+            IndexName=PLAN_INDEX,
+            KeyConditionExpression='#plan = :plan',
+            ExpressionAttributeNames={'#plan': 'plan'},
+            ExpressionAttributeValues={':plan': plan},
+            ScanIndexForward=False
+        )
+        return {'users': users, 'next_cursor': encode_cursor(last_key, filters)}
+
+    position = position or {'month': (now or datetime.utcnow()).strftime('%Y-%m'), 'key': None}
+    month, start_key = position['month'], position['key']
+    users, empty_months = [], 0
+    while len(users) < limit and empty_months < EMPTY_MONTHS_TO_STOP:
+        items, last_key = query_page(
+            table, limit - len(users), start_key,
+            IndexName=SIGNUP_INDEX,
+            KeyConditionExpression='signup_month = :month',
+            ExpressionAttributeValues={':month': month},
+            ScanIndexForward=False
+        )
+        users.extend(items)
+        empty_months = 0 if items else empty_months + 1
+        if last_key:
+            start_key = last_key
+            continue
+        month, start_key = previous_month(month), None
+
+    done = empty_months >= EMPTY_MONTHS_TO_STOP
+    next_position = None if done else {'month': month, 'key': start_key}
+    return {'users': users, 'next_cursor': encode_cursor(next_position, filters)}
+
+def list_subscriptions(table, limit=50, plan=None, status=None, cursor=None):
+    """{'subscriptions', 'next_cursor'}; see the module docstring for orders"""
+    filters = {k: v for k, v in (('plan', plan), ('status', status)) if v}
+    start_key = decode_cursor(cursor, filters)
+
+    if status:
+        kwargs = {
+            'IndexName': STATUS_INDEX,
+            'KeyConditionExpression': '#status = :status',
+            'ExpressionAttributeNames': {'#status': 'status'},
+            'ExpressionAttributeValues': {':status': status},
+            'ScanIndexForward': False
+        }
+        if plan:
+            # Limit counts rows before the filter, so a page can be short; keep following next_cursor
+            kwargs['FilterExpression'] = '#plan = :plan'
+            kwargs['ExpressionAttributeNames']['#plan'] = 'plan'
+            kwargs['ExpressionAttributeValues'][':plan'] = plan
+        items, last_key = query_page(table, limit, start_key, **kwargs)
+    elif plan:
+        items, last_key = query_page(
+            table, limit, start_key,
+            IndexName=PLAN_INDEX,
+            KeyConditionExpression='#plan = :plan',
+            ExpressionAttributeNames={'#plan': 'plan'},
+            ExpressionAttributeValues={':plan': plan},
+            ScanIndexForward=False
+        )
+    else:
+        items, last_key = newest_subscriptions(table, limit, start_key)
+
+    return {'subscriptions': items, 'next_cursor': encode_cursor(last_key, filters)}
+
+def newest_subscriptions(table, limit, position=None):
+    """
+    (items, next position) across every status, newest first. `position`
+    maps each status not yet exhausted to the key to resume after (None
+    for its first page).
+    """
+    position = position or {status: None for status in SUBSCRIPTION_STATUSES}
+    pages = {}
+    for status, start_key in position.items():
+        pages[status] = query_page(
+            table, limit, start_key,
+            IndexName=STATUS_INDEX,
+            KeyConditionExpression='#status = :status',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':status': status},
+            ScanIndexForward=False
+        )
+
+    # Each page is already newest first, so merging keeps every status's order
+    merged = heapq.merge(*([(item['created_at'], status, n) for n, item in enumerate(items)]
+                           for status, (items, _) in pages.items()), key=lambda entry: entry[0], reverse=True)
+    taken = {status: 0 for status in pages}
+    items = []
+    for _, status, n in merged:
+        if len(items) == limit:
+            break
+        items.append(pages[status][0][n])
+        taken[status] = n + 1
+
+    next_position = {}
+    for status, (page, last_key) in pages.items():
+        if taken[status] < len(page):
+            next_position[status] = ({k: page[taken[status] - 1][k] for k in STATUS_INDEX_KEY}
+                                     if taken[status] else position[status])
+        elif last_key:
+            next_position[status] = last_key
+    return items, next_position or None
@@ -3,6 +3,7 @@ import json
 import boto3
 from datetime import datetime
 from decimal import Decimal
+from lambda_functions.user_index import index_attributes
 
 # Helper class to convert Decimal to float for JSON serialization
 class DecimalEncoder(json.JSONEncoder):
@@ -11,6 +12,28 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj)
         return super(DecimalEncoder, self).default(obj)
 
+def queue_customer_provisioning(dynamodb, email, user_id=None):
+    """
+    Have the Stripe customer created in the background once a signup is
+    confirmed. Never fails the request: users the queue misses are picked up
+    by the backfill or at their first checkout.
+    """
+    try:
+        from lambda_functions.customer_provisioning import enqueue
+        if not user_id:
+            items = dynamodb.Table('ThreatalyticsUsers').query(
+                IndexName='email-index',
+                KeyConditionExpression='email = :email',
+                ExpressionAttributeValues={':email': email},
+                ProjectionExpression='user_id'
+            ).get('Items', [])
+            if not items:
+                return
+            user_id = items[0]['user_id']
+        enqueue(boto3.client('sqs'), user_id, email)
+    except Exception as e:
+        print(f"Could not queue Stripe customer provisioning for {email}: {e}")
+
 def lambda_handler(event, context):
     """
     Authentication Lambda - handles login, signup, token refresh
@@ -45,13 +68,16 @@ def lambda_handler(event, context):
             
             # Create user profile in DynamoDB
             users_table = dynamodb.Table('ThreatalyticsUsers')
+            created_at = datetime.utcnow().isoformat()
             users_table.put_item(Item={
                 'user_id': response['UserSub'],
                 'email': email,
                 'name': name,
                 'plan': 'free',
-                'created_at': datetime.utcnow().isoformat(),
-                'conversation_count': 0
+                'created_at': created_at,
+                'conversation_count': 0,
+                # Keys of the admin signup-month and email-prefix indexes
+                **index_attributes(email, created_at)
             })
 
             # Auto-confirm the user's email if auto_confirm flag is set
@@ -60,6 +86,7 @@ def lambda_handler(event, context):
                     UserPoolId=user_pool_id,
                     Username=email
                 )
+                queue_customer_provisioning(dynamodb, email, response['UserSub'])
             
             return {
                 'statusCode': 200,
@@ -85,6 +112,7 @@ def lambda_handler(event, context):
                     Username=email,
                     ConfirmationCode=code
                 )
+                queue_customer_provisioning(dynamodb, email)
                 
                 return {
                     'statusCode': 200,
@@ -0,0 +1,306 @@
+"""
+Bulk redaction of a folder of incident files.
+
+    python -m lambda_functions.bulk_redact s3://bucket/incoming/district-12/ s3://bucket/redacted/district-12/
+    python -m lambda_functions.bulk_redact ./incoming ./redacted --mode local --workers 8
+
+Input and output are S3 prefixes or local directories. Objects are listed
+lazily and streamed through extract -> redact -> write on a bounded thread
+pool, so memory holds only the files in flight. Each file is redacted with
+redact_chunked, so placeholders ([PERSON_1], ...) are consistent within a
+file.
+
+Progress lives in <output>/_manifest.json: one entry per input file with
+status, source fingerprint, per-stage timings and, in hybrid/llm mode, the
+number of model-listed entities that could not be located in the text.
+It is rewritten every --checkpoint-every files and at the end; a rerun
+with the same output skips files whose entry is 'ok' and whose source has
+not changed.
+"""
+import argparse
+import io
+import json
+import os
+import re
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+from lambda_functions.pii_redaction import redact_chunked, find_entities
+
+try:
+    import PyPDF2
+except ImportError:
+    PyPDF2 = None
+
+MANIFEST_KEY = '_manifest.json'
+TEXT_EXTENSIONS = ('.txt', '.md', '.csv', '.log', '.json', '.ndjson', '.eml')
+MAX_FILE_BYTES = 50 * 1024 * 1024
+DEFAULT_WORKERS = 8
+CHECKPOINT_EVERY = 50
+
+class UnsupportedFile(Exception):
+    pass
+
+def within(location, root):
+    """True if location is root or below it, comparing whole path components"""
+    if root.startswith('s3://') or location.startswith('s3://'):
+        root = root.rstrip('/') + '/'
+        return (location.rstrip('/') + '/').startswith(root)
+    return os.path.commonpath([location, root]) == root
+
+class LocalStore:
+    """Files under a directory; keys are '/'-separated paths relative to it"""
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def list(self, exclude=None):
+        """Yield (key, fingerprint) for every file, in sorted order"""
+        for directory, dirs, files in os.walk(self.root):
+            if exclude and within(os.path.abspath(directory), exclude):
+                dirs[:] = []
+                continue
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                yield os.path.relpath(path, self.root).replace(os.sep, '/'), f'{stat.st_size}-{int(stat.st_mtime)}'
+
+    def read(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data, content_type=None):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so an interrupted run never leaves half a manifest
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def location(self):
+        return self.root
+
+class S3Store:
+    def __init__(self, bucket, prefix, s3_client=None):
+        if s3_client is None:
+            import boto3
+            s3_client = boto3.client('s3')
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix if not prefix or prefix.endswith('/') else prefix + '/'
+
+    def list(self, exclude=None):
+        paginator = self.s3.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith('/') or (exclude and within(f"s3://{self.bucket}/{obj['Key']}", exclude)):
+                    continue
+                yield obj['Key'][len(self.prefix):], obj['ETag'].strip('"')
+
+    def read(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)['Body'].read()
+
+    def write(self, key, data, content_type='text/plain; charset=utf-8'):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data, ContentType=content_type)
+
+    def location(self):
+        return f's3://{self.bucket}/{self.prefix}'
+
+def open_store(uri, s3_client=None):
+    """s3://bucket/prefix or a local directory"""
+    if uri.startswith('s3://'):
+        bucket, _, prefix = uri[5:].partition('/')
+        return S3Store(bucket, prefix, s3_client)
+    return LocalStore(uri)
+
+def extract_text(key, data):
+    """Plain text, PDF (PyPDF2) or DOCX; anything else raises UnsupportedFile"""
+    name = key.lower()
+    if name.endswith(TEXT_EXTENSIONS):
+        return data.decode('utf-8-sig', errors='replace')
+    if name.endswith('.pdf'):
+        if not PyPDF2:
+            raise UnsupportedFile('PyPDF2 not available')
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        return '\n\n'.join(page.extract_text() or '' for page in reader.pages)
+    if name.endswith('.docx'):
+        with zipfile.ZipFile(io.BytesIO(data)) as docx:
+            xml = docx.read('word/document.xml').decode('utf-8')
+        paragraphs = re.split(r'</w:p>', xml)
+        return '\n'.join(''.join(re.findall(r'<w:t[^>]*>([^<]*)</w:t>', p)) for p in paragraphs).strip()
+    raise UnsupportedFile(f'Unsupported file type: {key}')
+
+def output_key(key):
+    """Redacted text keeps text keys as they are and appends .txt to the rest"""
+    return key if key.lower().endswith(TEXT_EXTENSIONS) else key + '.txt'
+
+def local_finder(unmatched):
+    """Finder for --mode local: patterns only, nothing is ever unmatched"""
+    return find_entities
+
+def redact_file(source, destination, key, fingerprint, finder, chunk_chars, concurrency):
+    """One file end to end; returns its manifest entry and never raises"""
+    entry = {'key': key, 'fingerprint': fingerprint}
+    started = time.time()
+    unmatched = []
+    try:
+        data = source.read(key)
+        if len(data) > MAX_FILE_BYTES:
+            raise UnsupportedFile(f'File exceeds {MAX_FILE_BYTES} bytes')
+        text = extract_text(key, data)
+        extracted = time.time()
+
+        redacted, entities, chunks = redact_chunked(text, finder(unmatched), chunk_chars, concurrency)
+        redacted_at = time.time()
+
+        destination.write(output_key(key), redacted.encode('utf-8'))
+        entry.update({
+            'status': 'ok',
+            'output_key': output_key(key),
+            'bytes_in': len(data),
+            'chars': len(text),
+            'chunks': chunks,
+            'entities': entities,
+            'unmatched_entities': len(unmatched),
+            'extract_ms': int((extracted - started) * 1000),
+            'redact_ms': int((redacted_at - extracted) * 1000),
+            'write_ms': int((time.time() - redacted_at) * 1000)
+        })
+    except UnsupportedFile as e:
+        entry.update({'status': 'skipped', 'error': str(e)})
+    except Exception as e:
+        entry.update({'status': 'error', 'error': str(e)})
+    entry['total_ms'] = int((time.time() - started) * 1000)
+    return entry
+
+def load_manifest(destination):
+    try:
+        return json.loads(destination.read(MANIFEST_KEY))
+    except Exception:
+        return None
+
+def summarize(files):
+    totals = {'files': len(files), 'ok': 0, 'skipped': 0, 'error': 0, 'bytes_in': 0, 'entities': {},
+              'unmatched_entities': 0}
+    for entry in files.values():
+        totals[entry['status']] += 1
+        totals['bytes_in'] += entry.get('bytes_in', 0)
+        totals['unmatched_entities'] += entry.get('unmatched_entities', 0)
+        for label, count in entry.get('entities', {}).items():
+            totals['entities'][label] = totals['entities'].get(label, 0) + count
+    return totals
+
+def run_job(source, destination, finder=local_finder, mode='local', workers=DEFAULT_WORKERS,
+            chunk_chars=6000, concurrency=1, checkpoint_every=CHECKPOINT_EVERY):
+    """
+    Redact every file under `source` into `destination`, resuming from the
+    destination's manifest. finder(unmatched) returns the per-chunk entity
+    finder for one file. Returns the manifest.
+    """
+    previous = load_manifest(destination) or {}
+    files = {entry['key']: entry for entry in previous.get('files', [])}
+    manifest = {
+        'input': source.location(),
+        'output': destination.location(),
+        'mode': mode,
+        'started_at': previous.get('started_at') or datetime.utcnow().isoformat(),
+        'runs': previous.get('runs', 0) + 1,
+        'complete': False
+    }
+
+    def checkpoint():
+        manifest['files'] = [files[key] for key in sorted(files)]
+        manifest['totals'] = summarize(files)
+        destination.write(MANIFEST_KEY, json.dumps(manifest, indent=1).encode('utf-8'), 'application/json')
+
+    # Never read our own output back when it sits under the input
+    exclude = destination.location() if within(destination.location(), source.location()) else None
+    run_started = time.time()
+    processed = resumed = 0
+    pending = set()
+
+    def collect(limit):
+        nonlocal processed
+        while len(pending) > limit:
+            done, remaining = wait(pending, return_when=FIRST_COMPLETED)
+            pending.intersection_update(remaining)
+            for future in done:
+                entry = future.result()
+                files[entry['key']] = entry
+                processed += 1
+                if processed % checkpoint_every == 0:
+                    checkpoint()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for key, fingerprint in source.list(exclude=exclude):
+            if key == MANIFEST_KEY:
+                continue
+            done = files.get(key)
+            if done and done['status'] == 'ok' and done.get('fingerprint') == fingerprint:
+                resumed += 1
+                continue
+            # Bounded queue: listing never runs far ahead of the workers
+            collect(workers * 2 - 1)
+            pending.add(executor.submit(redact_file, source, destination, key, fingerprint,
+                                        finder, chunk_chars, concurrency))
+        collect(0)
+
+    elapsed = time.time() - run_started
+    manifest.update({
+        'complete': True,
+        'finished_at': datetime.utcnow().isoformat(),
+        'last_run': {
+            'processed': processed,
+            'skipped_as_done': resumed,
+            'elapsed_sec': round(elapsed, 2),
+            'files_per_sec': round(processed / elapsed, 2) if elapsed > 0 else processed
+        }
+    })
+    checkpoint()
+    return manifest
+
+def model_finder(mode, client_openai=None):
+    """hybrid/llm: the same per-chunk finder /redact uses, with a key from the environment"""
+    from lambda_functions.redact import chunk_finder
+
+    if client_openai is None:
+        from openai import OpenAI
+        api_key = os.environ.get('OPENAI_API_KEY')
+        if not api_key:
+            import boto3
+            secret = boto3.client('secretsmanager').get_secret_value(SecretId=os.environ['OPENAI_SECRET'])
+            api_key = json.loads(secret['SecretString'])['api_key']
+        client_openai = OpenAI(api_key=api_key)
+
+    def finder(unmatched):
+        return chunk_finder(client_openai, mode, unmatched)
+    return finder
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Redact every file under an S3 prefix or directory')
+    parser.add_argument('input', help='s3://bucket/prefix/ or a local directory')
+    parser.add_argument('output', help='s3://bucket/prefix/ or a local directory')
+    parser.add_argument('--mode', choices=('local', 'hybrid', 'llm'), default='local')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='files in parallel')
+    parser.add_argument('--concurrency', type=int, default=1, help='chunks in parallel within a file')
+    parser.add_argument('--chunk-chars', type=int, default=6000)
+    parser.add_argument('--checkpoint-every', type=int, default=CHECKPOINT_EVERY)
+    args = parser.parse_args(argv)
+
+    finder = local_finder if args.mode == 'local' else model_finder(args.mode)
+    manifest = run_job(
+        open_store(args.input), open_store(args.output), finder=finder, mode=args.mode,
+        workers=args.workers, chunk_chars=args.chunk_chars, concurrency=args.concurrency,
+        checkpoint_every=args.checkpoint_every
+    )
+    totals, run = manifest['totals'], manifest['last_run']
+    print(f"{run['processed']} processed, {run['skipped_as_done']} already done in {run['elapsed_sec']}s "
+          f"({run['files_per_sec']} files/s); ok {totals['ok']}, skipped {totals['skipped']}, error {totals['error']}")
+    if totals['unmatched_entities']:
+        print(f"{totals['unmatched_entities']} model-listed entities were not found in the text; see the manifest")
+    print(f"Manifest: {args.output.rstrip('/')}/{MANIFEST_KEY}")
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,52 @@ import boto3
 from datetime import datetime
 import uuid
 import base64
+import gzip
+import math
+from decimal import Decimal
+from lambda_functions.search_index import queue_reindex
+from lambda_functions.etags import (
+    bump_version, get_version, make_etag, query_fingerprint, etag_matches, cache_headers, not_modified
+)
+
+# GSI on (user_id, updated_at) so listings are ordered by activity, not by UUID
+UPDATED_INDEX = 'user-updated-index'
+SUMMARY_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+PREVIEW_LENGTH = 160
+
+# Message storage codec: bodies above COMPRESS_THRESHOLD bytes are gzipped into
+# a binary attribute; compressed bodies above OFFLOAD_THRESHOLD go to S3 and
+# only a pointer stays in the item (DynamoDB items are capped at 400 KB).
+CONVERSATIONS_BUCKET = os.environ.get('S3_BUCKET', 'threatalytics-documents')
+COMPRESS_THRESHOLD = int(os.environ.get('CONVERSATION_COMPRESS_THRESHOLD', '1024'))
+OFFLOAD_THRESHOLD = int(os.environ.get('CONVERSATION_OFFLOAD_THRESHOLD', '65536'))
+
+# Delta sync: a conversation's version is its message_count, so the messages
+# newer than version N are exactly messages[N:]. Appends are conditional on
+# the client's base version, so two tabs can't silently overwrite each other.
+SYNC_PAGE_SIZE = 50
+
+sqs = boto3.client('sqs')
+
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return int(obj) if obj % 1 == 0 else float(obj)
+        return super(DecimalEncoder, self).default(obj)
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+    'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
+}
+
+def make_response(status, body, headers=None):
+    return {
+        'statusCode': status,
+        'headers': {**CORS_HEADERS, **headers} if headers else CORS_HEADERS,
+        'body': json.dumps(body, cls=DecimalEncoder)
+    }
 
 def get_user_id_from_token(event):
     """Extract user_id from JWT token in Authorization header"""
@@ -39,32 +85,387 @@ def get_user_id_from_token(event):
         print(f"Error extracting user_id: {str(e)}")
         return None
 
+def get_conversation_id(event):
+    """Read the conversation id from the path (/conversations/{id})"""
+    params = event.get('pathParameters') or {}
+    return params.get('id') or params.get('conversation_id')
+
+def encode_cursor(last_evaluated_key):
+    """Wrap a DynamoDB LastEvaluatedKey into an opaque URL-safe token"""
+    if not last_evaluated_key:
+        return None
+    raw = json.dumps(last_evaluated_key, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, user_id):
+    """Unwrap a cursor token; rejects tokens that belong to another user"""
+    if not cursor:
+        return None
+    padded = cursor + '=' * (-len(cursor) % 4)
+    key = json.loads(base64.urlsafe_b64decode(padded))
+    if not isinstance(key, dict) or key.get('user_id') != user_id:
+        raise ValueError('Invalid cursor')
+    return key
+
+def binary_value(value):
+    """DynamoDB returns Binary wrappers; S3/gzip want raw bytes"""
+    return value.value if hasattr(value, 'value') else bytes(value)
+
+def capacity_units(size_bytes, unit_size):
+    return max(1, math.ceil(size_bytes / unit_size))
+
+def encode_messages(s3_client, user_id, conversation_id, messages, start_index=0, write_id=None):
+    """
+    Prepare messages for storage. Returns the stored form plus byte counts
+    (raw vs stored) for the compression metrics. start_index is the position
+    of the first message in the conversation and write_id, when given, makes
+    the S3 keys unique to this write (an append that loses its version check
+    must not overwrite the winner's objects).
+    """
+    encoded = []
+    raw_bytes = 0
+    stored_bytes = 0
+
+    for index, message in enumerate(messages, start=start_index):
+        content = message.get('content')
+        if not isinstance(content, str):
+            encoded.append(message)
+            continue
+
+        body = content.encode('utf-8')
+        raw_bytes += len(body)
+
+        if len(body) <= COMPRESS_THRESHOLD:
+            encoded.append(message)
+            stored_bytes += len(body)
+            continue
+
+        compressed = gzip.compress(body)
+        stored = {k: v for k, v in message.items() if k != 'content'}
+        stored['encoding'] = 'gzip'
+
+        if len(compressed) > OFFLOAD_THRESHOLD:
+            name = f"{index}-{write_id}" if write_id else str(index)
+            key = f"conversations/{user_id}/{conversation_id}/{name}.gz"
+            s3_client.put_object(
+                Bucket=CONVERSATIONS_BUCKET,
+                Key=key,
+                Body=compressed,
+                ContentType='application/gzip'
+            )
+            stored['content_ref'] = {'bucket': CONVERSATIONS_BUCKET, 'key': key}
+            stored_bytes += len(key)
+        else:
+            stored['content_z'] = compressed
+            stored_bytes += len(compressed)
+
+        encoded.append(stored)
+
+    return encoded, raw_bytes, stored_bytes
+
+def decode_messages(s3_client, messages):
+    """Inverse of encode_messages: restore plain-text content on read"""
+    decoded = []
+    for message in messages or []:
+        if message.get('encoding') != 'gzip':
+            decoded.append(message)
+            continue
+
+        if 'content_ref' in message:
+            ref = message['content_ref']
+            obj = s3_client.get_object(Bucket=ref['bucket'], Key=ref['key'])
+            compressed = obj['Body'].read()
+        else:
+            compressed = binary_value(message['content_z'])
+
+        plain = {k: v for k, v in message.items() if k not in ('content_z', 'content_ref', 'encoding')}
+        plain['content'] = gzip.decompress(compressed).decode('utf-8')
+        decoded.append(plain)
+    return decoded
+
+def delete_offloaded_messages(s3_client, messages):
+    for message in messages or []:
+        ref = message.get('content_ref')
+        if ref:
+            try:
+                s3_client.delete_object(Bucket=ref['bucket'], Key=ref['key'])
+            except Exception as e:
+                print(f"Error deleting offloaded message {ref.get('key')}: {str(e)}")
+
+def log_storage_metrics(raw_bytes, stored_bytes):
+    """
+    Emit compression ratio and write-capacity savings as CloudWatch
+    embedded metrics (one JSON log line, no extra API calls).
+    """
+    wcu_raw = capacity_units(raw_bytes, 1024)
+    wcu_stored = capacity_units(stored_bytes, 1024)
+    rcu_raw = capacity_units(raw_bytes, 4096)
+    rcu_stored = capacity_units(stored_bytes, 4096)
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(datetime.utcnow().timestamp() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': 'Threatalytics/Conversations',
+                'Dimensions': [[]],
+                'Metrics': [
+                    {'Name': 'RawBytes', 'Unit': 'Bytes'},
+                    {'Name': 'StoredBytes', 'Unit': 'Bytes'},
+                    {'Name': 'CompressionRatio', 'Unit': 'None'},
+                    {'Name': 'WCUSaved', 'Unit': 'Count'},
+                    {'Name': 'RCUSaved', 'Unit': 'Count'}
+                ]
+            }]
+        },
+        'RawBytes': raw_bytes,
+        'StoredBytes': stored_bytes,
+        'CompressionRatio': round(raw_bytes / stored_bytes, 2) if stored_bytes else 1.0,
+        'WCUSaved': wcu_raw - wcu_stored,
+        'RCUSaved': rcu_raw - rcu_stored
+    }))
+
+def get_messages_since(conversations_table, s3_client, user_id, conversation_id, since):
+    """
+    Read only the messages after position `since` by projecting individual
+    list elements, so a resumed conversation never re-downloads its history.
+    """
+    indexes = range(since, since + SYNC_PAGE_SIZE)
+    response = conversations_table.get_item(
+        Key={'user_id': user_id, 'conversation_id': conversation_id},
+        ProjectionExpression=', '.join(['message_count'] + [f'#m[{i}]' for i in indexes]),
+        ExpressionAttributeNames={'#m': 'messages'}
+    )
+
+    if 'Item' not in response:
+        return None
+
+    item = response['Item']
+    version = int(item.get('message_count', 0))
+    messages = decode_messages(s3_client, item.get('messages'))
+
+    return {
+        'conversation_id': conversation_id,
+        'version': version,
+        'messages': messages,
+        'has_more': version > since + len(messages)
+    }
+
+def append_messages(dynamodb, conversations_table, s3_client, user_id, conversation_id, body):
+    """
+    Append new messages if the stored version still equals the client's
+    base_version. Creates the conversation when base_version is 0.
+    """
+    try:
+        base_version = int(body.get('base_version', 0))
+        if base_version < 0:
+            raise ValueError(base_version)
+    except (TypeError, ValueError):
+        return make_response(400, {'error': 'base_version must be a non-negative integer'})
+    new_messages = body.get('messages', [])
+    mode = body.get('mode') or 'analyze'
+    now = datetime.utcnow().isoformat()
+
+    stored_messages, raw_bytes, stored_bytes = encode_messages(
+        s3_client, user_id, conversation_id, new_messages, start_index=base_version, write_id=uuid.uuid4().hex
+    )
+    log_storage_metrics(raw_bytes, stored_bytes)
+
+    if base_version == 0:
+        condition = 'attribute_not_exists(message_count) OR message_count = :base'
+    else:
+        condition = 'message_count = :base'
+
+    try:
+        response = conversations_table.update_item(
+            Key={'user_id': user_id, 'conversation_id': conversation_id},
+            UpdateExpression=(
+                'SET #m = list_append(if_not_exists(#m, :empty), :new), '
+                'message_count = if_not_exists(message_count, :zero) + :n, '
+                'updated_at = :now, '
+                '#mode = if_not_exists(#mode, :mode), '
+                'title = if_not_exists(title, :title), '
+                'preview = if_not_exists(preview, :preview), '
+                'created_at = if_not_exists(created_at, :now)'
+            ),
+            ConditionExpression=condition,
+            ExpressionAttributeNames={'#m': 'messages', '#mode': 'mode'},
+            ExpressionAttributeValues={
+                ':new': stored_messages,
+                ':empty': [],
+                ':zero': 0,
+                ':n': len(new_messages),
+                ':base': base_version,
+                ':now': now,
+                ':mode': mode,
+                ':title': body.get('title') or f"{mode.title()} - {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}",
+                ':preview': build_preview(new_messages)
+            },
+            ReturnValues='UPDATED_NEW'
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # Another tab appended first: drop the objects this write offloaded
+        # and hand back what this client is missing
+        delete_offloaded_messages(s3_client, stored_messages)
+        current = get_messages_since(conversations_table, s3_client, user_id, conversation_id, base_version)
+        return make_response(409, {
+            'error': 'Version conflict',
+            'conversation_id': conversation_id,
+            'version': current['version'] if current else 0,
+            'messages': current['messages'] if current else []
+        })
+
+    bump_version(dynamodb, user_id, 'conversations')
+    update_search_index(dynamodb, s3_client, user_id, conversation_id)
+
+    return make_response(200, {
+        'message': 'Conversation synced',
+        'conversation_id': conversation_id,
+        'version': int(response['Attributes']['message_count'])
+    })
+
+def update_search_index(dynamodb, s3_client, user_id, conversation_id):
+    """
+    Have the search indexer re-read this conversation (inline when no queue
+    is configured); never fail the request over it
+    """
+    try:
+        if not queue_reindex(sqs, user_id, 'conversation', conversation_id):
+            from lambda_functions.search_indexer import reindex
+            reindex(dynamodb, s3_client, user_id, 'conversation', conversation_id)
+    except Exception as e:
+        print(f"Error updating search index: {str(e)}")
+
+def build_preview(messages):
+    """Short snippet of the first user message, shown in the History list"""
+    for message in messages:
+        if message.get('role') == 'user' and message.get('content'):
+            text = ' '.join(str(message['content']).split())
+            if len(text) > PREVIEW_LENGTH:
+                return text[:PREVIEW_LENGTH].rstrip() + '...'
+            return text
+    return ''
+
+def list_conversation_summaries(conversations_table, user_id, params):
+    """
+    Page through the user's conversations, most recently updated first,
+    reading only the summary attributes (never the message bodies).
+    """
+    try:
+        limit = max(1, min(int(params.get('limit', SUMMARY_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        limit = SUMMARY_PAGE_SIZE
+
+    query_args = {
+        'IndexName': UPDATED_INDEX,
+        'KeyConditionExpression': 'user_id = :uid',
+        'ExpressionAttributeValues': {':uid': user_id},
+        'ProjectionExpression': '#cid, #title, #mode, #updated, #count, #preview, #created',
+        'ExpressionAttributeNames': {
+            '#cid': 'conversation_id',
+            '#title': 'title',
+            '#mode': 'mode',
+            '#updated': 'updated_at',
+            '#count': 'message_count',
+            '#preview': 'preview',
+            '#created': 'created_at'
+        },
+        'ScanIndexForward': False,  # Most recently active first
+        'Limit': limit
+    }
+
+    start_key = decode_cursor(params.get('cursor'), user_id)
+    if start_key:
+        query_args['ExclusiveStartKey'] = start_key
+
+    response = conversations_table.query(**query_args)
+
+    return {
+        'conversations': response.get('Items', []),
+        'next_cursor': encode_cursor(response.get('LastEvaluatedKey'))
+    }
+
 def lambda_handler(event, context):
     """
     Conversations Lambda - manages user conversation history
+    Endpoints:
+    - GET /conversations - List conversations (full items, legacy)
+    - GET /conversations?view=summary&limit=N&cursor=... - Paginated summaries
+    - GET /conversations/{id} - Get one conversation with its messages
+    - GET /conversations/{id}/sync?since=N - Messages newer than version N
+    - POST /conversations/{id}/sync - Append new messages at base_version
+    - POST /conversations - Save/update a conversation
+    - DELETE /conversations/{id} - Delete a conversation
     """
     dynamodb = boto3.resource('dynamodb')
     conversations_table = dynamodb.Table('ThreatalyticsConversations')
+    s3_client = boto3.client('s3')
     
     # Get user ID from token
     user_id = get_user_id_from_token(event)
     
     if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
-            },
-            'body': json.dumps({'message': 'Unauthorized'})
-        }
+        return make_response(401, {'message': 'Unauthorized'})
     
     # Parse request
     http_method = event['httpMethod']
+    params = event.get('queryStringParameters') or {}
     
+    is_sync = event.get('path', '').endswith('/sync')
+
     try:
         if http_method == 'GET':
+            # Every GET is a function of the user's conversations version and the request
+            etag = make_etag(
+                'conversations', user_id, get_version(dynamodb, user_id, 'conversations'),
+                event.get('path', ''), query_fingerprint(event)
+            )
+            if etag_matches(event, etag):
+                return not_modified(CORS_HEADERS, etag)
+
+        if is_sync and http_method == 'GET':
+            try:
+                since = max(0, int(params.get('since', 0)))
+            except (TypeError, ValueError):
+                return make_response(400, {'error': 'since must be an integer'})
+
+            delta = get_messages_since(
+                conversations_table, s3_client, user_id, get_conversation_id(event), since
+            )
+            if delta is None:
+                return make_response(404, {'error': 'Conversation not found'})
+
+            return make_response(200, delta, cache_headers(etag))
+
+        elif is_sync and http_method == 'POST':
+            body = json.loads(event.get('body') or '{}')
+            return append_messages(
+                dynamodb, conversations_table, s3_client, user_id, get_conversation_id(event), body
+            )
+
+        elif http_method == 'GET' and get_conversation_id(event):
+            # Get a single conversation with its messages
+            response = conversations_table.get_item(Key={
+                'user_id': user_id,
+                'conversation_id': get_conversation_id(event)
+            })
+
+            if 'Item' not in response:
+                return make_response(404, {'error': 'Conversation not found'})
+
+            conversation = response['Item']
+            conversation['messages'] = decode_messages(s3_client, conversation.get('messages'))
+            conversation['version'] = int(conversation.get('message_count', len(conversation['messages'])))
+
+            return make_response(200, {'conversation': conversation}, cache_headers(etag))
+
+        elif http_method == 'GET' and params.get('view') == 'summary':
+            try:
+                return make_response(
+                    200, list_conversation_summaries(conversations_table, user_id, params), cache_headers(etag)
+                )
+            except ValueError:
+                return make_response(400, {'error': 'Invalid cursor'})
+
+        elif http_method == 'GET':
             # Get all conversations for user
             response = conversations_table.query(
                 KeyConditionExpression='user_id = :uid',
@@ -73,17 +474,13 @@ def lambda_handler(event, context):
                 Limit=50
             )
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
-                },
-                'body': json.dumps({
-                    'conversations': response.get('Items', [])
-                })
-            }
+            conversations = response.get('Items', [])
+            for conversation in conversations:
+                conversation['messages'] = decode_messages(s3_client, conversation.get('messages'))
+
+            return make_response(200, {
+                'conversations': conversations
+            }, cache_headers(etag))
             
         elif http_method == 'POST':
             # Save/update conversation
@@ -93,59 +490,48 @@ def lambda_handler(event, context):
             mode = body.get('mode')
             messages = body.get('messages', [])
             title = body.get('title', f"{mode.title()} - {datetime.utcnow().strftime('%Y-%m-%d %H:%M')}")
+
+            stored_messages, raw_bytes, stored_bytes = encode_messages(
+                s3_client, user_id, conversation_id, messages
+            )
+            log_storage_metrics(raw_bytes, stored_bytes)
             
             conversations_table.put_item(Item={
                 'user_id': user_id,
                 'conversation_id': conversation_id,
                 'mode': mode,
                 'title': title,
-                'messages': messages,
+                'messages': stored_messages,
+                'preview': build_preview(messages),
                 'created_at': body.get('created_at', datetime.utcnow().isoformat()),
                 'updated_at': datetime.utcnow().isoformat(),
                 'message_count': len(messages)
             })
+            bump_version(dynamodb, user_id, 'conversations')
+            update_search_index(dynamodb, s3_client, user_id, conversation_id)
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
-                },
-                'body': json.dumps({
-                    'message': 'Conversation saved',
-                    'conversation_id': conversation_id
-                })
-            }
+            return make_response(200, {
+                'message': 'Conversation saved',
+                'conversation_id': conversation_id,
+                'version': len(messages)
+            })
             
         elif http_method == 'DELETE':
             # Delete conversation
-            conversation_id = event['pathParameters']['conversation_id']
+            conversation_id = get_conversation_id(event)
             
-            conversations_table.delete_item(
+            response = conversations_table.delete_item(
                 Key={
                     'user_id': user_id,
                     'conversation_id': conversation_id
-                }
+                },
+                ReturnValues='ALL_OLD'
             )
+            delete_offloaded_messages(s3_client, response.get('Attributes', {}).get('messages'))
+            bump_version(dynamodb, user_id, 'conversations')
+            update_search_index(dynamodb, s3_client, user_id, conversation_id)
             
-            return {
-                'statusCode': 200,
-                'headers': {
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                    'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
-                },
-                'body': json.dumps({'message': 'Conversation deleted'})
-            }
+            return make_response(200, {'message': 'Conversation deleted'})
             
     except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
-                'Access-Control-Allow-Methods': 'GET,POST,DELETE,OPTIONS'
-            },
-            'body': json.dumps({'error': str(e)})
-        }
+        return make_response(500, {'error': str(e)})
@@ -0,0 +1,156 @@
+"""
+Stripe customers created ahead of checkout.
+
+auth.py queues {user_id, email} when a signup is confirmed. worker_handler
+creates the Stripe customer and stores stripe_customer_id on the user, so
+/subscription/create only has to create the Checkout Session.
+Customer.create uses the idempotency key customer-<user_id>, which means a
+redelivered message, the worker and an inline fallback in
+subscription_manager never create two customers for one user.
+
+Users confirmed before this existed are backfilled from a workstation:
+
+    python -m lambda_functions.customer_provisioning [--dry-run] [--segments 4]
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import stripe
+
+from lambda_functions.stripe_customers import remember_customer
+
+USERS_TABLE = os.environ.get('USERS_TABLE', 'ThreatalyticsUsers')
+PROVISION_QUEUE_URL = os.environ.get('CUSTOMER_PROVISION_QUEUE_URL', '')
+
+dynamodb = boto3.resource('dynamodb')
+
+def load_stripe_key():
+    """Secrets Manager (STRIPE_SECRET_NAME) first, then STRIPE_SECRET_KEY"""
+    secret_name = os.environ.get('STRIPE_SECRET_NAME')
+    if secret_name:
+        try:
+            secret = boto3.client('secretsmanager').get_secret_value(SecretId=secret_name).get('SecretString') or ''
+            try:
+                parsed = json.loads(secret)
+                key = parsed.get('STRIPE_SECRET_KEY') or parsed.get('stripe_secret_key') or parsed.get('api_key')
+            except ValueError:
+                key = secret.strip()
+            if key:
+                return key
+        except Exception as e:
+            print(f"Could not read secret {secret_name} from Secrets Manager: {e}")
+    return os.environ.get('STRIPE_SECRET_KEY')
+
+def enqueue(sqs, user_id, email):
+    """Queue provisioning for a confirmed user; returns False if there is no queue"""
+    if not PROVISION_QUEUE_URL:
+        return False
+    sqs.send_message(QueueUrl=PROVISION_QUEUE_URL, MessageBody=json.dumps({'user_id': user_id, 'email': email}))
+    return True
+
+def provision_customer(user_id, email=None, name=None):
+    """
+    The user's Stripe customer id, creating the customer if the user has none.
+    None if the user no longer exists. Safe to call more than once and from
+    several places at the same time.
+    """
+    users_table = dynamodb.Table(USERS_TABLE)
+    user = users_table.get_item(Key={'user_id': user_id}).get('Item')
+    if not user:
+        return None
+    if user.get('stripe_customer_id'):
+        return user['stripe_customer_id']
+    email = email or user.get('email')
+    if not email:
+        raise ValueError(f'No email for user {user_id}')
+
+    customer = stripe.Customer.create(
+        email=email,
+        name=name or user.get('name'),
+        metadata={'user_id': user_id},
+        idempotency_key=f'customer-{user_id}'
+    )
+    try:
+        users_table.update_item(
+            Key={'user_id': user_id},
+            UpdateExpression='SET stripe_customer_id = :cid',
+            ConditionExpression='attribute_not_exists(stripe_customer_id)',
+            ExpressionAttributeValues={':cid': customer.id}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # Someone stored it first; the idempotency key made it the same customer
+        pass
+    remember_customer(dynamodb, customer.id, user_id)
+    return customer.id
+
+def worker_handler(event, context):
+    """SQS consumer for auth.py's provisioning messages"""
+    if not stripe.api_key:
+        stripe.api_key = load_stripe_key()
+    failures = []
+    for record in event.get('Records', []):
+        try:
+            message = json.loads(record['body'])
+            customer_id = provision_customer(message['user_id'], message.get('email'))
+            if customer_id:
+                print(f"Stripe customer {customer_id} ready for {message['user_id']}")
+            else:
+                print(f"User {message['user_id']} no longer exists; nothing to provision")
+        except Exception as e:
+            print(f"Provisioning failed for message {record['messageId']}: {e}")
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+def users_without_customer(segment, segments):
+    """Yield (user_id, email) for users that have no stripe_customer_id"""
+    kwargs = {
+        'ProjectionExpression': 'user_id, email',
+        'FilterExpression': 'attribute_not_exists(stripe_customer_id) AND attribute_exists(email)',
+        'Segment': segment,
+        'TotalSegments': segments
+    }
+    table = dynamodb.Table(USERS_TABLE)
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get('Items', []):
+            yield item['user_id'], item['email']
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def backfill(segments=4, dry_run=False):
+    """Provision every user without a customer; returns (provisioned, failed)"""
+    stripe.api_key = stripe.api_key or load_stripe_key()
+
+    def run_segment(segment):
+        done = failed = 0
+        for user_id, email in users_without_customer(segment, segments):
+            if dry_run:
+                print(f"would provision {user_id} <{email}>")
+                done += 1
+                continue
+            try:
+                provision_customer(user_id, email)
+                done += 1
+            except Exception as e:
+                print(f"Provisioning failed for {user_id}: {e}")
+                failed += 1
+        return done, failed
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(run_segment, range(segments)))
+    return sum(r[0] for r in results), sum(r[1] for r in results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Create Stripe customers for users that have none')
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+    provisioned, failed = backfill(args.segments, args.dry_run)
+    print(f"{'Would provision' if args.dry_run else 'Provisioned'} {provisioned}, failed {failed}")
+
+if __name__ == '__main__':
+    main()
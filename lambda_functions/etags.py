@@ -0,0 +1,91 @@
+"""
+Conditional GET support.
+
+Writers bump a per-user counter for each resource they change
+(ThreatalyticsResourceVersions: user_id -> {usage: n, conversations: n, ...}).
+Readers build an ETag from that counter plus whatever else shapes the
+response (query string, month), and answer If-None-Match with 304 after a
+single projected GetItem instead of re-reading and re-serializing the data.
+"""
+import os
+import hashlib
+
+VERSIONS_TABLE = os.environ.get('VERSIONS_TABLE', 'ThreatalyticsResourceVersions')
+
+def bump_version(dynamodb, user_id, *resources):
+    """Increment the version of each resource for a user; best effort"""
+    if not user_id or not resources:
+        return
+    try:
+        names = {f'#r{i}': resource for i, resource in enumerate(resources)}
+        dynamodb.Table(VERSIONS_TABLE).update_item(
+            Key={'user_id': user_id},
+            UpdateExpression='ADD ' + ', '.join(f'{name} :one' for name in names),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues={':one': 1}
+        )
+    except Exception as e:
+        print(f"Error bumping version for {user_id}: {str(e)}")
+
+def get_version(dynamodb, user_id, resource):
+    """Current version of a resource; 0 if it has never been written"""
+    response = dynamodb.Table(VERSIONS_TABLE).get_item(
+        Key={'user_id': user_id},
+        ProjectionExpression='#r',
+        ExpressionAttributeNames={'#r': resource}
+    )
+    return int(response.get('Item', {}).get(resource, 0))
+
+def make_etag(*parts):
+    """Strong ETag over the version and every other input to the response"""
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+    return f'"{digest[:20]}"'
+
+def query_fingerprint(event):
+    """Stable string for the query parameters, which select the payload"""
+    params = event.get('queryStringParameters') or {}
+    return '&'.join(f'{k}={params[k]}' for k in sorted(params) if k != 'token')
+
+def if_none_match(event):
+    headers = event.get('headers') or {}
+    return headers.get('If-None-Match') or headers.get('if-none-match')
+
+def etag_matches(event, etag):
+    """True if the request's If-None-Match already names this ETag"""
+    header = if_none_match(event)
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison, as RFC 7232 requires for If-None-Match
+    tags = [tag.strip() for tag in header.split(',')]
+    return any(tag[2:] == etag if tag.startswith('W/') else tag == etag for tag in tags)
+
+def expose_headers(*names):
+    """Comma-joined Access-Control-Expose-Headers value without duplicates"""
+    merged = []
+    for value in names:
+        for name in (value or '').split(','):
+            name = name.strip()
+            if name and name not in merged:
+                merged.append(name)
+    return ','.join(merged)
+
+def cache_headers(etag, expose=''):
+    """
+    Headers for a 200 so browsers keep the body and revalidate every time.
+    `expose` lists any other response headers the page script must read.
+    """
+    return {
+        'ETag': etag,
+        'Cache-Control': 'private, no-cache',
+        'Access-Control-Expose-Headers': expose_headers('ETag', expose)
+    }
+
+def not_modified(headers, etag):
+    """304 response; carries the same CORS headers as the endpoint's 200"""
+    return {
+        'statusCode': 304,
+        'headers': {**headers, **cache_headers(etag, headers.get('Access-Control-Expose-Headers'))},
+        'body': ''
+    }
@@ -1,9 +1,107 @@
 import os
 import json
 import boto3
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from lambda_functions.etags import bump_version
+from lambda_functions.feedback_metrics import record_feedback, normalize_mode
+
+MAX_BATCH_EVENTS = 100
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+WRITE_WORKERS = 8
+
+def parse_event(event_body, now):
+    """
+    Validate one batched feedback event. The client-generated id and
+    timestamp make up the sort key, so a re-sent event maps to the same item.
+    """
+    feedback_id = str(event_body.get('id') or '').strip()
+    if not feedback_id or len(feedback_id) > 64:
+        raise ValueError('id required')
+    try:
+        created = datetime.fromisoformat(str(event_body.get('timestamp', '')).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError('timestamp must be ISO 8601')
+    if created.tzinfo:
+        created = (created - created.utcoffset()).replace(tzinfo=None)
+    if created > now + MAX_CLOCK_SKEW:
+        raise ValueError('timestamp is in the future')
+
+    timestamp = created.isoformat()
+    return {
+        'feedback_id': feedback_id,
+        'timestamp': f"{timestamp}#{feedback_id}",
+        'question': event_body.get('question', ''),
+        'helpful': bool(event_body.get('helpful', False)),
+        'comments': event_body.get('comments', ''),
+        'mode': normalize_mode(event_body.get('mode'))
+    }
+
+def put_new(feedback_table, user_id, item):
+    """
+    Store one event unless its key is already taken. True only for the one
+    request that created it, however many tabs flush the same event at once.
+    """
+    try:
+        feedback_table.put_item(
+            Item={'user_id': user_id, **item},
+            ConditionExpression='attribute_not_exists(#ts)',
+            ExpressionAttributeNames={'#ts': 'timestamp'}
+        )
+        return True
+    except feedback_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def store_batch(dynamodb, feedback_table, user_id, events):
+    """
+    Dedupe, write each event with a conditional put and update counters
+    once for the events this request actually stored.
+    Returns (accepted, duplicates, rejected).
+    """
+    now = datetime.utcnow()
+    items, rejected, seen = [], [], set()
+    for index, event_body in enumerate(events):
+        if not isinstance(event_body, dict):
+            rejected.append({'index': index, 'id': None, 'error': 'event must be an object'})
+            continue
+        try:
+            item = parse_event(event_body, now)
+        except ValueError as e:
+            rejected.append({'index': index, 'id': event_body.get('id'), 'error': str(e)})
+            continue
+        if item['feedback_id'] in seen:
+            continue
+        seen.add(item['feedback_id'])
+        items.append(item)
+
+    errors = []
+
+    def write(item):
+        try:
+            return put_new(feedback_table, user_id, item)
+        except Exception as e:
+            errors.append(e)
+            return False
+
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        stored = list(executor.map(write, items))
+    new_items = [item for item, created in zip(items, stored) if created]
+    duplicates = len(events) - len(rejected) - len(new_items)
+
+    if new_items:
+        try:
+            record_feedback(dynamodb, user_id, [(i['helpful'], i['mode'], i['timestamp']) for i in new_items])
+        except Exception as e:
+            print(f"Error updating feedback counters: {str(e)}")
+        bump_version(dynamodb, user_id, 'feedback')
+
+    if errors:
+        # The client keeps the batch and re-sends it; events stored above
+        # come back as duplicates and are not counted again
+        raise errors[0]
+    return len(new_items), duplicates, rejected
 
 def get_user_id_from_token(event):
     """Extract user_id from JWT token in Authorization header"""
@@ -34,7 +132,9 @@ def get_user_id_from_token(event):
 def lambda_handler(event, context):
     """
     Feedback Lambda - collects user feedback on answers
-    Endpoint: POST /feedback
+    Endpoints:
+    - POST /feedback - One feedback item
+    - POST /feedback/batch - {events: [{id, timestamp, question, helpful, comments, mode}]}
     """
     dynamodb = boto3.resource('dynamodb')
     feedback_table = dynamodb.Table('ThreatalyticsFeedback')
@@ -55,9 +155,40 @@ def lambda_handler(event, context):
     
     try:
         body = json.loads(event['body'])
+
+        if event.get('path', '').endswith('/batch'):
+            events = body.get('events')
+            if not isinstance(events, list) or not events or len(events) > MAX_BATCH_EVENTS:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Methods': 'POST,OPTIONS'
+                    },
+                    'body': json.dumps({'error': f'events must be a list of 1-{MAX_BATCH_EVENTS} items'})
+                }
+
+            accepted, duplicates, rejected = store_batch(dynamodb, feedback_table, user_id, events)
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                    'Access-Control-Allow-Methods': 'POST,OPTIONS'
+                },
+                'body': json.dumps({
+                    'status': 'logged',
+                    'accepted': accepted,
+                    'duplicates': duplicates,
+                    'rejected': rejected
+                })
+            }
+
         question = body.get('question', '')
         helpful = body.get('helpful', False)
         comments = body.get('comments', '')
+        mode = normalize_mode(body.get('mode'))
         
         # Store feedback
         feedback_id = str(uuid.uuid4())
@@ -69,8 +200,16 @@ def lambda_handler(event, context):
             'timestamp': timestamp,
             'question': question,
             'helpful': helpful,
-            'comments': comments
+            'comments': comments,
+            'mode': mode
         })
+
+        # The feedback item is the source of truth; counters are best effort
+        try:
+            record_feedback(dynamodb, user_id, [(helpful, mode, timestamp)])
+        except Exception as e:
+            print(f"Error updating feedback counters: {str(e)}")
+        bump_version(dynamodb, user_id, 'feedback')
         
         return {
             'statusCode': 200,
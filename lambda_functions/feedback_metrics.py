@@ -0,0 +1,105 @@
+"""
+Feedback counters maintained on write.
+
+ThreatalyticsFeedbackStats holds one item per (scope, bucket):
+scope is a user_id or GLOBAL_SCOPE, bucket is 'all' or 'day#YYYY-MM-DD'.
+Each item carries flat counters (total, helpful, mode#<mode>#total,
+mode#<mode>#helpful) bumped with ADD, so concurrent feedback never loses a
+count. A metrics read is one BatchGetItem of 'all' plus the last 30 days.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+
+STATS_TABLE = os.environ.get('FEEDBACK_STATS_TABLE', 'ThreatalyticsFeedbackStats')
+GLOBAL_SCOPE = 'global'
+ALL_TIME = 'all'
+WINDOWS = {'7d': 7, '30d': 30}
+MODE_RE = re.compile(r'^[a-z0-9_-]{1,32}$')
+
+def normalize_mode(mode):
+    """Modes become attribute names, so keep them to a small safe alphabet"""
+    mode = str(mode or 'unknown').strip().lower()
+    return mode if MODE_RE.match(mode) else 'other'
+
+def day_bucket(timestamp):
+    return 'day#' + timestamp[:10]
+
+def counter_deltas(user_id, entries):
+    """
+    Fold (helpful, mode, timestamp) entries into per-item counter deltas:
+    {(scope, bucket): {attribute: n}}
+    """
+    deltas = {}
+    for helpful, mode, timestamp in entries:
+        mode = normalize_mode(mode)
+        for scope in (user_id, GLOBAL_SCOPE):
+            for bucket in (ALL_TIME, day_bucket(timestamp)):
+                counters = deltas.setdefault((scope, bucket), {})
+                counters['total'] = counters.get('total', 0) + 1
+                counters[f'mode#{mode}#total'] = counters.get(f'mode#{mode}#total', 0) + 1
+                if helpful:
+                    counters['helpful'] = counters.get('helpful', 0) + 1
+                    counters[f'mode#{mode}#helpful'] = counters.get(f'mode#{mode}#helpful', 0) + 1
+    return deltas
+
+def record_feedback(dynamodb, user_id, entries):
+    """Apply counter deltas for a list of (helpful, mode, timestamp); one update_item per item touched"""
+    table = dynamodb.Table(STATS_TABLE)
+    for (scope, bucket), counters in counter_deltas(user_id, entries).items():
+        names = {f'#c{i}': name for i, name in enumerate(counters)}
+        values = {f':c{i}': counters[name] for i, name in enumerate(counters)}
+        table.update_item(
+            Key={'scope': scope, 'bucket': bucket},
+            UpdateExpression='ADD ' + ', '.join(f'#c{i} :c{i}' for i in range(len(counters))),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+def summarize(items):
+    """Sum counter items into the shape /metrics returns"""
+    total = helpful = 0
+    by_mode = {}
+    for item in items:
+        total += int(item.get('total', 0))
+        helpful += int(item.get('helpful', 0))
+        for name, value in item.items():
+            if not name.startswith('mode#'):
+                continue
+            _, mode, kind = name.split('#', 2)
+            counts = by_mode.setdefault(mode, {'total': 0, 'helpful': 0})
+            counts[kind] += int(value)
+
+    for counts in by_mode.values():
+        counts['not_helpful'] = counts['total'] - counts['helpful']
+        counts['helpful_rate_percent'] = round(counts['helpful'] / counts['total'] * 100, 2) if counts['total'] else 0
+
+    return {
+        'total_feedback': total,
+        'helpful': helpful,
+        'not_helpful': total - helpful,
+        'helpful_rate_percent': round(helpful / total * 100, 2) if total else 0,
+        'by_mode': by_mode
+    }
+
+def window_days(today, days):
+    return [day_bucket((today - timedelta(days=n)).isoformat()) for n in range(days)]
+
+def read_metrics(dynamodb, scope, today=None):
+    """All-time and windowed metrics for one scope from a single BatchGetItem"""
+    today = today or datetime.utcnow().date()
+    buckets = [ALL_TIME] + window_days(today, max(WINDOWS.values()))
+    keys = [{'scope': scope, 'bucket': bucket} for bucket in buckets]
+
+    found = {}
+    request = {STATS_TABLE: {'Keys': keys}}
+    while request:
+        response = dynamodb.batch_get_item(RequestItems=request)
+        for item in response.get('Responses', {}).get(STATS_TABLE, []):
+            found[item['bucket']] = item
+        request = response.get('UnprocessedKeys') or None
+
+    metrics = {'all_time': summarize([found[ALL_TIME]] if ALL_TIME in found else [])}
+    for name, days in WINDOWS.items():
+        metrics[name] = summarize([found[b] for b in window_days(today, days) if b in found])
+    return metrics
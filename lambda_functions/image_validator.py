@@ -1,4 +1,8 @@
+import os
+import re
 import json
+import time
+import unicodedata
 
 # Define approved and restricted keywords
 APPROVED_KEYWORDS = [
@@ -13,15 +17,197 @@ RESTRICTED_KEYWORDS = [
     "cute", "funny", "playful", "artistic"
 ]
 
+# Optional external rule set: s3://bucket/key (JSON) or dynamodb://Table/policy_id
+# Either holds {"approved": [...], "restricted": [...]}
+RULES_SOURCE = os.environ.get('IMAGE_RULES_SOURCE', '')
+RULES_CHECK_SECONDS = int(os.environ.get('IMAGE_RULES_CHECK_SECONDS', '60'))
+MAX_BATCH = 100
+
+# A word is a run of letters and digits (str.isalnum) in any script;
+# everything else, including Unicode dashes and quotes, separates words
+WORD_RE = re.compile(r'[^\W_]+')
+
+def words(text):
+    if not text.isascii():
+        # Fold full-width and compatibility forms to their plain letters and drop
+        # format characters (zero-width space/joiner, soft hyphen) that would
+        # otherwise split or hide a keyword
+        text = unicodedata.normalize('NFKC', text)
+        text = ''.join(c for c in text if unicodedata.category(c) != 'Cf')
+    return WORD_RE.findall(text.lower())
+
+class KeywordPolicy:
+    """
+    Keyword rules compiled into a word-level phrase index, built once.
+    A description is split into words once; a set intersection finds the
+    keyword heads it contains and only those positions are checked, so the
+    cost does not grow with the number of rules. Rules loaded from
+    IMAGE_RULES_SOURCE can run to hundreds of phrases; checking each phrase
+    against the words in turn is already ~20x slower at the built-in 24.
+    Keywords match whole words only ("drawing" does not match "withdrawing"),
+    with an optional plural ending on the last word.
+    """
+    def __init__(self, approved, restricted, version=None):
+        self.approved = list(approved)
+        self.restricted = list(restricted)
+        self.version = version
+        # first word (with plural forms for one-word keywords) -> [(phrase, restricted, keyword)]
+        self.index = {}
+        for keywords, restricted_kind in ((self.restricted, True), (self.approved, False)):
+            for keyword in keywords:
+                phrase = tuple(words(keyword))
+                if not phrase:
+                    continue
+                heads = plural_forms(phrase[0]) if len(phrase) == 1 else (phrase[0],)
+                for head in heads:
+                    self.index.setdefault(head, []).append((phrase, restricted_kind, keyword))
+        # Longest phrase first at each position
+        for entries in self.index.values():
+            entries.sort(key=lambda e: -len(e[0]))
+        self.heads = frozenset(self.index)
+
+    def check(self, text):
+        """Returns (restricted_term or None, [approved terms found])"""
+        tokens = words(text)
+        # Set intersection runs in C; most descriptions touch only a few keyword heads
+        hits = self.heads.intersection(tokens)
+        approved = []
+        if not hits:
+            return None, approved
+        for i, token in enumerate(tokens):
+            if token not in hits:
+                continue
+            for phrase, restricted_kind, keyword in self.index[token]:
+                n = len(phrase)
+                if n > 1 and not (i + n <= len(tokens)
+                                  and tuple(tokens[i + 1:i + n - 1]) == phrase[1:-1]
+                                  and tokens[i + n - 1] in plural_forms(phrase[-1])):
+                    continue
+                if restricted_kind:
+                    return keyword, approved
+                if keyword not in approved:
+                    approved.append(keyword)
+                break
+        return None, approved
+
+def plural_forms(word):
+    return (word, word + 's', word + 'es')
+
+def load_rules(source):
+    """Fetch (approved, restricted, version) from S3 or DynamoDB"""
+    import boto3
+    scheme, _, rest = source.partition('://')
+    location, _, key = rest.partition('/')
+    if scheme == 's3':
+        obj = boto3.client('s3').get_object(Bucket=location, Key=key)
+        rules = json.loads(obj['Body'].read())
+        version = obj.get('ETag')
+    elif scheme == 'dynamodb':
+        item = boto3.resource('dynamodb').Table(location).get_item(Key={'policy_id': key}).get('Item') or {}
+        rules = item
+        version = str(item.get('version', ''))
+    else:
+        raise ValueError(f'Unsupported rules source: {source}')
+    return list(rules.get('approved', [])), list(rules.get('restricted', [])), version
+
+def current_version(source):
+    """Cheap change check: S3 ETag or the DynamoDB item's version attribute"""
+    import boto3
+    scheme, _, rest = source.partition('://')
+    location, _, key = rest.partition('/')
+    if scheme == 's3':
+        return boto3.client('s3').head_object(Bucket=location, Key=key).get('ETag')
+    item = boto3.resource('dynamodb').Table(location).get_item(
+        Key={'policy_id': key}, ProjectionExpression='version'
+    ).get('Item') or {}
+    return str(item.get('version', ''))
+
+# Built once per container; reloaded only when the source version changes
+_policy = KeywordPolicy(APPROVED_KEYWORDS, RESTRICTED_KEYWORDS, version='builtin')
+_checked_at = 0.0
+
+def get_policy():
+    global _policy, _checked_at
+    if not RULES_SOURCE or time.time() - _checked_at < RULES_CHECK_SECONDS:
+        return _policy
+    _checked_at = time.time()
+    try:
+        if _policy.version == 'builtin' or current_version(RULES_SOURCE) != _policy.version:
+            approved, restricted, version = load_rules(RULES_SOURCE)
+            _policy = KeywordPolicy(approved, restricted, version)
+            print(f"Loaded image rules {version}: {len(approved)} approved, {len(restricted)} restricted")
+    except Exception as e:
+        # Keep serving the last good rule set
+        print(f"Error loading image rules from {RULES_SOURCE}: {str(e)}")
+    return _policy
+
+def validate_description(policy, description):
+    """Policy decision for one description, in the shape the endpoints return"""
+    restricted_term, approved_terms = policy.check(description)
+    if restricted_term:
+        return {
+            'approved': False,
+            'error': f"Request denied. The term '{restricted_term}' is not supported under the visual policy.",
+            'restricted_term': restricted_term
+        }
+    if not approved_terms:
+        return {
+            'approved': False,
+            'error': 'Request denied. Visuals must be related to operational casework or training.',
+            'suggestion': f'Try including one of these terms: {", ".join(policy.approved[:5])}'
+        }
+    return {
+        'approved': True,
+        'message': 'Image request approved. Proceed to generation module.'
+    }
+
 def lambda_handler(event, context):
     """
     Image Validation Lambda - validates image generation requests
     Denies requests with restricted terms or without approved patterns
-    Endpoint: POST /image/validate
+    Endpoints:
+    - POST /image/validate - {description}
+    - POST /image/validate/batch - {descriptions: [...]}
     """
     try:
-        body = json.loads(event.get('body', '{}'))
-        request_text = body.get('description', '').lower()
+        body = json.loads(event.get('body') or '{}')
+        policy = get_policy()
+
+        if event.get('path', '').endswith('/batch'):
+            descriptions = body.get('descriptions')
+            if not isinstance(descriptions, list) or not descriptions or len(descriptions) > MAX_BATCH:
+                return {
+                    'statusCode': 400,
+                    'headers': {
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Methods': 'POST,OPTIONS'
+                    },
+                    'body': json.dumps({
+                        'error': f'descriptions must be a list of 1-{MAX_BATCH} strings'
+                    })
+                }
+
+            results = [
+                validate_description(policy, d) if isinstance(d, str) and d.strip()
+                else {'approved': False, 'error': 'Description is required'}
+                for d in descriptions
+            ]
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                    'Access-Control-Allow-Methods': 'POST,OPTIONS'
+                },
+                'body': json.dumps({
+                    'results': results,
+                    'approved': sum(1 for r in results if r['approved']),
+                    'rules_version': policy.version
+                })
+            }
+
+        request_text = body.get('description', '')
         
         if not request_text:
             return {
@@ -36,26 +222,10 @@ def lambda_handler(event, context):
                 })
             }
         
-        # Check for restricted keywords
-        for keyword in RESTRICTED_KEYWORDS:
-            if keyword in request_text:
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
-                        'Access-Control-Allow-Methods': 'POST,OPTIONS'
-                    },
-                    'body': json.dumps({
-                        'error': f"Request denied. The term '{keyword}' is not supported under the visual policy.",
-                        'restricted_term': keyword
-                    })
-                }
-        
-        # Check for at least one approved keyword
-        approved_found = any(keyword in request_text for keyword in APPROVED_KEYWORDS)
-        
-        if not approved_found:
+        result = validate_description(policy, request_text)
+
+        if not result['approved']:
+            result.pop('approved')
             return {
                 'statusCode': 400,
                 'headers': {
@@ -63,10 +233,7 @@ def lambda_handler(event, context):
                     'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
                     'Access-Control-Allow-Methods': 'POST,OPTIONS'
                 },
-                'body': json.dumps({
-                    'error': 'Request denied. Visuals must be related to operational casework or training.',
-                    'suggestion': f'Try including one of these terms: {", ".join(APPROVED_KEYWORDS[:5])}'
-                })
+                'body': json.dumps(result)
             }
         
         # Request is valid
@@ -4,6 +4,8 @@ import boto3
 from datetime import datetime
 import base64
 from boto3.dynamodb.conditions import Key
+from lambda_functions.etags import get_version, make_etag, etag_matches, cache_headers, not_modified
+from lambda_functions.feedback_metrics import read_metrics, WINDOWS
 
 def get_user_id_from_token(event):
     """Extract user_id from JWT token in Authorization header"""
@@ -33,7 +35,7 @@ def get_user_id_from_token(event):
 
 def lambda_handler(event, context):
     """
-    Metrics Lambda - aggregates and returns feedback metrics
+    Metrics Lambda - returns feedback metrics (all-time, 7d, 30d)
     Endpoint: GET /metrics
     """
     dynamodb = boto3.resource('dynamodb')
@@ -54,31 +56,33 @@ def lambda_handler(event, context):
         }
     
     try:
-        # Get all feedback for user
+        # Metrics change when the user leaves feedback, and windows move daily
+        etag = make_etag(
+            'feedback', user_id, get_version(dynamodb, user_id, 'feedback'), datetime.utcnow().date()
+        )
+        if etag_matches(event, etag):
+            return not_modified({
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            }, etag)
+
+        # Counters are maintained by feedback.py, so this is O(1) in feedback volume
+        metrics = read_metrics(dynamodb, user_id)
+        
+        # Get sample comments (last 5)
         response = feedback_table.query(
             KeyConditionExpression=Key('user_id').eq(user_id),
+            ProjectionExpression='comments',
             ScanIndexForward=False,  # Most recent first
-            Limit=100
+            Limit=20
         )
-        
-        feedback_items = response.get('Items', [])
-        
-        # Calculate metrics
-        total = len(feedback_items)
-        helpful_count = sum(1 for f in feedback_items if f.get('helpful', False))
-        not_helpful_count = total - helpful_count
-        helpful_rate = round((helpful_count / total) * 100, 2) if total > 0 else 0
-        
-        # Get sample comments (last 5)
-        comments = [f.get('comments', '') for f in feedback_items if f.get('comments', '').strip()]
-        sample_comments = comments[:5]
+        comments = [f.get('comments', '') for f in response.get('Items', []) if f.get('comments', '').strip()]
         
         metrics = {
-            'total_feedback': total,
-            'helpful': helpful_count,
-            'not_helpful': not_helpful_count,
-            'helpful_rate_percent': helpful_rate,
-            'sample_comments': sample_comments
+            **metrics['all_time'],
+            'windows': {name: metrics[name] for name in WINDOWS},
+            'sample_comments': comments[:5]
         }
         
         return {
@@ -86,7 +90,8 @@ def lambda_handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
-                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+                'Access-Control-Allow-Methods': 'GET,OPTIONS',
+                **cache_headers(etag)
             },
             'body': json.dumps(metrics, default=str)
         }
@@ -0,0 +1,352 @@
+"""
+Local PII redaction.
+
+Structured PII (emails, SSNs, card numbers, phone numbers, IP addresses,
+street addresses) is found with precompiled patterns; person names with a
+gazetteer of first names held in a token trie, extended over the
+capitalized surname that follows, plus honorifics ("Mr.", "Officer").
+Everything runs in-process with no network calls.
+
+redact.py uses this for mode=local, and for mode=hybrid, where only the
+sentences that still look like they carry PII after the local pass are
+sent to the model.
+"""
+import os
+import re
+
+PLACEHOLDER_RE = re.compile(r'\[[A-Z_]+(?:_\d+)?\]')
+
+# (label, pattern); earlier entries win when spans overlap at the same start
+PATTERNS = [
+    ('EMAIL', re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}\b')),
+    ('SSN', re.compile(r'(?<!\d)\d{3}-\d{2}-\d{4}(?!\d)')),
+    ('CARD', re.compile(r'(?<!\d)\d{4}[ -]?\d{4}[ -]?\d{4}[ -]?\d{1,7}(?!\d)')),
+    ('PHONE', re.compile(r'(?<![\w+])(?:\+?1[ .-]?)?(?:\(\d{3}\)\s?|\d{3}[ .-]?)\d{3}[ .-]?\d{4}(?!\d)')),
+    ('IP_ADDRESS', re.compile(r'(?<![\d.])(?:(?:25[0-5]|2[0-4]\d|1?\d?\d)\.){3}(?:25[0-5]|2[0-4]\d|1?\d?\d)(?!\.?\d)')),
+    ('ADDRESS', re.compile(
+        r'\b\d{1,6}\s+(?:[NSEW]\.?\s+)?(?:[A-Z][a-zA-Z]+\s+){1,4}'
+        r'(?:Street|St|Avenue|Ave|Road|Rd|Boulevard|Blvd|Lane|Ln|Drive|Dr|Court|Ct|Way|Place|Pl|'
+        r'Terrace|Ter|Circle|Cir|Parkway|Pkwy|Highway|Hwy|Trail|Trl)\b'
+        r'(?:,?\s+(?:Apt|Apartment|Unit|Suite|Ste|#)\.?\s*[A-Za-z0-9-]+)?'
+    )),
+]
+
+# Quick character tests that let a pattern be skipped entirely
+PATTERN_GUARDS = {'EMAIL': '@'}
+
+FIRST_NAMES = """
+aaron abigail adam adrian aiden alex alexander alexis alice alicia allison alyssa amanda amber amy andrea andrew
+angela anna anne anthony antonio ashley austin barbara benjamin beth betty brandon brenda brian brittany brooke
+caleb cameron carl carlos carol caroline carolyn catherine charles charlotte chloe chris christian christina
+christopher cynthia daniel david deborah debra denise dennis derek diana diane donald donna dorothy dylan edward
+elijah elizabeth ella emily emma eric ethan evan evelyn gabriel gary george gloria gregory hannah harold heather
+helen henry isaac isabella jack jackson jacob james jamie jane janet jason jasmine jeffrey jennifer jeremy jerry
+jessica jesus joan john jonathan jordan jose joseph joshua joyce juan judith julia julie justin karen katherine
+kathleen kathryn kayla keith kelly kenneth kevin kimberly kyle larry laura lauren liam linda lisa logan lucas
+luis madison margaret maria marie marilyn mark mary mason matthew megan melissa michael michelle mike natalie
+nathan nicholas nicole noah olivia pamela patricia patrick paul peter rachel ralph raymond rebecca richard robert
+roger ronald rose ruth ryan samantha samuel sandra sara sarah scott sean sharon shirley sophia stephanie stephen
+steven susan taylor teresa terry thomas timothy tyler victoria vincent walter william zachary
+""".split() + ['mary ann', 'mary beth', 'anne marie', 'jean paul']
+
+# Names that are also ordinary words; only counted when a capitalized surname follows
+AMBIGUOUS_NAMES = frozenset("""
+will may june april august grace hope faith joy mark bill frank rose summer art dawn eve jack miles chase
+hunter mason taylor jordan austin carol paris dean guy victor sue
+""".split())
+
+HONORIFICS = frozenset("""
+mr mrs ms miss mx dr prof officer deputy sgt sergeant det detective lt lieutenant capt captain chief
+principal coach judge
+""".split())
+
+# Capitalized words that do not suggest a name on their own
+COMMON_CAPITALIZED = frozenset("""
+i i'm i'll i've i'd a an the this that these those he she they we you it his her their our my your its
+monday tuesday wednesday thursday friday saturday sunday january february march april may june july august
+september october november december mr mrs ms dr
+""".split())
+
+NAME_TOKEN_RE = re.compile(r"[A-Z][a-zA-Z'’-]*")
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])["\')\]]*\s+|\n\s*\n')
+
+class NameTrie:
+    """Token trie over lower-cased gazetteer entries; entries may span several words"""
+    END = ''
+
+    def __init__(self, names=()):
+        self.root = {}
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        node = self.root
+        for token in name.lower().split():
+            node = node.setdefault(token, {})
+        node[self.END] = True
+
+    def longest(self, tokens, start):
+        """Number of tokens from `start` forming the longest entry; 0 if none"""
+        node, length = self.root, 0
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if self.END in node:
+                length = i - start + 1
+        return length
+
+def load_gazetteer(path=None):
+    """Built-in first names plus one name per line from PII_NAMES_FILE, if set"""
+    names = list(FIRST_NAMES) + sorted(AMBIGUOUS_NAMES)
+    path = path or os.environ.get('PII_NAMES_FILE')
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            names.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    return NameTrie(names)
+
+GAZETTEER = load_gazetteer()
+
+def find_structured(text):
+    spans = []
+    for priority, (label, pattern) in enumerate(PATTERNS):
+        guard = PATTERN_GUARDS.get(label)
+        if guard and guard not in text:
+            continue
+        for match in pattern.finditer(text):
+            if label == 'CARD' and not luhn_valid(match.group()):
+                continue
+            spans.append((match.start(), match.end(), label, priority))
+    return spans
+
+def luhn_valid(number):
+    digits = [int(c) for c in number if c.isdigit()]
+    if not 13 <= len(digits) <= 19:
+        return False
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        if i % 2:
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    return total % 10 == 0
+
+def find_names(text, gazetteer=None):
+    """
+    Capitalized runs that start with a gazetteer first name or follow an
+    honorific. A run covers up to two following capitalized words (surname).
+    """
+    gazetteer = gazetteer or GAZETTEER
+    matches = list(NAME_TOKEN_RE.finditer(text))
+    tokens = [m.group().lower().rstrip("'’") for m in matches]
+    spans = []
+    i = 0
+    while i < len(matches):
+        length = gazetteer.longest(tokens, i)
+        honorific = (tokens[i] in HONORIFICS and i + 1 < len(matches)
+                     and adjacent(text, matches[i], matches[i + 1], after_honorific=True))
+        if honorific:
+            start_index, i = i + 1, i + 1
+            length = 1
+        elif length:
+            start_index = i
+        else:
+            i += 1
+            continue
+
+        end_index = start_index + length - 1
+        surnames = 0
+        while (surnames < 2 and end_index + 1 < len(matches)
+               and adjacent(text, matches[end_index], matches[end_index + 1])
+               and tokens[end_index + 1] not in COMMON_CAPITALIZED):
+            end_index += 1
+            surnames += 1
+
+        if honorific or surnames or tokens[start_index] not in AMBIGUOUS_NAMES:
+            spans.append((matches[start_index].start(), matches[end_index].end(), 'PERSON', len(PATTERNS)))
+        i = end_index + 1
+    return spans
+
+def adjacent(text, first, second, after_honorific=False):
+    """Two tokens separated only by a space, or by ". " after an honorific"""
+    gap = text[first.end():second.start()]
+    return gap == ' ' or (after_honorific and gap == '. ')
+
+def find_entities(text, gazetteer=None):
+    """Non-overlapping (start, end, label) spans, in order"""
+    spans = find_structured(text) + find_names(text, gazetteer)
+    spans.sort(key=lambda s: (s[0], s[3], -s[1]))
+    entities, last_end = [], 0
+    for start, end, label, _ in spans:
+        if start >= last_end:
+            entities.append((start, end, label))
+            last_end = end
+    return entities
+
+def apply_placeholders(text, entities, placeholder=None):
+    """Replace each span; placeholder(label, original) defaults to [LABEL]"""
+    placeholder = placeholder or (lambda label, original: f'[{label}]')
+    parts, last = [], 0
+    for start, end, label in entities:
+        parts.append(text[last:start])
+        parts.append(placeholder(label, text[start:end]))
+        last = end
+    parts.append(text[last:])
+    return ''.join(parts)
+
+def redact_local(text, gazetteer=None, placeholder=None):
+    """Returns (redacted_text, {label: count})"""
+    entities = find_entities(text, gazetteer)
+    counts = {}
+    for _, _, label in entities:
+        counts[label] = counts.get(label, 0) + 1
+    return apply_placeholders(text, entities, placeholder), counts
+
+def sentence_spans(text):
+    """(start, end) of each sentence; the spans cover the whole text"""
+    spans, start = [], 0
+    for match in SENTENCE_END_RE.finditer(text):
+        # "Mr. Smith" does not end a sentence
+        word = text[text.rfind(' ', start, match.start()) + 1:match.start()].strip('.').lower()
+        if word in HONORIFICS:
+            continue
+        spans.append((start, match.end()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+def needs_model(sentence):
+    """
+    True if a locally redacted sentence may still hold PII: a capitalized
+    word past the first that is not a placeholder, an acronym or a common word.
+    """
+    stripped = PLACEHOLDER_RE.sub(' ', sentence)
+    first = len(stripped) - len(stripped.lstrip(' "\'(\n\t'))
+    return any(match.start() != first and not match.group().isupper()
+               and match.group().lower() not in COMMON_CAPITALIZED
+               for match in NAME_TOKEN_RE.finditer(stripped))
+
+def redact_hybrid(text, model, gazetteer=None, placeholder=None):
+    """
+    Local pass first, then model(segments) -> redacted segments for the
+    sentences needs_model() flags. Returns (redacted_text, counts, segments_sent).
+    """
+    redacted, counts = redact_local(text, gazetteer, placeholder)
+    spans = [span for span in sentence_spans(redacted) if needs_model(redacted[span[0]:span[1]])]
+    if not spans:
+        return redacted, counts, 0
+
+    results = model([redacted[start:end] for start, end in spans])
+    if len(results) != len(spans):
+        raise ValueError(f'Model returned {len(results)} segments for {len(spans)}')
+
+    parts, last = [], 0
+    for (start, end), result in zip(spans, results):
+        parts.append(redacted[last:start])
+        # Keep the sentence's trailing whitespace; models tend to trim it
+        original = redacted[start:end]
+        parts.append(result.rstrip() + original[len(original.rstrip()):])
+        last = end
+    parts.append(redacted[last:])
+    return ''.join(parts), counts, len(spans)
+
+class PlaceholderMap:
+    """
+    Entity -> numbered placeholder ([PERSON_1], [EMAIL_2], ...), shared by
+    every chunk of a document so the same entity always gets the same tag.
+    A lone first name or surname reuses the tag of a full name seen earlier.
+    """
+    def __init__(self):
+        self.tags = {}
+        self.counters = {}
+
+    def placeholder(self, label, original):
+        key = (label, ' '.join(original.lower().split()))
+        tag = self.tags.get(key)
+        if tag is None and label == 'PERSON' and ' ' not in key[1]:
+            tag = next((t for (l, name), t in self.tags.items() if l == 'PERSON' and key[1] in name.split()), None)
+        if tag is None:
+            self.counters[label] = self.counters.get(label, 0) + 1
+            tag = f'[{label}_{self.counters[label]}]'
+        self.tags[key] = tag
+        return tag
+
+    def counts(self):
+        """Distinct entities per label"""
+        return dict(self.counters)
+
+def chunk_text(text, max_chars):
+    """Pack whole sentences into chunks of at most max_chars; an overlong sentence is cut at whitespace"""
+    chunks, current = [], ''
+    for start, end in sentence_spans(text):
+        sentence = text[start:end]
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars) + 1 or max_chars
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(sentence[:cut])
+            sentence = sentence[cut:]
+        if len(current) + len(sentence) > max_chars and current:
+            chunks.append(current)
+            current = ''
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+def locate(text, found):
+    """(start, end, label) for every whole-word occurrence of each (entity text, label)"""
+    spans = []
+    for value, label in found:
+        value = value.strip()
+        if not value:
+            continue
+        pattern = r'(?<!\w)' + r'\s+'.join(re.escape(part) for part in value.split()) + r'(?!\w)'
+        spans.extend((m.start(), m.end(), label) for m in re.finditer(pattern, text))
+    return spans
+
+def merge_entities(*span_lists):
+    """Non-overlapping union of span lists; on overlap the earlier list wins, then the earlier span"""
+    ranked = sorted(
+        ((start, end, label, rank) for rank, spans in enumerate(span_lists) for start, end, label in spans),
+        key=lambda s: (s[3], s[0], -s[1])
+    )
+    kept = []
+    for start, end, label, _ in ranked:
+        if all(end <= s or start >= e for s, e, _ in kept):
+            kept.append((start, end, label))
+    return sorted(kept)
+
+def redact_chunked(text, find, max_chars=6000, concurrency=4):
+    """
+    Split on sentence boundaries, run find(chunk) -> [(start, end, label)]
+    on chunks concurrently, then number placeholders in document order so
+    the result does not depend on which chunk finished first.
+    Returns (redacted_text, {label: distinct entities}, chunk_count).
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    chunks = chunk_text(text, max_chars)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(find, chunks))
+
+    # "Adjei" on its own, in any chunk, once "Kwame Adjei" was found anywhere
+    parts = {
+        part for chunk, entities in zip(chunks, results) for start, end, label in entities
+        if label == 'PERSON' for part in chunk[start:end].split()[1:]
+        if len(part) > 2 and part.lower() not in COMMON_CAPITALIZED
+    }
+    if parts:
+        pattern = re.compile(r'(?<!\w)(?:' + '|'.join(re.escape(p) for p in sorted(parts, key=len, reverse=True)) + r')(?!\w)')
+        results = [
+            merge_entities(entities, [(m.start(), m.end(), 'PERSON') for m in pattern.finditer(chunk)])
+            for chunk, entities in zip(chunks, results)
+        ]
+
+    placeholders = PlaceholderMap()
+    redacted = ''.join(apply_placeholders(chunk, entities, placeholders.placeholder)
+                       for chunk, entities in zip(chunks, results))
+    return redacted, placeholders.counts(), len(chunks)
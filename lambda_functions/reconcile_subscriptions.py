@@ -0,0 +1,421 @@
+"""
+Stripe -> DynamoDB subscription reconciliation.
+
+Webhooks that were missed or applied out of order leave ThreatalyticsUsers
+(plan, subscription_status, stripe_subscription_id) and ThreatalyticsPlans
+rows out of step with Stripe. This job re-derives both from Stripe and
+fixes the difference. It also backfills the customer -> user mapping.
+
+    python -m lambda_functions.reconcile_subscriptions --dry-run --report reconcile.json
+    python -m lambda_functions.reconcile_subscriptions --workers 8 --windows 32
+    python -m lambda_functions.reconcile_subscriptions --stripe-fixture stripe.json --dry-run
+
+The job runs in four stages:
+
+- Fetch. Stripe lists page sequentially, so the account's history is split
+  into --windows created-time ranges. Those are paged on --workers threads,
+  which bounds the request rate. Each page is retried with backoff on
+  errors, including rate limiting.
+- Scan. Users, plans rows and the customer map are read with segmented
+  parallel scans.
+- Diff. Stripe and DynamoDB are compared in memory.
+- Apply. Mapping entries never change owner and are written with
+  batch_writer. Users and plans rows are also written by the webhook and
+  the verify endpoint, so their fixes are conditional UpdateItems that
+  set only the reconciled fields: a user whose plan, or a plans row whose
+  billing fields, changed since the scan is left alone.
+
+Plans rows written before the webhook stored `plan` (they only have the
+price under `plan_id`) differ from Stripe, so a full run without --since
+also backfills `plan`, `price_id` and `created_at` for the admin indexes.
+
+Without --dry-run the report also lists what was applied.
+"""
+import argparse
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from lambda_functions.etags import bump_version
+from lambda_functions.stripe_customers import CUSTOMERS_TABLE
+from lambda_functions.subscription_state import ACTIVE_STATUSES, subscription_plan, put_state
+
+USERS_TABLE = os.environ.get('USERS_TABLE', 'ThreatalyticsUsers')
+PLANS_TABLE = 'ThreatalyticsPlans'
+DEFAULT_SINCE = '2020-01-01'
+DEFAULT_WORKERS = 8
+DEFAULT_WINDOWS = 32
+DEFAULT_SEGMENTS = 8
+PAGE_SIZE = 100
+MAX_ATTEMPTS = 5
+SAMPLE_SIZE = 50
+
+# Stripe subscription status -> the status the webhook writes on plans rows
+PLANS_ROW_STATUS = {
+    'active': 'active',
+    'trialing': 'active',
+    'canceled': 'cancelled',
+    'incomplete_expired': 'cancelled',
+    'past_due': 'payment_failed',
+    'unpaid': 'payment_failed',
+    'incomplete': 'incomplete',
+    'paused': 'paused'
+}
+USER_FIELDS = ('plan', 'subscription_status', 'stripe_subscription_id')
+PLANS_ROW_FIELDS = ('plan', 'price_id', 'status', 'stripe_customer_id')
+# What the webhook stores when Stripe does not name the plan
+DEFAULT_PAID_PLAN = 'starter'
+
+class FixtureStripe:
+    """
+    Local stand-in for the two Stripe list endpoints the job uses, over a
+    JSON dump {"customers": [...], "subscriptions": [...]}. Supports the
+    created range, limit and starting_after parameters, newest first like
+    Stripe. Used by the tests and for dry runs against an exported account.
+    """
+    class _Endpoint:
+        def __init__(self, objects):
+            self.objects = sorted(objects, key=lambda o: (-o['created'], o['id']))
+            self.calls = 0
+
+        def list(self, created=None, limit=10, starting_after=None, **params):
+            self.calls += 1
+            created = created or {}
+            matches = [
+                o for o in self.objects
+                if o['created'] >= created.get('gte', float('-inf')) and o['created'] < created.get('lt', float('inf'))
+            ]
+            if starting_after:
+                ids = [o['id'] for o in matches]
+                matches = matches[ids.index(starting_after) + 1:]
+            return {'data': matches[:limit], 'has_more': len(matches) > limit}
+
+    def __init__(self, customers=(), subscriptions=()):
+        self.Customer = self._Endpoint(customers)
+        self.Subscription = self._Endpoint(subscriptions)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            dump = json.load(f)
+        return cls(dump.get('customers', []), dump.get('subscriptions', []))
+
+def created_windows(since, until, count):
+    """Split [since, until) into `count` contiguous created-time ranges"""
+    step = max(1, -(-(until - since) // count))
+    return [(start, min(start + step, until)) for start in range(since, until, step)]
+
+def fetch_page(endpoint, params):
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return endpoint.list(**params)
+        except Exception as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            # Stripe answers 429 under load; back off with jitter and retry
+            delay = min(30, 2 ** attempt) * (0.5 + random.random())
+            print(f"Stripe list failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def fetch_all(endpoint, since, until, workers=DEFAULT_WORKERS, windows=DEFAULT_WINDOWS, **params):
+    """Every object created in [since, until), paged per window on a bounded pool"""
+    def fetch_window(window):
+        objects, starting_after = [], None
+        while True:
+            page_params = dict(params, created={'gte': window[0], 'lt': window[1]}, limit=PAGE_SIZE)
+            if starting_after:
+                page_params['starting_after'] = starting_after
+            page = fetch_page(endpoint, page_params)
+            objects.extend(page['data'])
+            if not page['has_more'] or not page['data']:
+                return objects
+            starting_after = page['data'][-1]['id']
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return [obj for chunk in executor.map(fetch_window, created_windows(since, until, windows)) for obj in chunk]
+
+def parallel_scan(table, segments=DEFAULT_SEGMENTS, **kwargs):
+    def scan_segment(segment):
+        scan_kwargs = dict(kwargs, Segment=segment, TotalSegments=segments)
+        items = []
+        while True:
+            response = table.scan(**scan_kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return [item for chunk in executor.map(scan_segment, range(segments)) for item in chunk]
+
+def current_subscription(subscriptions):
+    """The subscription that decides a customer's plan: newest live one, else newest"""
+    if not subscriptions:
+        return None
+    live = [s for s in subscriptions if s['status'] in ACTIVE_STATUSES or s['status'] == 'past_due']
+    return max(live or subscriptions, key=lambda s: s['created'])
+
+def subscription_price(subscription):
+    try:
+        item = subscription['items']['data'][0]
+        return (item.get('plan') or item.get('price') or {}).get('id')
+    except (KeyError, IndexError, TypeError):
+        return None
+
+def expected_user(user, subscription):
+    """USER_FIELDS as Stripe says they should be, or None to leave the user alone"""
+    if subscription is None:
+        # No subscription at all: only undo an activation Stripe does not know about
+        if user.get('subscription_status') != 'active':
+            return None
+        return {'plan': 'free', 'subscription_status': 'canceled', 'stripe_subscription_id': user.get('stripe_subscription_id')}
+    active = subscription['status'] in ACTIVE_STATUSES
+    return {
+        'plan': subscription_plan(subscription, user.get('plan', 'free')) if active else 'free',
+        'subscription_status': 'active' if active else subscription['status'],
+        'stripe_subscription_id': subscription['id']
+    }
+
+def diff(customers, subscriptions, users, plans_rows, mapped_customers):
+    """
+    Compare Stripe with DynamoDB. Returns a dict of corrections:
+    users [(user, want)], plans_rows [(existing or None, want)],
+    mappings [(customer_id, user_id)], plus unmatched and orphan lists.
+    """
+    users_by_id = {u['user_id']: u for u in users}
+    user_by_stored_customer = {u['stripe_customer_id']: u['user_id'] for u in users if u.get('stripe_customer_id')}
+    # Only customers Stripe returned: their subscriptions are all newer, so
+    # "no subscription" really means none (not "older than --since")
+    user_by_customer = {}
+    for customer in customers:
+        user_id = user_by_stored_customer.get(customer['id']) or (customer.get('metadata') or {}).get('user_id')
+        if user_id and user_id in users_by_id:
+            user_by_customer[customer['id']] = user_id
+
+    subscriptions_by_customer = {}
+    for subscription in subscriptions:
+        subscriptions_by_customer.setdefault(subscription['customer'], []).append(subscription)
+    rows_by_key = {(r['user_id'], r['subscription_id']): r for r in plans_rows}
+    stripe_subscription_ids = {s['id'] for s in subscriptions}
+
+    corrections = {'users': [], 'plans_rows': [], 'mappings': [], 'unmatched_customers': [], 'orphan_plans_rows': []}
+    for customer_id, user_id in user_by_customer.items():
+        if customer_id not in mapped_customers:
+            corrections['mappings'].append((customer_id, user_id))
+
+    for customer_id in set(subscriptions_by_customer) - set(user_by_customer):
+        corrections['unmatched_customers'].append(customer_id)
+
+    for customer_id, user_id in user_by_customer.items():
+        customer_subscriptions = subscriptions_by_customer.get(customer_id, [])
+        user = users_by_id.get(user_id)
+        if user is not None:
+            want = expected_user(user, current_subscription(customer_subscriptions))
+            if want and any(user.get(field) != want[field] for field in USER_FIELDS):
+                corrections['users'].append((user, want))
+
+        for subscription in customer_subscriptions:
+            have = rows_by_key.get((user_id, subscription['id']))
+            want = {
+                'user_id': user_id,
+                'subscription_id': subscription['id'],
+                'plan': subscription_plan(subscription, None) or (have or {}).get('plan') or DEFAULT_PAID_PLAN,
+                'price_id': subscription_price(subscription),
+                'status': PLANS_ROW_STATUS.get(subscription['status'], subscription['status']),
+                'stripe_customer_id': customer_id
+            }
+            if have is None or any(have.get(field) != want[field] for field in PLANS_ROW_FIELDS):
+                corrections['plans_rows'].append((have, want))
+
+    reconciled_users = set(user_by_customer.values())
+    for row in plans_rows:
+        if (row['user_id'] in reconciled_users and row.get('status') == 'active'
+                and row['subscription_id'] not in stripe_subscription_ids):
+            corrections['orphan_plans_rows'].append(row)
+    return corrections
+
+def apply_corrections(dynamodb, corrections, workers=DEFAULT_WORKERS):
+    """Write the corrections; returns counts of what was applied"""
+    now = datetime.utcnow().isoformat()
+    applied = {'users': 0, 'users_changed_since_scan': 0, 'plans_rows': 0, 'plans_rows_changed_since_scan': 0,
+               'mappings': 0}
+
+    with dynamodb.Table(CUSTOMERS_TABLE).batch_writer() as batch:
+        for customer_id, user_id in corrections['mappings']:
+            batch.put_item(Item={'customer_id': customer_id, 'user_id': user_id, 'created_at': now})
+            applied['mappings'] += 1
+
+    users_table = dynamodb.Table(USERS_TABLE)
+    plans_table = dynamodb.Table(PLANS_TABLE)
+    conditional_failed = dynamodb.meta.client.exceptions.ConditionalCheckFailedException
+
+    def fix_plans_row(correction):
+        have, want = correction
+        names, values = {}, {':now': now, ':api_key': f"ta_live_{uuid.uuid4().hex}"}
+
+        def name(field):
+            placeholder = f'#f{PLANS_ROW_FIELDS.index(field)}'
+            names[placeholder] = field
+            return placeholder
+
+        sets = [f'{name(field)} = :set_{field}' for field in PLANS_ROW_FIELDS if want.get(field) is not None]
+        values.update({f':set_{field}': want[field] for field in PLANS_ROW_FIELDS if want.get(field) is not None})
+        # Other writers' attributes are kept; the webhook's api_key and created_at win
+        sets += ['updated_at = :now', 'reconciled_at = :now',
+                 'created_at = if_not_exists(created_at, :now)', 'api_key = if_not_exists(api_key, :api_key)']
+        if have is None:
+            condition = 'attribute_not_exists(user_id)'
+        else:
+            checks = []
+            for field in PLANS_ROW_FIELDS:
+                if have.get(field) is None:
+                    checks.append(f'attribute_not_exists({name(field)})')
+                else:
+                    checks.append(f'{name(field)} = :seen_{field}')
+                    values[f':seen_{field}'] = have[field]
+            condition = ' AND '.join(checks)
+        try:
+            plans_table.update_item(
+                Key={'user_id': want['user_id'], 'subscription_id': want['subscription_id']},
+                UpdateExpression='SET ' + ', '.join(sets) + ' REMOVE plan_id',
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except conditional_failed:
+            return False
+        bump_version(dynamodb, want['user_id'], 'usage')
+        return True
+
+    def fix_user(correction):
+        user, want = correction
+        values = {':plan': want['plan'], ':status': want['subscription_status'], ':now': now}
+        sets = ['#plan = :plan', 'subscription_status = :status', 'updated_at = :now']
+        if want.get('stripe_subscription_id'):
+            sets.append('stripe_subscription_id = :sid')
+            values[':sid'] = want['stripe_subscription_id']
+        if user.get('plan') is None:
+            condition = 'attribute_not_exists(#plan)'
+        else:
+            condition = '#plan = :seen'
+            values[':seen'] = user['plan']
+        try:
+            users_table.update_item(
+                Key={'user_id': user['user_id']},
+                UpdateExpression='SET ' + ', '.join(sets),
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#plan': 'plan'},
+                ExpressionAttributeValues=values
+            )
+        except conditional_failed:
+            return False
+        bump_version(dynamodb, user['user_id'], 'usage')
+        put_state(dynamodb, {
+            'user_id': user['user_id'],
+            'active': want['subscription_status'] == 'active',
+            'plan': want['plan'],
+            'status': want['subscription_status'],
+            'stripe_subscription_id': want.get('stripe_subscription_id'),
+            'stripe_customer_id': user.get('stripe_customer_id')
+        })
+        return True
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for fixed in executor.map(fix_plans_row, corrections['plans_rows']):
+            applied['plans_rows' if fixed else 'plans_rows_changed_since_scan'] += 1
+        for fixed in executor.map(fix_user, corrections['users']):
+            applied['users' if fixed else 'users_changed_since_scan'] += 1
+    return applied
+
+def reconcile(stripe, dynamodb, since, until=None, dry_run=True, workers=DEFAULT_WORKERS,
+              windows=DEFAULT_WINDOWS, segments=DEFAULT_SEGMENTS):
+    """Run the whole job and return the report"""
+    until = int(until or time.time()) + 1
+    started = time.time()
+
+    customers = fetch_all(stripe.Customer, since, until, workers, windows)
+    subscriptions = fetch_all(stripe.Subscription, since, until, workers, windows, status='all')
+    fetched = time.time()
+
+    users = parallel_scan(
+        dynamodb.Table(USERS_TABLE), segments,
+        ProjectionExpression='user_id, #plan, subscription_status, stripe_customer_id, stripe_subscription_id',
+        ExpressionAttributeNames={'#plan': 'plan'}
+    )
+    plans_rows = parallel_scan(dynamodb.Table(PLANS_TABLE), segments)
+    mapped_customers = {item['customer_id'] for item in parallel_scan(
+        dynamodb.Table(CUSTOMERS_TABLE), segments, ProjectionExpression='customer_id')}
+    scanned = time.time()
+
+    corrections = diff(customers, subscriptions, users, plans_rows, mapped_customers)
+    compared = time.time()
+
+    report = {
+        'dry_run': dry_run,
+        'generated_at': datetime.utcnow().isoformat(),
+        'stripe': {'customers': len(customers), 'subscriptions': len(subscriptions)},
+        'dynamodb': {'users': len(users), 'plans_rows': len(plans_rows), 'mapped_customers': len(mapped_customers)},
+        'corrections': {kind: len(items) for kind, items in corrections.items()},
+        'samples': {
+            'users': [
+                {'user_id': user['user_id'],
+                 **{f: [user.get(f), want[f]] for f in USER_FIELDS if user.get(f) != want[f]}}
+                for user, want in corrections['users'][:SAMPLE_SIZE]
+            ],
+            'plans_rows': [
+                {'user_id': want['user_id'], 'subscription_id': want['subscription_id'], 'missing': have is None,
+                 **{f: [have.get(f), want[f]] for f in PLANS_ROW_FIELDS if have and have.get(f) != want[f]}}
+                for have, want in corrections['plans_rows'][:SAMPLE_SIZE]
+            ],
+            'unmatched_customers': corrections['unmatched_customers'][:SAMPLE_SIZE],
+            'orphan_plans_rows': [
+                {'user_id': r['user_id'], 'subscription_id': r['subscription_id']}
+                for r in corrections['orphan_plans_rows'][:SAMPLE_SIZE]
+            ]
+        }
+    }
+    if not dry_run:
+        report['applied'] = apply_corrections(dynamodb, corrections, workers)
+    report['timings_sec'] = {
+        'stripe_fetch': round(fetched - started, 2),
+        'dynamodb_scan': round(scanned - fetched, 2),
+        'diff': round(compared - scanned, 2),
+        'apply': round(time.time() - compared, 2)
+    }
+    return report
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Reconcile ThreatalyticsUsers/ThreatalyticsPlans with Stripe')
+    parser.add_argument('--dry-run', action='store_true', help='report the differences without writing')
+    parser.add_argument('--report', help='write the JSON report to this file')
+    parser.add_argument('--since', default=DEFAULT_SINCE, help='oldest Stripe object to read (YYYY-MM-DD)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='concurrent Stripe requests')
+    parser.add_argument('--windows', type=int, default=DEFAULT_WINDOWS, help='created-time ranges to page')
+    parser.add_argument('--segments', type=int, default=DEFAULT_SEGMENTS, help='DynamoDB parallel scan segments')
+    parser.add_argument('--stripe-fixture', help='read Stripe objects from a JSON dump instead of the API')
+    args = parser.parse_args(argv)
+
+    import boto3
+    if args.stripe_fixture:
+        stripe = FixtureStripe.load(args.stripe_fixture)
+    else:
+        import stripe
+        from lambda_functions.customer_provisioning import load_stripe_key
+        stripe.api_key = load_stripe_key()
+
+    since = int((datetime.strptime(args.since, '%Y-%m-%d') - datetime(1970, 1, 1)).total_seconds())
+    report = reconcile(stripe, boto3.resource('dynamodb'), since, dry_run=args.dry_run,
+                       workers=args.workers, windows=args.windows, segments=args.segments)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2, default=str)
+    print(json.dumps({k: report[k] for k in ('stripe', 'dynamodb', 'corrections', 'timings_sec')}, default=str))
+    if 'applied' in report:
+        print(f"Applied: {report['applied']}")
+
+if __name__ == '__main__':
+    main()
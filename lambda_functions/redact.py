@@ -1,43 +1,217 @@
 import os
+import re
 import json
 import boto3
 from openai import OpenAI
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from lambda_functions.usage_events import get_writer, usage_user_id
+from lambda_functions.pii_redaction import (
+    redact_local, redact_hybrid, redact_chunked, find_entities, apply_placeholders,
+    sentence_spans, needs_model, locate, merge_entities, chunk_text
+)
+
+REDACT_MODES = ('local', 'hybrid', 'llm')
+DEFAULT_MODE = os.environ.get('REDACT_DEFAULT_MODE', 'llm')
+
+# Local and hybrid inputs longer than one chunk are redacted in chunks unless the
+# request says otherwise; llm mode only chunks when asked to
+CHUNK_CHARS = int(os.environ.get('REDACT_CHUNK_CHARS', '6000'))
+# A chunk whose entity list comes back cut off is retried in halves down to this size
+MIN_SPLIT_CHARS = 500
+DEFAULT_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# System prompt for redaction
+SYSTEM_PROMPT = "You are Threatalytics AI. Redact all personally identifiable information (PII) from the provided text, including names, emails, phone numbers, addresses, etc. Replace with placeholders like [REDACTED]."
+
+SEGMENT_PROMPT = (
+    "You are Threatalytics AI. Each input segment has already had some PII replaced with placeholders such as "
+    "[PERSON] or [EMAIL]; keep those unchanged. Replace any remaining personally identifiable information with a "
+    "placeholder naming its type, e.g. [PERSON], [ADDRESS], [PHONE]. Change nothing else. "
+    'Reply with JSON {"segments": [...]} holding the same number of segments in the same order.'
+)
+
+def llm_redact(client_openai, text):
+    response = client_openai.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": text}
+        ],
+        temperature=0.0
+    )
+    return response.choices[0].message.content
+
+def llm_redact_segments(client_openai, segments):
+    """Hybrid mode: only the sentences the local pass could not clear"""
+    response = client_openai.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": SEGMENT_PROMPT},
+            {"role": "user", "content": json.dumps({"segments": segments})}
+        ],
+        response_format={"type": "json_object"},
+        temperature=0.0
+    )
+    return json.loads(response.choices[0].message.content).get('segments', [])
+
+ENTITY_PROMPT = (
+    "You are Threatalytics AI. List every piece of personally identifiable information in the text: names, "
+    "emails, phone numbers, addresses, dates of birth, ID numbers, etc. "
+    'Reply with JSON {"entities": [{"text": "<exact text as it appears>", '
+    '"type": "PERSON|EMAIL|PHONE|ADDRESS|SSN|DATE_OF_BIRTH|ID|OTHER"}]}.'
+)
+
+class EntityListIncomplete(ValueError):
+    """The model's entity list was cut off at max_tokens or is not valid JSON"""
+
+def llm_find_entities(client_openai, text):
+    """
+    Chunked mode: the model lists entities and the placeholders are applied
+    locally, so one shared map keeps tags consistent across chunks.
+    """
+    response = client_openai.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": ENTITY_PROMPT},
+            {"role": "user", "content": text}
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=1024,
+        temperature=0.0
+    )
+    choice = response.choices[0]
+    if choice.finish_reason == 'length':
+        raise EntityListIncomplete('Entity list was cut off at max_tokens')
+    try:
+        found = json.loads(choice.message.content).get('entities', [])
+    except (TypeError, ValueError, AttributeError) as e:
+        raise EntityListIncomplete(f'Entity list is not valid JSON: {str(e)}')
+    return [
+        (str(e.get('text', '')), re.sub(r'[^A-Z_]', '', str(e.get('type', '')).upper()) or 'OTHER')
+        for e in found if isinstance(e, dict)
+    ]
+
+def model_entities(client_openai, chunk, unmatched):
+    """
+    Spans of the entities the model lists for chunk. An incomplete list is
+    retried on the chunk's halves; below MIN_SPLIT_CHARS the error is raised.
+    The labels of listed entities that do not occur in the chunk verbatim
+    are appended to unmatched.
+    """
+    try:
+        found = llm_find_entities(client_openai, chunk)
+    except EntityListIncomplete:
+        if len(chunk) < 2 * MIN_SPLIT_CHARS:
+            raise
+        spans, offset = [], 0
+        for part in chunk_text(chunk, len(chunk) // 2 + 1):
+            spans.extend((start + offset, end + offset, label)
+                         for start, end, label in model_entities(client_openai, part, unmatched))
+            offset += len(part)
+        return spans
+
+    spans = []
+    for value, label in found:
+        located = locate(chunk, [(value, label)])
+        if not located and value.strip():
+            unmatched.append(label)
+        spans.extend(located)
+    return spans
+
+def chunk_finder(client_openai, mode, unmatched):
+    """find(chunk) -> entity spans; local patterns first, the model only where the mode needs it"""
+    def find(chunk):
+        entities = find_entities(chunk)
+        if mode == 'local':
+            return entities
+        if mode == 'hybrid':
+            cleaned = apply_placeholders(chunk, entities)
+            if not any(needs_model(cleaned[start:end]) for start, end in sentence_spans(cleaned)):
+                return entities
+        return merge_entities(entities, model_entities(client_openai, chunk, unmatched))
+    return find
 
 def lambda_handler(event, context):
     # Initialize AWS clients
     secrets_client = boto3.client('secretsmanager')
-    dynamodb = boto3.resource('dynamodb')
     s3_client = boto3.client('s3')
     sns_client = boto3.client('sns')
     
-    # Get OpenAI key from Secrets Manager
-    secret_name = os.environ['OPENAI_SECRET']
-    secret = json.loads(secrets_client.get_secret_value(SecretId=secret_name)['SecretString'])
-    openai_api_key = secret['api_key']
-    
-    # Initialize OpenAI client
-    client_openai = OpenAI(api_key=openai_api_key)
-    
     # Parse input
     body = json.loads(event['body'])
     input_text = body.get('text', '')
-    
-    # System prompt for redaction
-    system_prompt = "You are Threatalytics AI. Redact all personally identifiable information (PII) from the provided text, including names, emails, phone numbers, addresses, etc. Replace with placeholders like [REDACTED]."
+    mode = body.get('mode') or DEFAULT_MODE
+    chunked = bool(body.get('chunked', mode != 'llm' and len(input_text) > CHUNK_CHARS))
     
     try:
-        # Call GPT
-        response = client_openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": input_text}
-            ],
-            temperature=0.0
-        )
+        concurrency = int(body.get('concurrency', DEFAULT_CONCURRENCY))
+    except (TypeError, ValueError):
+        concurrency = 0
+    
+    if mode not in REDACT_MODES or not 1 <= concurrency <= MAX_CONCURRENCY:
+        return {
+            'statusCode': 400,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+                'Access-Control-Allow-Methods': 'POST,OPTIONS'
+            },
+            'body': json.dumps({
+                "error": f"mode must be one of: {', '.join(REDACT_MODES)}; concurrency must be 1-{MAX_CONCURRENCY}"
+            })
+        }
+    
+    # Local mode never calls OpenAI
+    client_openai = None
+    if mode != 'local':
+        # Get OpenAI key from Secrets Manager
+        secret_name = os.environ['OPENAI_SECRET']
+        secret = json.loads(secrets_client.get_secret_value(SecretId=secret_name)['SecretString'])
+        openai_api_key = secret['api_key']
         
-        redacted = response.choices[0].message.content
+        # Initialize OpenAI client
+        client_openai = OpenAI(api_key=openai_api_key)
+    
+    try:
+        entities = {}
+        segments_sent = 0
+        chunks = 1
+        # Labels of entities the model listed but that were not found verbatim, so stayed unredacted
+        unmatched = []
+        if chunked:
+            try:
+                # Placeholders are numbered per document: [PERSON_1] is the same person in every chunk
+                redacted, entities, chunks = redact_chunked(
+                    input_text, chunk_finder(client_openai, mode, unmatched), CHUNK_CHARS, concurrency
+                )
+            except EntityListIncomplete as e:
+                # The model could not list a chunk's entities even in small pieces; have it redact each chunk
+                print(f"Chunked redaction fell back to full-text redaction per chunk: {str(e)}")
+                parts = chunk_text(input_text, CHUNK_CHARS)
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    redacted = ''.join(executor.map(
+                        lambda part: llm_redact(client_openai, redact_local(part)[0]), parts
+                    ))
+                entities, chunks, unmatched = {}, len(parts), []
+            if unmatched:
+                print(f"Model listed {len(unmatched)} entities not found verbatim in the text: {sorted(set(unmatched))}")
+        elif mode == 'local':
+            redacted, entities = redact_local(input_text)
+        elif mode == 'hybrid':
+            try:
+                redacted, entities, segments_sent = redact_hybrid(
+                    input_text, lambda segments: llm_redact_segments(client_openai, segments)
+                )
+            except ValueError as e:
+                # Model reply did not line up with the segments; redact the locally cleaned text whole
+                print(f"Hybrid redaction fell back to full text: {str(e)}")
+                local_text, entities = redact_local(input_text)
+                redacted = llm_redact(client_openai, local_text)
+                segments_sent = 1
+        else:
+            redacted = llm_redact(client_openai, input_text)
         
         # Log structured data to S3
         log_data = {
@@ -45,6 +219,10 @@ def lambda_handler(event, context):
             'endpoint': 'redact',
             'api_key': event['headers'].get('x-api-key'),
             'input_length': len(input_text),
+            'mode': mode,
+            'segments_sent': segments_sent,
+            'chunks': chunks,
+            'unmatched_entities': len(unmatched),
             'request_id': context.aws_request_id,
             'status': 'success'
         }
@@ -57,15 +235,9 @@ def lambda_handler(event, context):
         )
         
         # Log usage
-        api_key = event['headers'].get('x-api-key')
-        if api_key:
-            table = dynamodb.Table('ThreatalyticsUsage')
-            table.put_item(Item={
-                'api_key': api_key,
-                'timestamp': str(context.aws_request_id),
-                'endpoint': 'redact',
-                'usage': 1
-            })
+        usage = get_writer()
+        usage.record(usage_user_id(event), 'redact', request_id=context.aws_request_id)
+        usage.flush()
         
         return {
             'statusCode': 200,
@@ -74,7 +246,14 @@ def lambda_handler(event, context):
                 'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
                 'Access-Control-Allow-Methods': 'POST,OPTIONS'
             },
-            'body': json.dumps({"redacted": redacted})
+            'body': json.dumps({
+                "redacted": redacted,
+                "mode": mode,
+                "entities": entities,
+                "segments_sent": segments_sent,
+                "chunks": chunks,
+                "unmatched_entities": len(unmatched)
+            })
         }
         
     except Exception as e:
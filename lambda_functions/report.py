@@ -2,6 +2,7 @@ import os
 import json
 import boto3
 from openai import OpenAI
+from lambda_functions.usage_events import get_writer, usage_user_id
 
 def lambda_handler(event, context):
     # Get OpenAI key from Secrets Manager
@@ -33,16 +34,9 @@ def lambda_handler(event, context):
     report = response.choices[0].message.content
     
     # Log usage
-    api_key = event['headers'].get('x-api-key')
-    if api_key:
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('ThreatalyticsUsage')
-        table.put_item(Item={
-            'api_key': api_key,
-            'timestamp': str(context.aws_request_id),
-            'endpoint': 'report',
-            'usage': 1
-        })
+    usage = get_writer()
+    usage.record(usage_user_id(event), 'report', request_id=context.aws_request_id)
+    usage.flush()
     
     return {
         'statusCode': 200,
@@ -0,0 +1,174 @@
+"""
+Revenue ledger for the admin dashboard.
+
+ThreatalyticsRevenueLedger (pk, sk) holds:
+
+    pk='charge#<charge id>', sk='charge'   one row per counted charge
+    pk='daily',   sk='YYYY-MM-DD'          amount (cents) and count per day
+    pk='monthly', sk='YYYY-MM'             amount (cents) and count per month
+    pk='cursor',  sk='balance_transactions' created time up to which charges are synced
+
+A charge is counted with one transaction: a conditional put of its row plus
+ADDs on its day and month. A charge already in the ledger fails the
+condition and changes nothing, so the webhook (invoice.payment_succeeded)
+and the periodic Stripe sync can both report the same charge.
+
+The sync walks forward from the cursor in day-long windows of created
+time and saves the cursor after each one, so a long first backfill that
+hits the Lambda timeout resumes from its last window on the next run.
+
+The admin endpoints read the daily/monthly rows with a single Query.
+
+    python -m lambda_functions.revenue_ledger [--days 365]   # manual sync / first backfill
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timedelta
+
+LEDGER_TABLE = os.environ.get('REVENUE_LEDGER_TABLE', 'ThreatalyticsRevenueLedger')
+CURSOR_KEY = {'pk': 'cursor', 'sk': 'balance_transactions'}
+INITIAL_DAYS = 365
+# Re-read a little before the cursor; already counted charges are skipped
+OVERLAP_SECONDS = 600
+WINDOW_SECONDS = 86400
+
+def serialize(value):
+    """DynamoDB wire format for the only types the ledger stores"""
+    return {'N': str(value)} if isinstance(value, int) else {'S': str(value)}
+
+def record_charge(dynamodb, charge_id, amount, created, currency='usd', source='sync', **extra):
+    """Count a charge once. Returns False if it was already in the ledger."""
+    when = datetime.utcfromtimestamp(int(created))
+    day, month = when.strftime('%Y-%m-%d'), when.strftime('%Y-%m')
+    row = {
+        'pk': f'charge#{charge_id}',
+        'sk': 'charge',
+        'amount': int(amount),
+        'currency': currency,
+        'created': int(created),
+        'date': day,
+        'source': source,
+        **{k: v for k, v in extra.items() if v is not None}
+    }
+
+    def add(pk, sk):
+        return {'Update': {
+            'TableName': LEDGER_TABLE,
+            'Key': {'pk': serialize(pk), 'sk': serialize(sk)},
+            'UpdateExpression': 'ADD amount :amount, #count :one',
+            'ExpressionAttributeNames': {'#count': 'count'},
+            'ExpressionAttributeValues': {':amount': serialize(int(amount)), ':one': serialize(1)}
+        }}
+
+    client = dynamodb.meta.client
+    try:
+        client.transact_write_items(TransactItems=[
+            {'Put': {
+                'TableName': LEDGER_TABLE,
+                'Item': {k: serialize(v) for k, v in row.items()},
+                'ConditionExpression': 'attribute_not_exists(pk)'
+            }},
+            add('daily', day),
+            add('monthly', month)
+        ])
+    except client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons') or []
+        if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+            return False
+        raise
+    return True
+
+def sync(dynamodb, stripe, now=None, initial_days=INITIAL_DAYS, deadline=None):
+    """
+    Pull charge balance transactions newer than the stored cursor into the
+    ledger, one window at a time from the oldest. Stops early once time.time()
+    passes `deadline`. Returns {'seen': n, 'recorded': n, 'cursor': ts, 'complete': bool}.
+    """
+    now = int(now or time.time())
+    table = dynamodb.Table(LEDGER_TABLE)
+    cursor_item = table.get_item(Key=CURSOR_KEY).get('Item')
+    if cursor_item:
+        start = int(cursor_item['created']) - OVERLAP_SECONDS
+    else:
+        start = now - initial_days * 86400
+
+    seen = recorded = 0
+    cursor = int(cursor_item['created']) if cursor_item else start
+    # Stripe lists newest first, so only a fully read window can move the cursor
+    while start <= now:
+        if deadline and time.time() > deadline:
+            break
+        end = min(start + WINDOW_SECONDS, now + 1)
+        transactions = stripe.BalanceTransaction.list(created={'gte': start, 'lt': end}, type='charge', limit=100)
+        for txn in transactions.auto_paging_iter():
+            seen += 1
+            charge_id = txn.get('source') or txn['id']
+            if record_charge(dynamodb, charge_id, txn['amount'], txn['created'], txn.get('currency', 'usd'),
+                             source='sync', balance_transaction=txn['id']):
+                recorded += 1
+        cursor = max(cursor, end - 1)
+        table.put_item(Item={**CURSOR_KEY, 'created': cursor, 'synced_at': int(time.time())})
+        start = end
+
+    return {'seen': seen, 'recorded': recorded, 'cursor': cursor, 'complete': start > now}
+
+def daily_totals(dynamodb, days, now=None):
+    """[{'date', 'revenue' (dollars), 'subscriptions' (charges)}], newest first"""
+    since = ((now or datetime.utcnow()) - timedelta(days=days)).strftime('%Y-%m-%d')
+    items = query_totals(dynamodb, 'daily', since)
+    return [
+        {'date': item['sk'], 'revenue': int(item.get('amount', 0)) / 100, 'subscriptions': int(item.get('count', 0))}
+        for item in reversed(items)
+    ]
+
+def monthly_totals(dynamodb, months, now=None):
+    """{'YYYY-MM': dollars} for the last `months` months including this one"""
+    now = now or datetime.utcnow()
+    year, month = now.year, now.month - (months - 1)
+    while month < 1:
+        year, month = year - 1, month + 12
+    items = query_totals(dynamodb, 'monthly', f'{year:04d}-{month:02d}')
+    return {item['sk']: int(item.get('amount', 0)) / 100 for item in items}
+
+def query_totals(dynamodb, pk, since):
+    kwargs = {
+        'KeyConditionExpression': 'pk = :pk AND sk >= :since',
+        'ExpressionAttributeValues': {':pk': pk, ':since': since}
+    }
+    table = dynamodb.Table(LEDGER_TABLE)
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def sync_handler(event, context):
+    """Scheduled sync (see serverless.yml revenueSync)"""
+    import boto3
+    import stripe
+    from lambda_functions.customer_provisioning import load_stripe_key
+
+    stripe.api_key = stripe.api_key or load_stripe_key()
+    # Leave time to save the cursor; the next run picks up from there
+    deadline = time.time() + context.get_remaining_time_in_millis() / 1000 - 30
+    result = sync(boto3.resource('dynamodb'), stripe, deadline=deadline)
+    print(f"Revenue sync: {result}")
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sync Stripe charges into the revenue ledger')
+    parser.add_argument('--days', type=int, default=INITIAL_DAYS, help='history to load when there is no cursor yet')
+    args = parser.parse_args(argv)
+
+    import boto3
+    import stripe
+    from lambda_functions.customer_provisioning import load_stripe_key
+
+    stripe.api_key = load_stripe_key()
+    print(sync(boto3.resource('dynamodb'), stripe, initial_days=args.days))
+
+if __name__ == '__main__':
+    main()
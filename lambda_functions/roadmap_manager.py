@@ -5,6 +5,7 @@ from datetime import datetime
 import csv
 from io import StringIO
 import base64
+from lambda_functions.etags import make_etag, if_none_match, etag_matches, cache_headers, not_modified
 
 def get_user_id_from_token(event):
     """Extract user_id from JWT token in Authorization header"""
@@ -57,12 +58,174 @@ DEFAULT_ROADMAP = {
     }
 }
 
+# Most task updates one POST may carry
+MAX_BATCH_UPDATES = 50
+
+class VersionConflict(Exception):
+    """Raised when the stored roadmap version differs from the caller's"""
+    def __init__(self, current_version):
+        super().__init__('Roadmap was modified by someone else')
+        self.current_version = current_version
+
+def seed_roadmap(roadmap_table, user_id):
+    """Create the default roadmap at version 0 unless one already exists"""
+    now = datetime.utcnow().isoformat()
+    try:
+        roadmap_table.put_item(
+            Item={
+                'user_id': user_id,
+                'roadmap_data': DEFAULT_ROADMAP,
+                'version': 0,
+                'created_at': now,
+                'updated_at': now
+            },
+            ConditionExpression='attribute_not_exists(user_id)'
+        )
+    except roadmap_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+
+def parse_updates(updates):
+    """
+    Validate [{category, index, status}, ...]; later entries for the same
+    task win, since one UpdateExpression cannot set a path twice.
+    """
+    parsed = {}
+    for update in updates:
+        category = update.get('category')
+        index = update.get('index')
+        status = update.get('status')
+        if not category or category == 'database' or not isinstance(status, str) or not status:
+            raise ValueError('category and status required')
+        if isinstance(index, bool) or not isinstance(index, int) or index < 0:
+            raise ValueError('index must be a non-negative integer')
+        parsed[(category, index)] = status
+    return parsed
+
+def apply_status_updates(roadmap_table, user_id, updates, expected_version=None):
+    """
+    Set roadmap_data.<category>[i].status for every update in one update_item
+    and bump the version. With expected_version the write only succeeds if
+    nobody else has written since. Returns the new version.
+    """
+    names = {'#v': 'version'}
+    values = {':one': 1, ':zero': 0, ':now': datetime.utcnow().isoformat()}
+    sets = ['updated_at = :now']
+    conditions = []
+
+    categories = {}
+    for n, ((category, index), status) in enumerate(sorted(updates.items())):
+        if category not in categories:
+            categories[category] = f'#c{len(categories)}'
+            names[categories[category]] = category
+        path = f'roadmap_data.{categories[category]}[{index}]'
+        values[f':s{n}'] = status
+        sets.append(f'{path}.#st = :s{n}')
+        conditions.append(f'attribute_exists({path})')
+    names['#st'] = 'status'
+
+    if expected_version is not None:
+        values[':expected'] = expected_version
+        if expected_version == 0:
+            conditions.append('(attribute_not_exists(#v) OR #v = :expected)')
+        else:
+            conditions.append('#v = :expected')
+
+    update_kwargs = {
+        'Key': {'user_id': user_id},
+        'UpdateExpression': 'SET ' + ', '.join(sets) + ', #v = if_not_exists(#v, :zero) + :one',
+        'ConditionExpression': ' AND '.join(conditions),
+        'ExpressionAttributeNames': names,
+        'ExpressionAttributeValues': values,
+        'ReturnValues': 'UPDATED_NEW'
+    }
+
+    for attempt in range(2):
+        try:
+            response = roadmap_table.update_item(**update_kwargs)
+            return int(response['Attributes']['version'])
+        except roadmap_table.meta.client.exceptions.ConditionalCheckFailedException:
+            # Work out which part of the condition failed (rare path)
+            current = roadmap_table.get_item(
+                Key={'user_id': user_id},
+                ProjectionExpression='#v, user_id',
+                ExpressionAttributeNames={'#v': 'version'}
+            ).get('Item')
+            if current is None and attempt == 0:
+                seed_roadmap(roadmap_table, user_id)
+                continue
+            current_version = int(current.get('version', 0)) if current else 0
+            if expected_version is not None and current_version != expected_version:
+                raise VersionConflict(current_version)
+            raise ValueError('Invalid category or index')
+
+def current_version(roadmap_table, user_id):
+    item = roadmap_table.get_item(
+        Key={'user_id': user_id},
+        ProjectionExpression='#v, user_id',
+        ExpressionAttributeNames={'#v': 'version'}
+    ).get('Item')
+    return int(item.get('version', 0)) if item else 0
+
+def get_version(event, body, roadmap_table, user_id):
+    """
+    Expected version from the body or an If-Match header, if the client sent
+    one. If-Match may carry the version number or the ETag of the JSON
+    roadmap; an ETag that is no longer current is a version conflict.
+    """
+    version = body.get('version')
+    if version is not None:
+        try:
+            return int(version)
+        except (TypeError, ValueError):
+            raise ValueError('version must be an integer')
+
+    headers = event.get('headers') or {}
+    header = (headers.get('If-Match') or headers.get('if-match') or '').strip()
+    if not header or header == '*':
+        return None
+    if header.strip('"').isdigit():
+        return int(header.strip('"'))
+
+    current = current_version(roadmap_table, user_id)
+    if roadmap_etag(user_id, current, 'json') in [tag.strip() for tag in header.split(',')]:
+        return current
+    raise VersionConflict(current)
+
+def roadmap_etag(user_id, version, representation):
+    return make_etag('roadmap', representation, user_id, version)
+
+def check_not_modified(event, roadmap_table, user_id, representation, headers):
+    """
+    Answer If-None-Match from the version attribute alone (a projected read).
+    Returns a 304 response, or None if the full roadmap must be sent. The
+    304 carries X-Roadmap-Version like the 200, so a client that revalidated
+    still knows the version to send with its next update.
+    """
+    if not if_none_match(event):
+        return None
+    item = roadmap_table.get_item(
+        Key={'user_id': user_id},
+        ProjectionExpression='#v, user_id',
+        ExpressionAttributeNames={'#v': 'version'}
+    ).get('Item')
+    if item is None:
+        return None
+    version = int(item.get('version', 0))
+    etag = roadmap_etag(user_id, version, representation)
+    if not etag_matches(event, etag):
+        return None
+    return not_modified({
+        **headers,
+        'X-Roadmap-Version': str(version),
+        'Access-Control-Expose-Headers': 'X-Roadmap-Version'
+    }, etag)
+
 def lambda_handler(event, context):
     """
     Roadmap Manager Lambda - manages project roadmap and launch checklist
     Endpoints:
     - GET /admin/roadmap - Get roadmap for user
-    - POST /admin/roadmap/update - Update task status
+    - POST /admin/roadmap/update - Update task status ({category, index, status} or {updates: [...]}, optional version)
     - GET /admin/roadmap/export - Export roadmap as CSV
     """
     dynamodb = boto3.resource('dynamodb')
@@ -88,9 +251,14 @@ def lambda_handler(event, context):
     try:
         if http_method == 'GET' and '/export' in path:
             # Export roadmap as CSV
+            cached = check_not_modified(event, roadmap_table, user_id, 'csv', {'Access-Control-Allow-Origin': '*'})
+            if cached:
+                return cached
+
             # Get roadmap from DynamoDB
             response = roadmap_table.get_item(Key={'user_id': user_id})
             roadmap = response.get('Item', {}).get('roadmap_data', DEFAULT_ROADMAP)
+            etag = roadmap_etag(user_id, int(response.get('Item', {}).get('version', 0)), 'csv')
             
             # Generate CSV
             output = StringIO()
@@ -111,89 +279,87 @@ def lambda_handler(event, context):
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
                     'Content-Type': 'text/csv',
-                    'Content-Disposition': 'attachment; filename=roadmap.csv'
+                    'Content-Disposition': 'attachment; filename=roadmap.csv',
+                    **cache_headers(etag)
                 },
                 'body': csv_data
             }
             
         elif http_method == 'GET':
+            cached = check_not_modified(event, roadmap_table, user_id, 'json', {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key,If-Match',
+                'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+            })
+            if cached:
+                return cached
+
             # Get roadmap
             response = roadmap_table.get_item(Key={'user_id': user_id})
             
             if 'Item' in response:
                 roadmap = response['Item']['roadmap_data']
+                version = int(response['Item'].get('version', 0))
             else:
                 # Initialize with default roadmap
                 roadmap = DEFAULT_ROADMAP
-                roadmap_table.put_item(Item={
-                    'user_id': user_id,
-                    'roadmap_data': roadmap,
-                    'created_at': datetime.utcnow().isoformat(),
-                    'updated_at': datetime.utcnow().isoformat()
-                })
+                version = 0
+                seed_roadmap(roadmap_table, user_id)
             
             return {
                 'statusCode': 200,
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
-                    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key,If-Match',
+                    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS',
+                    'X-Roadmap-Version': str(version),
+                    **cache_headers(roadmap_etag(user_id, version, 'json'), 'X-Roadmap-Version')
                 },
                 'body': json.dumps(roadmap, default=str)
             }
             
         elif http_method == 'POST':
-            # Update task status
+            # Update task status (one task or a batch) in a single update_item
             body = json.loads(event['body'])
-            category = body.get('category')
-            index = body.get('index')
-            status = body.get('status')
-            
-            if not all([category, index is not None, status]):
-                return {
-                    'statusCode': 400,
-                    'headers': {
-                        'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
-                        'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
-                    },
-                    'body': json.dumps({'error': 'category, index, and status required'})
-                }
-            
-            # Get current roadmap
-            response = roadmap_table.get_item(Key={'user_id': user_id})
-            roadmap = response.get('Item', {}).get('roadmap_data', DEFAULT_ROADMAP)
-            
-            # Update status
-            if category in roadmap and index < len(roadmap[category]):
-                roadmap[category][index]['status'] = status
-                
-                # Save back to DynamoDB
-                roadmap_table.put_item(Item={
-                    'user_id': user_id,
-                    'roadmap_data': roadmap,
-                    'updated_at': datetime.utcnow().isoformat()
-                })
-                
+            updates = body.get('updates')
+            if updates is None:
+                updates = [body]
+
+            try:
+                if not isinstance(updates, list) or not updates or len(updates) > MAX_BATCH_UPDATES:
+                    raise ValueError(f'updates must be a list of 1-{MAX_BATCH_UPDATES} items')
+                parsed = parse_updates(updates)
+                version = apply_status_updates(roadmap_table, user_id, parsed, get_version(event, body, roadmap_table, user_id))
+            except VersionConflict as e:
                 return {
-                    'statusCode': 200,
+                    'statusCode': 409,
                     'headers': {
                         'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key,If-Match',
                         'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
                     },
-                    'body': json.dumps({'ok': True, 'message': 'Status updated'})
+                    'body': json.dumps({'error': str(e), 'version': e.current_version})
                 }
-            else:
+            except ValueError as e:
                 return {
                     'statusCode': 400,
                     'headers': {
                         'Access-Control-Allow-Origin': '*',
-                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key',
+                        'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key,If-Match',
                         'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
                     },
-                    'body': json.dumps({'error': 'Invalid category or index'})
+                    'body': json.dumps({'error': str(e)})
                 }
+
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization,X-API-Key,If-Match',
+                    'Access-Control-Allow-Methods': 'GET,POST,OPTIONS'
+                },
+                'body': json.dumps({'ok': True, 'message': 'Status updated', 'version': version, 'updated': len(parsed)})
+            }
                 
     except Exception as e:
         print(f"Error in roadmap_manager: {str(e)}")
@@ -0,0 +1,106 @@
+import json
+import boto3
+import time
+import base64
+from lambda_functions.search_index import SearchIndex
+
+MAX_RESULTS = 50
+
+def get_user_id_from_token(event):
+    """Extract user_id from JWT token in Authorization header"""
+    try:
+        if 'requestContext' in event and 'authorizer' in event['requestContext']:
+            if 'claims' in event['requestContext']['authorizer']:
+                return event['requestContext']['authorizer']['claims']['sub']
+        
+        auth_header = event.get('headers', {}).get('Authorization') or event.get('headers', {}).get('authorization')
+        if not auth_header:
+            raise Exception('No Authorization header found')
+        
+        token = auth_header.replace('Bearer ', '').replace('bearer ', '')
+        parts = token.split('.')
+        if len(parts) != 3:
+            raise Exception('Invalid token format')
+        
+        payload = parts[1]
+        payload += '=' * (4 - len(payload) % 4)
+        decoded = base64.urlsafe_b64decode(payload)
+        claims = json.loads(decoded)
+        
+        return claims.get('sub')
+    except Exception as e:
+        print(f"Error extracting user_id: {str(e)}")
+        return None
+
+def lambda_handler(event, context):
+    """
+    Search Lambda - full-text search over the user's conversations and activity notes
+    Endpoint: GET /search?q={query}&type={conversation|activity}&limit={n}
+    """
+    dynamodb = boto3.resource('dynamodb')
+    
+    # Get user ID from token
+    user_id = get_user_id_from_token(event)
+    
+    if not user_id:
+        return {
+            'statusCode': 401,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            },
+            'body': json.dumps({'message': 'Unauthorized'})
+        }
+    
+    try:
+        params = event.get('queryStringParameters') or {}
+        query = params.get('q', '').strip()
+        doc_type = params.get('type')
+        
+        if not query:
+            return {
+                'statusCode': 400,
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                    'Access-Control-Allow-Methods': 'GET,OPTIONS'
+                },
+                'body': json.dumps({'error': 'q is required'})
+            }
+        
+        try:
+            limit = max(1, min(int(params.get('limit', 10)), MAX_RESULTS))
+        except ValueError:
+            limit = 10
+        
+        started = time.time()
+        results = SearchIndex(dynamodb, user_id).search(query, limit=limit, doc_type=doc_type)
+        took_ms = round((time.time() - started) * 1000, 1)
+        
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            },
+            'body': json.dumps({
+                'query': query,
+                'results': results,
+                'count': len(results),
+                'took_ms': took_ms
+            }, default=str)
+        }
+        
+    except Exception as e:
+        print(f"Error in search: {str(e)}")
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Headers': 'Content-Type,Authorization',
+                'Access-Control-Allow-Methods': 'GET,OPTIONS'
+            },
+            'body': json.dumps({'error': str(e)})
+        }
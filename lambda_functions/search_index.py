@@ -0,0 +1,535 @@
+"""
+Per-user inverted index over conversations and activity notes.
+
+Everything lives in one DynamoDB table keyed by (user_id, sk):
+- sk 'meta'                  -> next_ordinal, doc_count, total_length
+- sk 'ref#<type>#<id>'       -> ordinal, length, fingerprint_z (term -> crc of its positions)
+- sk 'doc#<ordinal>'         -> doc_type, doc_id, title, text_z (for snippets)
+- sk 'len#<shard>'           -> l<ordinal>: token count, one attribute per document
+- sk 'term#<term>#<shard>'   -> postings, df, ver
+
+Documents get increasing ordinals and are grouped into shards of
+SHARD_DOCS ordinals. A term's postings are split across one item per
+shard, so no item grows past DynamoDB's 400 KB limit however common the
+term. Within a shard, postings are sorted by ordinal and stored
+column-wise as zlib-compressed uint32 arrays: [doc count | ordinal deltas
+| doc types | term frequencies | stored position counts | position
+deltas]. At most MAX_POSITIONS positions per document are kept; they
+are only used for snippets.
+
+A document's length is stored once, in its len#<shard> attribute, rather
+than copied into every posting. Re-indexing a document therefore rewrites
+only the terms whose positions changed, and BM25 still sees the current
+length.
+
+Writes happen in the search indexer worker (lambda_functions/search_indexer.py).
+Request handlers call queue_reindex, and the worker re-reads the source
+item. A search costs a Query per term plus BatchGetItems for the length
+shards and the top documents.
+"""
+
+import os
+import re
+import sys
+import gzip
+import json
+import math
+import uuid
+import zlib
+import heapq
+from array import array
+from itertools import accumulate
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+SEARCH_TABLE = os.environ.get('SEARCH_TABLE', 'ThreatalyticsSearchIndex')
+SEARCH_INDEX_QUEUE_URL = os.environ.get('SEARCH_INDEX_QUEUE_URL', '')
+SQS_BATCH_SIZE = 10      # SendMessageBatch limit
+
+DOC_TYPES = ('conversation', 'activity')
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MAX_TERM_LENGTH = 40
+MAX_QUERY_TERMS = 10
+MAX_STORED_TEXT = 100000  # characters kept per document for snippets
+MAX_POSITIONS = 32        # positions kept per term per document, for snippets
+SHARD_DOCS = 512          # ordinals per postings / lengths shard
+SNIPPET_RADIUS = 12       # tokens either side of the best match
+WRITE_WORKERS = 8
+WRITE_RETRIES = 3
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have he her his i if in into is it its
+me my no not of on or our she so that the their them then there these they this
+to was we were what when which who will with you your
+""".split())
+
+# --- Encoding helpers ---
+def _to_bytes(values):
+    arr = array('I', values)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr.tobytes()
+
+def _from_bytes(data):
+    arr = array('I')
+    arr.frombytes(data)
+    if sys.byteorder != 'little':
+        arr.byteswap()
+    return arr
+
+def encode_postings(entries):
+    """entries: list of (ordinal, type_code, tf, positions) sorted by ordinal"""
+    ordinals = [e[0] for e in entries]
+    columns = [len(entries)]
+    columns += [o - p for o, p in zip(ordinals, [0] + ordinals[:-1])]
+    columns += [e[1] for e in entries]
+    columns += [e[2] for e in entries]
+    columns += [len(e[3]) for e in entries]
+    for entry in entries:
+        positions = entry[3]
+        columns += [q - p for q, p in zip(positions, [0] + positions[:-1])]
+    return zlib.compress(_to_bytes(columns), 1)
+
+class PostingList:
+    """Decoded view over one shard of a term's postings"""
+
+    def __init__(self, data):
+        values = _from_bytes(zlib.decompress(data)) if data else array('I', [0])
+        n = values[0]
+        self.ordinals = list(accumulate(values[1:1 + n]))
+        self.types = values[1 + n:1 + 2 * n]
+        self.freqs = values[1 + 2 * n:1 + 3 * n]
+        self.stored = values[1 + 3 * n:1 + 4 * n]
+        self.position_deltas = values[1 + 4 * n:]
+        self._offsets = None
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def positions(self, i):
+        if self._offsets is None:
+            self._offsets = [0] + list(accumulate(self.stored))
+        return list(accumulate(self.position_deltas[self._offsets[i]:self._offsets[i + 1]]))
+
+    def entries(self):
+        return [
+            (self.ordinals[i], self.types[i], self.freqs[i], self.positions(i))
+            for i in range(len(self))
+        ]
+
+def append_posting(data, ordinal, type_code, tf, positions):
+    """
+    Splice a new highest-ordinal entry into encoded postings using array
+    slices only. Returns None when the ordinal isn't the highest, in which
+    case the caller falls back to decode/modify/encode.
+    """
+    values = _from_bytes(zlib.decompress(data))
+    n = values[0]
+    last = sum(values[1:1 + n])
+    if ordinal <= last:
+        return None
+    deltas = [q - p for q, p in zip(positions, [0] + positions[:-1])]
+    columns = array('I', [n + 1])
+    columns += values[1:1 + n] + array('I', [ordinal - last])
+    columns += values[1 + n:1 + 2 * n] + array('I', [type_code])
+    columns += values[1 + 2 * n:1 + 3 * n] + array('I', [tf])
+    columns += values[1 + 3 * n:1 + 4 * n] + array('I', [len(positions)])
+    columns += values[1 + 4 * n:] + array('I', deltas)
+    return zlib.compress(_to_bytes(columns), 1), n + 1
+
+def decode_postings(data):
+    return PostingList(data).entries()
+
+def shard_of(ordinal):
+    return ordinal // SHARD_DOCS
+
+def term_sk(term, shard):
+    return f'term#{term}#{shard:06d}'
+
+def binary_value(value):
+    """DynamoDB returns Binary wrappers; the codecs want raw bytes"""
+    if value is None:
+        return b''
+    return value.value if hasattr(value, 'value') else bytes(value)
+
+def positions_crc(positions, crc=0):
+    """crc32 over absolute positions; chaining it gives the same result as one pass"""
+    return zlib.crc32(_to_bytes(positions), crc)
+
+# --- Tokenizing ---
+def iter_tokens(text):
+    """Yield (position, token, match) for every token, stopwords included"""
+    for position, match in enumerate(TOKEN_RE.finditer(text.lower())):
+        yield position, match.group(), match
+
+def analyze(text, offset=0):
+    """Return ({term: [positions]}, token_count) for indexable terms"""
+    terms = {}
+    count = 0
+    for position, token, _ in iter_tokens(text):
+        count = position + 1
+        if token in STOPWORDS or len(token) > MAX_TERM_LENGTH:
+            continue
+        terms.setdefault(token, []).append(position + offset)
+    return terms, count
+
+def query_terms(query):
+    terms = []
+    for _, token, _ in iter_tokens(query or ''):
+        if token not in STOPWORDS and len(token) <= MAX_TERM_LENGTH and token not in terms:
+            terms.append(token)
+    return terms[:MAX_QUERY_TERMS]
+
+def build_snippet(text, positions, radius=SNIPPET_RADIUS):
+    """Cut a window of tokens around the earliest matched position"""
+    if not text:
+        return ''
+    if not positions:
+        return text[:radius * 12].strip()
+
+    anchor = min(positions)
+    first, last = max(0, anchor - radius), anchor + radius
+    start = end = None
+    for position, _, match in iter_tokens(text):
+        if position == first:
+            start = match.start()
+        if position >= last:
+            end = match.end()
+            break
+    if start is None:
+        # Match falls beyond the stored text
+        return text[:radius * 12].strip()
+
+    snippet = ' '.join(text[start:end].split())
+    if start > 0:
+        snippet = '...' + snippet
+    if end is not None and end < len(text):
+        snippet += '...'
+    return snippet
+
+def compress_json(value):
+    return gzip.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+def decompress_json(value, default):
+    data = binary_value(value)
+    return json.loads(gzip.decompress(data)) if data else default
+
+def decompress_text(value):
+    data = binary_value(value)
+    return gzip.decompress(data).decode('utf-8') if data else ''
+
+
+class SearchIndex:
+    """Incremental inverted index for one user's documents"""
+
+    def __init__(self, dynamodb, user_id, table_name=SEARCH_TABLE):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.table = dynamodb.Table(table_name)
+        self.user_id = user_id
+
+    def _key(self, sk):
+        return {'user_id': self.user_id, 'sk': sk}
+
+    # --- Writes ---
+    def index_document(self, doc_type, doc_id, title, text):
+        """Index or re-index a whole document; only changed terms are rewritten"""
+        full_text = f"{title or ''}\n{text or ''}"
+        positions, length = analyze(full_text)
+        fingerprint = {term: positions_crc(p) for term, p in positions.items()}
+
+        ref = self.table.get_item(Key=self._key(f'ref#{doc_type}#{doc_id}')).get('Item')
+        if ref:
+            ordinal = int(ref['ordinal'])
+            old_length = int(ref.get('length', 0))
+            old_fingerprint = decompress_json(ref.get('fingerprint_z'), {})
+        else:
+            ordinal = self._allocate_ordinal()
+            old_length = 0
+            old_fingerprint = {}
+
+        changed = {t: p for t, p in positions.items() if old_fingerprint.get(t) != fingerprint[t]}
+        removed = [t for t in old_fingerprint if t not in positions]
+        self._update_terms(ordinal, doc_type, changed, removed)
+        self._set_length(ordinal, length)
+
+        self._save_document(doc_type, doc_id, ordinal, title, full_text, length, fingerprint)
+        self._update_meta(0 if ref else 1, length - old_length)
+
+    def remove_document(self, doc_type, doc_id):
+        ref = self.table.get_item(Key=self._key(f'ref#{doc_type}#{doc_id}')).get('Item')
+        if not ref:
+            return
+
+        ordinal = int(ref['ordinal'])
+        fingerprint = decompress_json(ref.get('fingerprint_z'), {})
+        self._update_terms(ordinal, doc_type, {}, list(fingerprint))
+        self._set_length(ordinal, None)
+
+        self.table.delete_item(Key=self._key(f'ref#{doc_type}#{doc_id}'))
+        self.table.delete_item(Key=self._key(f'doc#{ordinal}'))
+        self._update_meta(-1, -int(ref.get('length', 0)))
+
+    def clear(self):
+        """Delete the user's whole index (before a rebuild)"""
+        kwargs = {
+            'KeyConditionExpression': 'user_id = :uid',
+            'ExpressionAttributeValues': {':uid': self.user_id},
+            'ProjectionExpression': 'user_id, sk'
+        }
+        with self.table.batch_writer() as batch:
+            while True:
+                response = self.table.query(**kwargs)
+                for item in response.get('Items', []):
+                    batch.delete_item(Key=self._key(item['sk']))
+                if 'LastEvaluatedKey' not in response:
+                    break
+                kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _allocate_ordinal(self):
+        response = self.table.update_item(
+            Key=self._key('meta'),
+            UpdateExpression='ADD next_ordinal :one',
+            ExpressionAttributeValues={':one': 1},
+            ReturnValues='UPDATED_NEW'
+        )
+        return int(response['Attributes']['next_ordinal'])
+
+    def _update_meta(self, doc_delta, length_delta):
+        if not doc_delta and not length_delta:
+            return
+        self.table.update_item(
+            Key=self._key('meta'),
+            UpdateExpression='ADD doc_count :docs, total_length :length',
+            ExpressionAttributeValues={':docs': doc_delta, ':length': length_delta}
+        )
+
+    def _set_length(self, ordinal, length):
+        """The one stored copy of a document's length (None removes it)"""
+        kwargs = {
+            'Key': self._key(f'len#{shard_of(ordinal):06d}'),
+            'ExpressionAttributeNames': {'#len': f'l{ordinal}'}
+        }
+        if length is None:
+            self.table.update_item(UpdateExpression='REMOVE #len', **kwargs)
+        else:
+            self.table.update_item(UpdateExpression='SET #len = :len',
+                                   ExpressionAttributeValues={':len': length}, **kwargs)
+
+    def _save_document(self, doc_type, doc_id, ordinal, title, full_text, length, fingerprint):
+        now = datetime.utcnow().isoformat()
+        self.table.put_item(Item={
+            **self._key(f'ref#{doc_type}#{doc_id}'),
+            'ordinal': ordinal,
+            'length': length,
+            'fingerprint_z': compress_json(fingerprint),
+            'updated_at': now
+        })
+        self.table.put_item(Item={
+            **self._key(f'doc#{ordinal}'),
+            'doc_type': doc_type,
+            'doc_id': doc_id,
+            'title': title or '',
+            'text_z': gzip.compress(full_text[:MAX_STORED_TEXT].encode('utf-8')),
+            'updated_at': now
+        })
+
+    def _update_terms(self, ordinal, doc_type, positions_by_term, removed_terms):
+        type_code = DOC_TYPES.index(doc_type)
+        jobs = [(term, positions) for term, positions in positions_by_term.items()]
+        jobs += [(term, None) for term in removed_terms]
+        if not jobs:
+            return
+
+        def run(job):
+            term, positions = job
+            self._update_term(term, ordinal, type_code, positions)
+
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            list(executor.map(run, jobs))
+
+    def _update_term(self, term, ordinal, type_code, positions):
+        """Read-modify-write the term's shard for `ordinal`, retrying if another writer got there first"""
+        key = self._key(term_sk(term, shard_of(ordinal)))
+        tf = len(positions) if positions else 0
+        stored = positions[:MAX_POSITIONS] if positions else None
+        for _ in range(WRITE_RETRIES):
+            item = self.table.get_item(Key=key).get('Item')
+            version = int(item['ver']) if item else 0
+            data = binary_value(item.get('postings')) if item else b''
+
+            # New documents get the highest ordinal, so the common case is a splice
+            spliced = append_posting(data, ordinal, type_code, tf, stored) if data and stored else None
+            if spliced:
+                postings, df = spliced
+            else:
+                entries = decode_postings(data)
+                existing = next((i for i, e in enumerate(entries) if e[0] == ordinal), None)
+                if stored is None:
+                    if existing is None:
+                        return
+                    del entries[existing]
+                elif existing is not None:
+                    entries[existing] = (ordinal, type_code, tf, stored)
+                else:
+                    entries.append((ordinal, type_code, tf, stored))
+                    entries.sort(key=lambda e: e[0])
+                postings, df = encode_postings(entries), len(entries)
+
+            try:
+                if df:
+                    self.table.put_item(
+                        Item={**key, 'postings': postings, 'df': df, 'ver': version + 1},
+                        ConditionExpression='attribute_not_exists(ver) OR ver = :ver',
+                        ExpressionAttributeValues={':ver': version}
+                    )
+                else:
+                    self.table.delete_item(
+                        Key=key,
+                        ConditionExpression='ver = :ver',
+                        ExpressionAttributeValues={':ver': version}
+                    )
+                return
+            except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+                continue
+        raise RuntimeError(f"Search index: gave up updating a term after {WRITE_RETRIES} conflicts")
+
+    # --- Reads ---
+    def _batch_get(self, sks):
+        items = []
+        for i in range(0, len(sks), 100):
+            request = {self.table_name: {'Keys': [self._key(sk) for sk in sks[i:i + 100]]}}
+            while request:
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                items.extend(response.get('Responses', {}).get(self.table_name, []))
+                request = response.get('UnprocessedKeys') or None
+        return items
+
+    def _term_postings(self, term):
+        """Every shard of a term's postings, in ordinal order"""
+        kwargs = {
+            'KeyConditionExpression': 'user_id = :uid AND begins_with(sk, :prefix)',
+            'ExpressionAttributeValues': {':uid': self.user_id, ':prefix': f'term#{term}#'}
+        }
+        shards = []
+        while True:
+            response = self.table.query(**kwargs)
+            shards += [PostingList(binary_value(item['postings'])) for item in response.get('Items', [])]
+            if 'LastEvaluatedKey' not in response:
+                return shards
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _doc_lengths(self, shards):
+        lengths = {}
+        for item in self._batch_get([f'len#{shard:06d}' for shard in sorted(shards)]):
+            for name, value in item.items():
+                if name[0] == 'l' and name[1:].isdigit():
+                    lengths[int(name[1:])] = int(value)
+        return lengths
+
+    def search(self, query, limit=10, doc_type=None):
+        terms = query_terms(query)
+        if not terms:
+            return []
+
+        with ThreadPoolExecutor(max_workers=len(terms)) as executor:
+            postings_by_term = dict(zip(terms, executor.map(self._term_postings, terms)))
+        meta = self.table.get_item(Key=self._key('meta')).get('Item') or {}
+        doc_count = max(1, int(meta.get('doc_count', 0)))
+        avg_len = max(1.0, float(meta.get('total_length', 0)) / doc_count)
+        type_filter = DOC_TYPES.index(doc_type) if doc_type in DOC_TYPES else None
+
+        idfs = {}
+        matched = {}
+        for term in terms:
+            shards = postings_by_term[term]
+            df = sum(len(postings) for postings in shards)
+            if not df:
+                continue
+            idfs[term] = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+            for postings in shards:
+                for i, (ordinal, type_code) in enumerate(zip(postings.ordinals, postings.types)):
+                    if type_filter is not None and type_code != type_filter:
+                        continue
+                    matched.setdefault(ordinal, []).append((term, postings, i))
+
+        lengths = self._doc_lengths({shard_of(ordinal) for ordinal in matched})
+        length_norm = K1 * B / avg_len
+        base_norm = K1 * (1 - B)
+        scores = {}
+        for ordinal, hits in matched.items():
+            doc_len = lengths.get(ordinal, avg_len)
+            scores[ordinal] = sum(
+                idfs[term] * postings.freqs[i] * (K1 + 1) / (postings.freqs[i] + base_norm + length_norm * doc_len)
+                for term, postings, i in hits
+            )
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda s: s[1])
+        docs = {item['sk']: item for item in self._batch_get([f'doc#{ordinal}' for ordinal, _ in top])}
+
+        results = []
+        for ordinal, score in top:
+            doc = docs.get(f'doc#{ordinal}')
+            if not doc:
+                continue
+            positions = [p for _, postings, i in matched[ordinal] for p in postings.positions(i)]
+            results.append({
+                'doc_type': doc['doc_type'],
+                'doc_id': doc['doc_id'],
+                'title': doc.get('title', ''),
+                'score': round(score, 4),
+                'matched_terms': sorted(term for term, _, _ in matched[ordinal]),
+                'snippet': build_snippet(decompress_text(doc.get('text_z')), positions),
+                'updated_at': doc.get('updated_at')
+            })
+        return results
+
+
+def queue_reindex(sqs, user_id, doc_type, doc_id):
+    """
+    Ask the search indexer to re-read a document from its source table.
+    Returns False when no queue is configured. Messages are grouped by
+    user, so one user's index is only ever written by one worker at a time.
+    """
+    if not SEARCH_INDEX_QUEUE_URL:
+        return False
+    sqs.send_message(
+        QueueUrl=SEARCH_INDEX_QUEUE_URL,
+        MessageBody=json.dumps({'user_id': user_id, 'doc_type': doc_type, 'doc_id': doc_id}),
+        MessageGroupId=user_id,
+        # Every save must reach the worker, even one identical to a recent message
+        MessageDeduplicationId=uuid.uuid4().hex
+    )
+    return True
+
+def queue_reindex_batch(sqs, user_id, doc_type, doc_ids):
+    """
+    queue_reindex for many documents of one user, ten per SendMessageBatch.
+    Returns False when no queue is configured; raises if entries were rejected.
+    """
+    if not SEARCH_INDEX_QUEUE_URL:
+        return False
+    doc_ids = list(doc_ids)
+    for start in range(0, len(doc_ids), SQS_BATCH_SIZE):
+        entries = [{
+            'Id': str(i),
+            'MessageBody': json.dumps({'user_id': user_id, 'doc_type': doc_type, 'doc_id': doc_id}),
+            'MessageGroupId': user_id,
+            'MessageDeduplicationId': uuid.uuid4().hex
+        } for i, doc_id in enumerate(doc_ids[start:start + SQS_BATCH_SIZE])]
+        failed = sqs.send_message_batch(QueueUrl=SEARCH_INDEX_QUEUE_URL, Entries=entries).get('Failed', [])
+        if failed:
+            raise RuntimeError(f"{len(failed)} reindex messages rejected: {failed[0].get('Message')}")
+    return True
+
+def conversation_text(messages):
+    return '\n'.join(str(m.get('content', '')) for m in messages or [] if m.get('content'))
+
+def activity_text(activity):
+    fields = ('client_id', 'tag', 'question', 'answer', 'note')
+    return '\n'.join(str(activity[f]) for f in fields if activity.get(f))
@@ -0,0 +1,138 @@
+"""
+Search indexer worker.
+
+Conversation saves and activity note edits queue {user_id, doc_type,
+doc_id} through search_index.queue_reindex instead of writing the index
+themselves. This worker re-reads the document from its source table, then
+re-indexes it or removes it if it no longer exists. The queue is FIFO and
+grouped by user, so one user's index is never written by two workers at
+once.
+
+A rebuild drops the user's index and indexes every document again. Use
+it after a format change, or for users saved while no queue was
+configured:
+
+    python -m lambda_functions.search_indexer --rebuild [--user <user_id>]
+"""
+import argparse
+import json
+
+from lambda_functions.search_index import SearchIndex, conversation_text, activity_text
+
+CONVERSATIONS_TABLE = 'ThreatalyticsConversations'
+ACTIVITY_TABLE = 'ThreatalyticsActivityLog'
+
+def load_conversation(dynamodb, s3_client, user_id, conversation_id):
+    """(title, text) of a conversation, or None if it was deleted"""
+    from lambda_functions.conversations import decode_messages
+
+    item = dynamodb.Table(CONVERSATIONS_TABLE).get_item(
+        Key={'user_id': user_id, 'conversation_id': conversation_id}
+    ).get('Item')
+    if not item:
+        return None
+    return item.get('title', ''), conversation_text(decode_messages(s3_client, item.get('messages')))
+
+def load_activity(dynamodb, s3_client, user_id, activity_id):
+    """(title, text) of an activity, or None if it was deleted"""
+    item = dynamodb.Table(ACTIVITY_TABLE).get_item(
+        Key={'user_id': user_id, 'activity_id': activity_id}
+    ).get('Item')
+    if not item:
+        return None
+    return item.get('case_name', ''), activity_text(item)
+
+LOADERS = {'conversation': load_conversation, 'activity': load_activity}
+
+def reindex(dynamodb, s3_client, user_id, doc_type, doc_id):
+    """Bring one document's index entry in line with its source item"""
+    index = SearchIndex(dynamodb, user_id)
+    document = LOADERS[doc_type](dynamodb, s3_client, user_id, doc_id)
+    if document is None:
+        index.remove_document(doc_type, doc_id)
+    else:
+        index.index_document(doc_type, doc_id, *document)
+
+def worker_handler(event, context, dynamodb=None, s3_client=None):
+    """
+    SQS FIFO consumer. After a failure, the rest of that user's messages in
+    the batch are returned as failures too, so they are retried in order.
+    """
+    if dynamodb is None:
+        import boto3
+        dynamodb, s3_client = boto3.resource('dynamodb'), boto3.client('s3')
+
+    failures = []
+    failed_groups = set()
+    for record in event.get('Records', []):
+        group = record.get('attributes', {}).get('MessageGroupId')
+        if group in failed_groups:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        try:
+            message = json.loads(record['body'])
+            reindex(dynamodb, s3_client, message['user_id'], message['doc_type'], message['doc_id'])
+        except Exception as e:
+            print(f"Search indexing failed for message {record['messageId']}: {e}")
+            failed_groups.add(group)
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
+def user_documents(dynamodb, user_id):
+    """Yield (doc_type, doc_id) for everything a user can search"""
+    sources = (
+        ('conversation', CONVERSATIONS_TABLE, 'conversation_id'),
+        ('activity', ACTIVITY_TABLE, 'activity_id')
+    )
+    for doc_type, table_name, id_attribute in sources:
+        kwargs = {
+            'KeyConditionExpression': 'user_id = :uid',
+            'ExpressionAttributeValues': {':uid': user_id},
+            'ProjectionExpression': id_attribute
+        }
+        table = dynamodb.Table(table_name)
+        while True:
+            response = table.query(**kwargs)
+            for item in response.get('Items', []):
+                yield doc_type, item[id_attribute]
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def all_user_ids(dynamodb):
+    user_ids = set()
+    for table_name in (CONVERSATIONS_TABLE, ACTIVITY_TABLE):
+        kwargs = {'ProjectionExpression': 'user_id'}
+        table = dynamodb.Table(table_name)
+        while True:
+            response = table.scan(**kwargs)
+            user_ids.update(item['user_id'] for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return sorted(user_ids)
+
+def rebuild(dynamodb, s3_client, user_id):
+    """Drop and re-create one user's index; returns the number of documents indexed"""
+    SearchIndex(dynamodb, user_id).clear()
+    count = 0
+    for doc_type, doc_id in user_documents(dynamodb, user_id):
+        reindex(dynamodb, s3_client, user_id, doc_type, doc_id)
+        count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rebuild per-user search indexes')
+    parser.add_argument('--rebuild', action='store_true')
+    parser.add_argument('--user', help='only this user_id')
+    args = parser.parse_args(argv)
+    if not args.rebuild:
+        parser.error('nothing to do (use --rebuild)')
+
+    import boto3
+    dynamodb, s3_client = boto3.resource('dynamodb'), boto3.client('s3')
+    for user_id in [args.user] if args.user else all_user_ids(dynamodb):
+        print(f"{user_id}: {rebuild(dynamodb, s3_client, user_id)} documents indexed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Stripe customer -> Cognito user mapping.
+
+ThreatalyticsStripeCustomers has one item per Stripe customer id. It is
+written when subscription_manager creates the customer, and by the webhook
+the first time it learns the pair from metadata. Webhook handlers read it
+with a point get instead of scanning users by stripe_customer_id.
+
+Subscriptions are found the other way round through the subscription-index
+GSI on the subscriptions table (subscription_id -> user_id, subscription_id).
+"""
+import os
+from datetime import datetime
+
+CUSTOMERS_TABLE = os.environ.get('STRIPE_CUSTOMERS_TABLE', 'ThreatalyticsStripeCustomers')
+SUBSCRIPTION_INDEX = 'subscription-index'
+
+# A customer never changes owner, so lookups are cached for the container's life
+_users = {}
+
+def remember_customer(dynamodb, customer_id, user_id):
+    if not customer_id or not user_id or _users.get(customer_id) == user_id:
+        return
+    dynamodb.Table(CUSTOMERS_TABLE).put_item(Item={
+        'customer_id': customer_id,
+        'user_id': user_id,
+        'created_at': datetime.utcnow().isoformat()
+    })
+    _users[customer_id] = user_id
+
+def user_for_customer(dynamodb, customer_id):
+    """user_id for a Stripe customer, or None if the mapping has no entry"""
+    if not customer_id:
+        return None
+    if customer_id not in _users:
+        item = dynamodb.Table(CUSTOMERS_TABLE).get_item(Key={'customer_id': customer_id}).get('Item')
+        if not item:
+            return None
+        _users[customer_id] = item['user_id']
+    return _users[customer_id]
+
+def forget_customer(dynamodb, customer_id):
+    _users.pop(customer_id, None)
+    dynamodb.Table(CUSTOMERS_TABLE).delete_item(Key={'customer_id': customer_id})
+
+def find_subscription(table, subscription_id):
+    """The subscriptions-table item for a Stripe subscription id, via its GSI"""
+    items = table.query(
+        IndexName=SUBSCRIPTION_INDEX,
+        KeyConditionExpression='subscription_id = :sid',
+        ExpressionAttributeValues={':sid': subscription_id},
+        Limit=1
+    ).get('Items', [])
+    return items[0] if items else None
@@ -3,8 +3,13 @@ import json
 import stripe
 import boto3
 import uuid
+import time
 from datetime import datetime
 import logging
+from lambda_functions.etags import bump_version
+from lambda_functions.subscription_state import put_state, state_from_subscription, cache_checkout_session, subscription_plan
+from lambda_functions.stripe_customers import remember_customer, user_for_customer
+from lambda_functions.revenue_ledger import record_charge
 
 # Configure logging
 logger = logging.getLogger()
@@ -13,6 +18,16 @@ logger.setLevel(logging.INFO)
 # Initialize Stripe
 stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', '')
 
+# Created once per container and shared by every handler
+dynamodb = boto3.resource('dynamodb')
+sqs = boto3.client('sqs')
+
+# Ledger of received events (event_id -> status) and the FIFO queue the worker drains.
+# Without a queue URL events are applied inline, e.g. when running locally.
+EVENTS_TABLE = os.environ.get('STRIPE_EVENTS_TABLE', 'ThreatalyticsStripeEvents')
+EVENTS_QUEUE_URL = os.environ.get('STRIPE_EVENTS_QUEUE_URL', '')
+LEDGER_TTL_DAYS = 30  # Stripe stops retrying after 3 days
+
 # Webhook endpoint URL will be:
 # https://km8gnz77e8.execute-api.us-east-1.amazonaws.com/dev/stripe/webhook
 # Configure this in Stripe Dashboard > Developers > Webhooks
@@ -23,6 +38,10 @@ stripe.api_key = os.environ.get('STRIPE_SECRET_KEY', '')
 # - invoice.payment_succeeded
 # - invoice.payment_failed
 
+# Plans rows store the plan name under `plan`, like the verify endpoint does;
+# the admin listings filter on it. Used when Stripe does not name the plan.
+DEFAULT_PAID_PLAN = 'starter'
+
 def generate_api_key():
     """Generate a unique API key"""
     return f"ta_live_{uuid.uuid4().hex}"
@@ -31,18 +50,33 @@ def handle_subscription_created(subscription):
     """Handle new subscription creation"""
     try:
         customer_id = subscription['customer']
-        plan_id = subscription['items']['data'][0]['plan']['id']
+        price_id = subscription['items']['data'][0]['plan']['id']
+        plan = subscription_plan(subscription, DEFAULT_PAID_PLAN)
+        user_id = resolve_user_id(subscription)
+        if not user_id:
+            logger.warning("No user for customer %s; subscription %s not recorded", customer_id, subscription['id'])
+            return
 
-        dynamodb = boto3.resource('dynamodb')
         table = dynamodb.Table('ThreatalyticsPlans')
-        table.put_item(Item={
-        'user_id': customer_id,
-        'plan_id': plan_id,
-        'api_key': generate_api_key(),
-        'status': 'active',
-        'created_at': datetime.utcnow().isoformat()
-    })
-        logger.info("Subscription created for %s, plan %s", customer_id, plan_id)
+        # Re-running the event keeps the API key issued the first time
+        table.update_item(
+            Key={'user_id': user_id, 'subscription_id': subscription['id']},
+            UpdateExpression='SET #plan = :plan, price_id = :price_id, stripe_customer_id = :cid, #status = :status, '
+                             'api_key = if_not_exists(api_key, :api_key), created_at = if_not_exists(created_at, :now) '
+                             'REMOVE plan_id',
+            ExpressionAttributeNames={'#plan': 'plan', '#status': 'status'},
+            ExpressionAttributeValues={
+                ':plan': plan,
+                ':price_id': price_id,
+                ':cid': customer_id,
+                ':status': 'active',
+                ':api_key': generate_api_key(),
+                ':now': datetime.utcnow().isoformat()
+            }
+        )
+        # /usage reports the active Plans row
+        bump_version(dynamodb, user_id, 'usage')
+        logger.info("Subscription created for %s, plan %s (%s)", user_id, plan, price_id)
     except Exception as e:
         logger.error("Failed to create subscription: %s", str(e))
         raise
@@ -71,8 +105,11 @@ def handle_checkout_completed(session):
             logger.error("ERROR: user_id not found in metadata! Cannot update database.")
             logger.error(f"Available metadata keys: {list(metadata.keys())}")
             return
+
+        remember_customer(dynamodb, customer_id, user_id)
+        # /subscription/verify reads this instead of calling Stripe again
+        cache_checkout_session(dynamodb, session)
         
-        dynamodb = boto3.resource('dynamodb')
         users_table = dynamodb.Table('ThreatalyticsUsers')
         
         # Update user's plan in ThreatalyticsUsers table
@@ -91,6 +128,7 @@ def handle_checkout_completed(session):
         )
         
         logger.info("✓ DATABASE UPDATE SUCCESSFUL")
+        bump_version(dynamodb, user_id, 'usage')
         logger.info(f"Updated attributes: {update_response.get('Attributes', {})}")
         logger.info("=" * 80)
         
@@ -105,31 +143,45 @@ def handle_checkout_completed(session):
 
 def handle_subscription_updated(subscription):
     """Handle subscription updates"""
-    customer_id = subscription['customer']
-    plan_id = subscription['items']['data'][0]['plan']['id']
+    price_id = subscription['items']['data'][0]['plan']['id']
+    plan = subscription_plan(subscription, None)
+    user_id = resolve_user_id(subscription)
+    if not user_id:
+        logger.warning("No user for customer %s; update ignored", subscription['customer'])
+        return
 
-    dynamodb = boto3.resource('dynamodb')
     table = dynamodb.Table('ThreatalyticsPlans')
+    now = datetime.utcnow().isoformat()
+    # The update may arrive before (or instead of) the created event, so it
+    # also sets created_at; a plan Stripe does not name keeps the stored one
     table.update_item(
-        Key={'user_id': customer_id},
-        UpdateExpression='SET plan_id = :plan_id, updated_at = :updated_at',
+        Key={'user_id': user_id, 'subscription_id': subscription['id']},
+        UpdateExpression=('SET #plan = :plan, ' if plan else 'SET #plan = if_not_exists(#plan, :plan), ')
+                         + 'price_id = :price_id, stripe_customer_id = :cid, updated_at = :updated_at, '
+                           'created_at = if_not_exists(created_at, :updated_at) REMOVE plan_id',
+        ExpressionAttributeNames={'#plan': 'plan'},
         ExpressionAttributeValues={
-            ':plan_id': plan_id,
-            ':updated_at': datetime.utcnow().isoformat()
+            ':plan': plan or DEFAULT_PAID_PLAN,
+            ':price_id': price_id,
+            ':cid': subscription['customer'],
+            ':updated_at': now
         }
     )
-    logger.info("Subscription updated for %s, plan %s", customer_id, plan_id)
+    bump_version(dynamodb, user_id, 'usage')
+    logger.info("Subscription updated for %s, plan %s (%s)", user_id, plan, price_id)
 
 def handle_subscription_deleted(subscription):
     """Handle subscription cancellation"""
-    customer_id = subscription['customer']
+    user_id = resolve_user_id(subscription)
+    if not user_id:
+        logger.warning("No user for customer %s; cancellation ignored", subscription['customer'])
+        return
 
-    dynamodb = boto3.resource('dynamodb')
     plans_table = dynamodb.Table('ThreatalyticsPlans')
     users_table = dynamodb.Table('ThreatalyticsUsers')
 
     plans_table.update_item(
-        Key={'user_id': customer_id},
+        Key={'user_id': user_id, 'subscription_id': subscription['id']},
         UpdateExpression='SET #status = :status, cancelled_at = :cancelled_at',
         ExpressionAttributeNames={'#status': 'status'},
         ExpressionAttributeValues={
@@ -139,58 +191,228 @@ def handle_subscription_deleted(subscription):
     )
 
     users_table.update_item(
-        Key={'user_id': customer_id},
+        Key={'user_id': user_id},
         UpdateExpression='SET plan = :plan',
         ExpressionAttributeValues={
             ':plan': 'free'
         }
     )
-    logger.info("Subscription cancelled for %s", customer_id)
+    bump_version(dynamodb, user_id, 'usage')
+    logger.info("Subscription cancelled for %s", user_id)
 
 def handle_payment_succeeded(invoice):
     """Handle successful payment"""
     customer_id = invoice['customer']
     amount_paid = invoice.get('amount_paid', 0)
 
-    dynamodb = boto3.resource('dynamodb')
     payments_table = dynamodb.Table('ThreatalyticsPayments')
     payments_table.put_item(Item={
         'payment_id': invoice['id'],
-        'user_id': customer_id,
+        'user_id': resolve_user_id(invoice) or customer_id,
+        'stripe_customer_id': customer_id,
         'amount': amount_paid,
         'status': 'succeeded',
         'created_at': datetime.utcnow().isoformat()
     })
+
+    # Admin revenue totals; the periodic sync skips charges counted here
+    if invoice.get('charge') and amount_paid:
+        paid_at = (invoice.get('status_transitions') or {}).get('paid_at') or invoice.get('created') or time.time()
+        record_charge(dynamodb, invoice['charge'], amount_paid, paid_at, invoice.get('currency', 'usd'),
+                      source='webhook', invoice_id=invoice['id'], customer_id=customer_id)
     logger.info("Payment succeeded for %s amount %s", customer_id, amount_paid)
 
 def handle_payment_failed(invoice):
     """Handle failed payment"""
     customer_id = invoice['customer']
+    user_id = resolve_user_id(invoice)
 
-    dynamodb = boto3.resource('dynamodb')
     payments_table = dynamodb.Table('ThreatalyticsPayments')
     plans_table = dynamodb.Table('ThreatalyticsPlans')
 
     payments_table.put_item(Item={
         'payment_id': invoice['id'],
-        'user_id': customer_id,
+        'user_id': user_id or customer_id,
+        'stripe_customer_id': customer_id,
         'amount': invoice.get('amount_due', 0),
         'status': 'failed',
         'created_at': datetime.utcnow().isoformat()
     })
 
-    plans_table.update_item(
-        Key={'user_id': customer_id},
-        UpdateExpression='SET #status = :status',
-        ExpressionAttributeNames={'#status': 'status'},
-        ExpressionAttributeValues={
-            ':status': 'payment_failed'
-        }
-    )
+    if user_id and invoice.get('subscription'):
+        plans_table.update_item(
+            Key={'user_id': user_id, 'subscription_id': invoice['subscription']},
+            UpdateExpression='SET #status = :status',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':status': 'payment_failed'
+            }
+        )
+        bump_version(dynamodb, user_id, 'usage')
     logger.info("Payment failed for %s", customer_id)
 
+def resolve_user_id(obj):
+    """
+    Our user_id for a Stripe object with a customer: the customer mapping,
+    else the object's or the customer's metadata (remembered for next time)
+    """
+    customer_id = obj.get('customer')
+    user_id = user_for_customer(dynamodb, customer_id)
+    if user_id or not customer_id:
+        return user_id
+    user_id = (obj.get('metadata') or {}).get('user_id')
+    if not user_id:
+        customer = stripe.Customer.retrieve(customer_id)
+        user_id = (customer.get('metadata') or {}).get('user_id')
+    remember_customer(dynamodb, customer_id, user_id)
+    return user_id
+
+def sync_subscription_state(event_stripe):
+    """Keep the /subscription/status projection in step with Stripe"""
+    event_type = event_stripe.get('type')
+    obj = event_stripe.get('data', {}).get('object', {})
+    if event_type == 'checkout.session.completed':
+        user_id = (obj.get('metadata') or {}).get('user_id')
+        if not user_id or not obj.get('subscription'):
+            return
+        item = {
+            'user_id': user_id,
+            'active': True,
+            'plan': obj['metadata'].get('plan', 'starter'),
+            'status': 'active',
+            'stripe_subscription_id': obj.get('subscription'),
+            'stripe_customer_id': obj.get('customer')
+        }
+    elif event_type.startswith('customer.subscription.'):
+        user_id = resolve_user_id(obj)
+        if not user_id:
+            logger.warning(f"No user_id for subscription {obj.get('id')}; state not synced")
+            return
+        item = state_from_subscription(user_id, obj)
+    else:
+        return
+    if not put_state(dynamodb, item, event_stripe.get('created')):
+        logger.info(f"Subscription state for {item['user_id']} already newer than {event_stripe['id']}")
+
+EVENT_HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'customer.subscription.created': handle_subscription_created,
+    'customer.subscription.updated': handle_subscription_updated,
+    'customer.subscription.deleted': handle_subscription_deleted,
+    'invoice.payment_succeeded': handle_payment_succeeded,
+    'invoice.payment_failed': handle_payment_failed
+}
+
+def apply_event(event_stripe):
+    """Run the handler for one event; handlers are safe to re-run"""
+    event_type = event_stripe.get('type')
+    handler = EVENT_HANDLERS.get(event_type)
+    if handler is None:
+        logger.info(f"ℹ Unhandled Stripe event type: {event_type}")
+        return
+    logger.info(f"→ Handling {event_type}")
+    handler(event_stripe.get('data', {}).get('object', {}))
+    sync_subscription_state(event_stripe)
+
+def event_customer(event_stripe):
+    """Customer the event belongs to; events are applied in order per customer"""
+    obj = event_stripe.get('data', {}).get('object', {})
+    if obj.get('object') == 'customer':
+        return obj.get('id')
+    return obj.get('customer') or 'no-customer'
+
+def record_event(event_stripe):
+    """
+    Conditional put into the ledger. False if the event was already received
+    and has been queued or processed; a retry of an event whose enqueue never
+    completed ('received') is let through again.
+    """
+    try:
+        dynamodb.Table(EVENTS_TABLE).put_item(
+            Item={
+                'event_id': event_stripe['id'],
+                'type': event_stripe.get('type'),
+                'customer_id': event_customer(event_stripe),
+                'status': 'received',
+                'received_at': datetime.utcnow().isoformat(),
+                'expires_at': int(time.time()) + LEDGER_TTL_DAYS * 86400
+            },
+            ConditionExpression='attribute_not_exists(event_id) OR #status = :received',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':received': 'received'}
+        )
+        return True
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def set_event_status(event_id, status, only_from=None, **extra):
+    """Move an event to `status`; with only_from, only if it is still in that status"""
+    names = {'#status': 'status'}
+    values = {':status': status}
+    sets = ['#status = :status']
+    for i, (name, value) in enumerate(extra.items()):
+        names[f'#x{i}'] = name
+        values[f':x{i}'] = value
+        sets.append(f'#x{i} = :x{i}')
+    kwargs = {}
+    if only_from:
+        kwargs['ConditionExpression'] = '#status = :from'
+        values[':from'] = only_from
+    try:
+        dynamodb.Table(EVENTS_TABLE).update_item(
+            Key={'event_id': event_id},
+            UpdateExpression='SET ' + ', '.join(sets),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+            **kwargs
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        # The worker got there first
+        pass
+
+def is_processed(event_id):
+    item = dynamodb.Table(EVENTS_TABLE).get_item(
+        Key={'event_id': event_id},
+        ProjectionExpression='#status',
+        ExpressionAttributeNames={'#status': 'status'}
+    ).get('Item')
+    return bool(item) and item.get('status') == 'processed'
+
+def process_event(event_stripe):
+    """Apply an event once and mark it processed in the ledger"""
+    if is_processed(event_stripe['id']):
+        logger.info(f"Skipping already processed event {event_stripe['id']}")
+        return
+    apply_event(event_stripe)
+    set_event_status(event_stripe['id'], 'processed', processed_at=datetime.utcnow().isoformat())
+
+def worker_handler(event, context):
+    """
+    SQS FIFO consumer. Messages are grouped by customer, so each customer's
+    events arrive in order. After a failure, the rest of that customer's
+    messages in the batch are returned as failures too, so nothing is
+    applied out of order while SQS redelivers.
+    """
+    failures = []
+    failed_groups = set()
+    for record in event.get('Records', []):
+        group = record.get('attributes', {}).get('MessageGroupId')
+        if group in failed_groups:
+            failures.append({'itemIdentifier': record['messageId']})
+            continue
+        try:
+            process_event(json.loads(record['body']))
+        except Exception:
+            logger.exception(f"Error applying Stripe event from message {record['messageId']}")
+            failed_groups.add(group)
+            failures.append({'itemIdentifier': record['messageId']})
+    return {'batchItemFailures': failures}
+
 def lambda_handler(event, context):
-    """Single entrypoint for Stripe webhook events with proper error handling"""
+    """
+    Stripe webhook endpoint: verify, record in the ledger, enqueue, 200.
+    The worker applies the event; duplicates are acknowledged without work.
+    """
     try:
         logger.info("🔔 Stripe webhook received")
         
@@ -226,33 +448,34 @@ def lambda_handler(event, context):
                 }
             }
 
-        event_type = event_stripe.get('type')
-        event_data = event_stripe.get('data', {}).get('object', {})
-        
-        logger.info(f"📨 Processing event type: {event_type}")
-
-        if event_type == 'checkout.session.completed':
-            logger.info("→ Handling checkout.session.completed")
-            handle_checkout_completed(event_data)
-        elif event_type == 'customer.subscription.created':
-            logger.info("→ Handling customer.subscription.created")
-            handle_subscription_created(event_data)
-        elif event_type == 'customer.subscription.updated':
-            logger.info("→ Handling customer.subscription.updated")
-            handle_subscription_updated(event_data)
-        elif event_type == 'customer.subscription.deleted':
-            logger.info("→ Handling customer.subscription.deleted")
-            handle_subscription_deleted(event_data)
-        elif event_type == 'invoice.payment_succeeded':
-            logger.info("→ Handling invoice.payment_succeeded")
-            handle_payment_succeeded(event_data)
-        elif event_type == 'invoice.payment_failed':
-            logger.info("→ Handling invoice.payment_failed")
-            handle_payment_failed(event_data)
+        event_id = event_stripe['id']
+        logger.info(f"📨 Received {event_stripe.get('type')} {event_id}")
+
+        if not record_event(event_stripe):
+            logger.info(f"Duplicate delivery of {event_id}; already queued or processed")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'received': True, 'duplicate': True}),
+                'headers': {
+                    'Access-Control-Allow-Origin': '*',
+                    'Access-Control-Allow-Credentials': 'true'
+                }
+            }
+
+        if EVENTS_QUEUE_URL:
+            # The verified raw payload is the message; dedup by event id, order by customer
+            sqs.send_message(
+                QueueUrl=EVENTS_QUEUE_URL,
+                MessageBody=payload,
+                MessageGroupId=event_customer(event_stripe),
+                MessageDeduplicationId=event_id
+            )
+            set_event_status(event_id, 'queued', only_from='received')
+            logger.info("✓ Webhook queued")
         else:
-            logger.info(f"ℹ Unhandled Stripe event type: {event_type}")
+            process_event(event_stripe)
+            logger.info("✓ Webhook processed successfully")
 
-        logger.info("✓ Webhook processed successfully")
         return {
             'statusCode': 200,
             'body': json.dumps({'received': True}),
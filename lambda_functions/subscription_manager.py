@@ -1,9 +1,16 @@
 import json
 import boto3
+import hashlib
 import os
 import stripe
+from boto3.dynamodb.types import TypeSerializer
 from datetime import datetime
 from decimal import Decimal
+from lambda_functions.etags import bump_version
+from lambda_functions.subscription_state import (
+    get_state, put_state, state_from_subscription, status_body, cached_checkout_session
+)
+from lambda_functions.customer_provisioning import provision_customer
 
 dynamodb = boto3.resource('dynamodb')
 users_table = dynamodb.Table(os.environ.get('USERS_TABLE', 'ThreatalyticsUsers'))
@@ -74,6 +81,147 @@ def get_user_from_token(event):
         print(f"Error extracting user from token: {e}")
         return None
 
+def subscription_status(user_id):
+    """
+    Status from the webhook-maintained projection. Stripe is only called
+    when the user has no projection yet or it is stale, and the answer is
+    stored so the next request is a point read again.
+    """
+    state = get_state(dynamodb, user_id)
+    if state:
+        return status_body(state)
+
+    user = users_table.get_item(Key={'user_id': user_id}).get('Item', {})
+    stripe_customer_id = user.get('stripe_customer_id')
+    item = {
+        'user_id': user_id,
+        'active': False,
+        'plan': user.get('plan', 'free'),
+        'status': 'none',
+        'stripe_customer_id': stripe_customer_id
+    }
+    if stripe_customer_id:
+        try:
+            subscriptions = stripe.Subscription.list(
+                customer=stripe_customer_id,
+                status='active',
+                limit=1
+            )
+        except Exception as e:
+            print(f"Error in subscription status: {e}")
+            # Return user's current plan from database instead of failing
+            return {
+                'active': user.get('subscription_status') == 'active',
+                'plan': user.get('plan', 'free'),
+                'message': 'Status retrieved from database'
+            }
+        if subscriptions.data:
+            item = state_from_subscription(user_id, subscriptions.data[0], user.get('plan', 'free'))
+
+    put_state(dynamodb, item)
+    return status_body(item)
+
+def activation_transaction(user_id, plan, session):
+    """
+    The users update and the subscriptions update as one TransactWriteItems
+    request. Timestamps come from the session, so a retried verification
+    sends identical parameters under the same ClientRequestToken.
+    The subscription row is updated, not replaced, so the api_key the webhook
+    issued survives, and created_at is only set the first time.
+    """
+    serialize = TypeSerializer().serialize
+    subscription = session.get('subscription')
+    subscription_id = subscription.get('id') if isinstance(subscription, dict) else subscription
+    activated_at = datetime.utcfromtimestamp(int(session.get('created') or 0)).isoformat()
+    fields = {
+        'plan': plan,
+        'status': 'active',
+        'stripe_subscription_id': subscription_id,
+        'stripe_customer_id': session.get('customer'),
+        'amount': session.get('amount_total'),
+        'currency': session.get('currency'),
+        'updated_at': activated_at
+    }
+    fields = {k: v for k, v in fields.items() if v is not None}
+    names = {f'#f{i}': name for i, name in enumerate(fields)}
+    values = {f':f{i}': serialize(value) for i, value in enumerate(fields.values())}
+    return {
+        'TransactItems': [
+            {'Update': {
+                'TableName': users_table.name,
+                'Key': {'user_id': serialize(user_id)},
+                'UpdateExpression': 'SET #plan = :plan, subscription_status = :status, '
+                                    'stripe_subscription_id = :sub_id, updated_at = :updated REMOVE pending_plan',
+                'ExpressionAttributeNames': {'#plan': 'plan'},
+                'ExpressionAttributeValues': {
+                    ':plan': serialize(plan),
+                    ':status': serialize('active'),
+                    ':sub_id': serialize(subscription_id),
+                    ':updated': serialize(activated_at)
+                }
+            }},
+            {'Update': {
+                'TableName': subscriptions_table.name,
+                'Key': {'user_id': serialize(user_id), 'subscription_id': serialize(subscription_id)},
+                'UpdateExpression': 'SET ' + ', '.join(f'{n} = :{n[1:]}' for n in names)
+                                    + ', created_at = if_not_exists(created_at, :created)',
+                'ExpressionAttributeNames': names,
+                'ExpressionAttributeValues': {**values, ':created': serialize(activated_at)}
+            }}
+        ],
+        # Same session, same token: DynamoDB applies a retried request once
+        'ClientRequestToken': hashlib.sha256(f"{user_id}:{session['id']}".encode()).hexdigest()[:36]
+    }
+
+def verify_checkout(user_id, session_id, plan):
+    """
+    Activate a paid Checkout Session. The session comes from the webhook's
+    cache when checkout.session.completed has already arrived, otherwise
+    from Stripe. Returns (status_code, body).
+    """
+    session = cached_checkout_session(dynamodb, session_id)
+    source = 'webhook cache'
+    if session is None:
+        session = stripe.checkout.Session.retrieve(session_id, expand=['subscription'])
+        source = 'Stripe'
+    print(f"Session {session_id} from {source}: payment_status={session.get('payment_status')}, "
+          f"status={session.get('status')}, customer={session.get('customer')}")
+
+    if session.get('payment_status') != 'paid' or session.get('status') != 'complete':
+        print(f"✗ Payment not completed")
+        return 400, {
+            'success': False,
+            'message': 'Payment not completed',
+            'payment_status': session.get('payment_status'),
+            'session_status': session.get('status')
+        }
+
+    dynamodb.meta.client.transact_write_items(**activation_transaction(user_id, plan, session))
+    print(f"✓ ThreatalyticsUsers and subscription entry written for {user_id}")
+
+    # Status reads see the new plan before the webhook arrives
+    subscription = session.get('subscription')
+    if isinstance(subscription, dict):
+        put_state(dynamodb, state_from_subscription(user_id, subscription, plan))
+    else:
+        put_state(dynamodb, {
+            'user_id': user_id,
+            'active': True,
+            'plan': plan,
+            'status': 'active',
+            'stripe_subscription_id': subscription,
+            'stripe_customer_id': session.get('customer')
+        })
+
+    # Plan is part of the /usage payload
+    bump_version(dynamodb, user_id, 'usage')
+    return 200, {
+        'success': True,
+        'message': 'Payment verified and subscription activated',
+        'plan': plan,
+        'status': 'active'
+    }
+
 def lambda_handler(event, context):
     headers = get_cors_headers()
 
@@ -107,6 +255,44 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'Unauthorized'})
             }
 
+        # Status is served from the projection and needs nothing else
+        if method == 'GET' and path.endswith('/subscription/status'):
+            return {
+                'statusCode': 200,
+                'headers': headers,
+                'body': json.dumps(subscription_status(user_id), cls=DecimalEncoder)
+            }
+
+        # Verification needs the session, not the user record
+        if method == 'POST' and path.endswith('/subscription/verify'):
+            body = json.loads(event.get('body') or '{}')
+            session_id = body.get('session_id')
+            plan = body.get('plan')
+            print(f"PAYMENT VERIFICATION REQUEST user={user_id} session={session_id} plan={plan}")
+
+            if not session_id or not plan:
+                return {
+                    'statusCode': 400,
+                    'headers': headers,
+                    'body': json.dumps({'error': 'Missing session_id or plan'})
+                }
+            try:
+                status_code, result = verify_checkout(user_id, session_id, plan)
+            except Exception as e:
+                print(f"✗✗✗ VERIFICATION ERROR ✗✗✗ {e}")
+                import traceback
+                print(traceback.format_exc())
+                return {
+                    'statusCode': 500,
+                    'headers': headers,
+                    'body': json.dumps({'error': str(e)})
+                }
+            return {
+                'statusCode': status_code,
+                'headers': headers,
+                'body': json.dumps(result, cls=DecimalEncoder)
+            }
+
         # Get user data
         user_response = users_table.get_item(Key={'user_id': user_id})
         user = user_response.get('Item', {})
@@ -161,22 +347,18 @@ def lambda_handler(event, context):
                     'body': json.dumps({'error': 'Invalid Stripe price ID'})
                 }
 
-            # Get or create Stripe customer
+            # Provisioned at signup confirmation; created here only for users
+            # the provisioning queue has not reached yet
             stripe_customer_id = user.get('stripe_customer_id')
 
             if not stripe_customer_id:
-                customer = stripe.Customer.create(
-                    email=email,
-                    metadata={'user_id': user_id}
-                )
-                stripe_customer_id = customer.id
-
-                # Update user with Stripe customer ID
-                users_table.update_item(
-                    Key={'user_id': user_id},
-                    UpdateExpression='SET stripe_customer_id = :cid',
-                    ExpressionAttributeValues={':cid': stripe_customer_id}
-                )
+                stripe_customer_id = provision_customer(user_id, email)
+                if not stripe_customer_id:
+                    return {
+                        'statusCode': 404,
+                        'headers': headers,
+                        'body': json.dumps({'error': 'User not found'})
+                    }
 
             # Create checkout session
             print("=" * 80)
@@ -219,6 +401,13 @@ def lambda_handler(event, context):
                 metadata={
                     'user_id': user_id,
                     'plan': plan_id
+                },
+                # Subscription webhooks carry the user_id without a customer lookup
+                subscription_data={
+                    'metadata': {
+                        'user_id': user_id,
+                        'plan': plan_id
+                    }
                 }
             )
             
@@ -236,188 +425,6 @@ def lambda_handler(event, context):
                 })
             }
 
-        elif method == 'GET' and path.endswith('/subscription/status'):
-            try:
-                stripe_customer_id = user.get('stripe_customer_id')
-
-                if not stripe_customer_id:
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'active': False,
-                            'plan': user.get('plan', 'free'),
-                            'message': 'No active subscription'
-                        })
-                    }
-
-                subscriptions = stripe.Subscription.list(
-                    customer=stripe_customer_id,
-                    status='active',
-                    limit=1
-                )
-
-                if subscriptions.data:
-                    sub = subscriptions.data[0]
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'active': True,
-                            'plan': sub['items']['data'][0]['price'].get('metadata', {}).get('plan', user.get('plan', 'free')),
-                            'status': sub.status,
-                            'current_period_end': sub.current_period_end,
-                            'cancel_at_period_end': sub.cancel_at_period_end
-                        })
-                    }
-                else:
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'active': False,
-                            'plan': user.get('plan', 'free'),
-                            'message': 'No active subscription'
-                        })
-                    }
-            except Exception as e:
-                print(f"Error in subscription status: {e}")
-                # Return user's current plan from database instead of failing
-                return {
-                    'statusCode': 200,
-                    'headers': headers,
-                    'body': json.dumps({
-                        'active': user.get('subscription_status') == 'active',
-                        'plan': user.get('plan', 'free'),
-                        'message': 'Status retrieved from database'
-                    })
-                }
-
-        elif method == 'POST' and path.endswith('/subscription/verify'):
-            # NEW: Verify payment completion and update database
-            body = json.loads(event.get('body', '{}'))
-            session_id = body.get('session_id')
-            plan = body.get('plan')
-            
-            print("=" * 80)
-            print("PAYMENT VERIFICATION REQUEST")
-            print(f"User ID: {user_id}")
-            print(f"Session ID: {session_id}")
-            print(f"Plan: {plan}")
-            print("=" * 80)
-            
-            if not session_id or not plan:
-                return {
-                    'statusCode': 400,
-                    'headers': headers,
-                    'body': json.dumps({'error': 'Missing session_id or plan'})
-                }
-            
-            try:
-                # Retrieve the checkout session from Stripe
-                print(f"Retrieving session from Stripe: {session_id}")
-                session = stripe.checkout.Session.retrieve(session_id)
-                
-                print(f"Session retrieved:")
-                print(f"  - Payment status: {session.payment_status}")
-                print(f"  - Session status: {session.status}")
-                print(f"  - Customer: {session.customer}")
-                print(f"  - Subscription: {session.subscription}")
-                print(f"  - Amount total: {session.amount_total}")
-                
-                if session.payment_status == 'paid' and session.status == 'complete':
-                    # Update user's plan to active
-                    subscription_id = session.subscription
-                    
-                    print(f"✓ Payment confirmed - Updating database...")
-                    print(f"  User ID: {user_id}")
-                    print(f"  Plan: {plan}")
-                    print(f"  Subscription ID: {subscription_id}")
-                    
-                    try:
-                        # Update ThreatalyticsUsers table
-                        print(f"\n1. Updating ThreatalyticsUsers table...")
-                        users_update = users_table.update_item(
-                            Key={'user_id': user_id},
-                            UpdateExpression='SET plan = :plan, subscription_status = :status, stripe_subscription_id = :sub_id, updated_at = :updated REMOVE pending_plan',
-                            ExpressionAttributeValues={
-                                ':plan': plan,
-                                ':status': 'active',
-                                ':sub_id': subscription_id,
-                                ':updated': datetime.utcnow().isoformat()
-                            },
-                            ReturnValues='ALL_NEW'
-                        )
-                        print(f"✓ ThreatalyticsUsers updated:")
-                        print(f"  {users_update.get('Attributes')}")
-                        
-                        # Create subscription entry in ThreatalyticsPlans (subscriptions) table
-                        print(f"\n2. Creating subscription entry in ThreatalyticsPlans table...")
-                        subscriptions_table.put_item(Item={
-                            'user_id': user_id,
-                            'subscription_id': subscription_id,
-                            'plan': plan,
-                            'status': 'active',
-                            'stripe_subscription_id': subscription_id,
-                            'stripe_customer_id': session.customer,
-                            'amount': session.amount_total,
-                            'currency': session.currency,
-                            'created_at': datetime.utcnow().isoformat(),
-                            'updated_at': datetime.utcnow().isoformat()
-                        })
-                        print(f"✓ Subscription entry created in ThreatalyticsPlans")
-                        
-                        print(f"\n✓✓✓ ALL DATABASE UPDATES SUCCESSFUL ✓✓✓")
-                        print("=" * 80)
-                        
-                    except Exception as db_error:
-                        print(f"\n✗✗✗ DATABASE UPDATE FAILED ✗✗✗")
-                        print(f"Error: {db_error}")
-                        import traceback
-                        print(traceback.format_exc())
-                        print("=" * 80)
-                        raise db_error
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'success': True,
-                            'message': 'Payment verified and subscription activated',
-                            'plan': plan,
-                            'status': 'active'
-                        })
-                    }
-                else:
-                    print(f"\n✗ Payment not completed")
-                    print(f"  Payment status: {session.payment_status} (expected: paid)")
-                    print(f"  Session status: {session.status} (expected: complete)")
-                    print("=" * 80)
-                    
-                    return {
-                        'statusCode': 400,
-                        'headers': headers,
-                        'body': json.dumps({
-                            'success': False,
-                            'message': 'Payment not completed',
-                            'payment_status': session.payment_status,
-                            'session_status': session.status
-                        })
-                    }
-                    
-            except Exception as e:
-                print(f"\n✗✗✗ VERIFICATION ERROR ✗✗✗")
-                print(f"Error: {e}")
-                import traceback
-                print(traceback.format_exc())
-                print("=" * 80)
-                
-                return {
-                    'statusCode': 500,
-                    'headers': headers,
-                    'body': json.dumps({'error': str(e)})
-                }
-
         elif method == 'POST' and path.endswith('/subscription/cancel'):
             stripe_customer_id = user.get('stripe_customer_id')
 
@@ -436,10 +443,11 @@ def lambda_handler(event, context):
 
             if subscriptions.data:
                 sub = subscriptions.data[0]
-                stripe.Subscription.modify(
+                updated = stripe.Subscription.modify(
                     sub.id,
                     cancel_at_period_end=True
                 )
+                put_state(dynamodb, state_from_subscription(user_id, updated, user.get('plan', 'free')))
 
                 return {
                     'statusCode': 200,
@@ -0,0 +1,129 @@
+"""
+Subscription state projection.
+
+ThreatalyticsSubscriptionState holds one item per user with what
+GET /subscription/status returns. The Stripe webhook worker writes it as
+events arrive, and /subscription/verify writes it right after checkout.
+Each write carries the Stripe event's `created` time and is conditional
+on it, so a late, older event never overwrites newer state.
+
+Reads go through a small per-container TTL cache. Stripe is only asked
+when the item is missing or stale.
+
+Completed Checkout Sessions are also kept for a day in the Stripe event
+ledger, under 'checkout#<session id>', so /subscription/verify can skip
+Session.retrieve once the webhook has seen the session.
+"""
+import os
+import time
+
+STATE_TABLE = os.environ.get('SUBSCRIPTION_STATE_TABLE', 'ThreatalyticsSubscriptionState')
+CACHE_TTL_SECONDS = int(os.environ.get('SUBSCRIPTION_CACHE_TTL', '30'))
+MAX_AGE_SECONDS = int(os.environ.get('SUBSCRIPTION_STATE_MAX_AGE', str(24 * 3600)))
+RENEWAL_GRACE_SECONDS = 3600
+SESSIONS_TABLE = os.environ.get('STRIPE_EVENTS_TABLE', 'ThreatalyticsStripeEvents')
+SESSION_TTL_SECONDS = 86400
+SESSION_FIELDS = ('id', 'payment_status', 'status', 'customer', 'subscription',
+                  'amount_total', 'currency', 'created', 'metadata')
+ACTIVE_STATUSES = ('active', 'trialing')
+
+_cache = {}
+
+def subscription_plan(subscription, default='free'):
+    """Plan name from the price metadata, then the subscription metadata"""
+    try:
+        price = subscription['items']['data'][0].get('price') or {}
+        plan = (price.get('metadata') or {}).get('plan')
+        if plan:
+            return plan
+    except (KeyError, IndexError, TypeError):
+        pass
+    return (subscription.get('metadata') or {}).get('plan') or default
+
+def state_from_subscription(user_id, subscription, default_plan='free'):
+    status = subscription.get('status')
+    return {
+        'user_id': user_id,
+        'active': status in ACTIVE_STATUSES,
+        'plan': subscription_plan(subscription, default_plan) if status in ACTIVE_STATUSES else 'free',
+        'status': status,
+        'stripe_subscription_id': subscription.get('id'),
+        'stripe_customer_id': subscription.get('customer'),
+        'current_period_end': subscription.get('current_period_end'),
+        'cancel_at_period_end': bool(subscription.get('cancel_at_period_end'))
+    }
+
+def put_state(dynamodb, item, event_created=None):
+    """
+    Write the projection unless a newer event already has. event_created is
+    the Stripe event time; None means "as of now" (a direct Stripe read).
+    Returns False if the write lost to newer state.
+    """
+    event_created = int(event_created if event_created is not None else time.time())
+    item = {k: v for k, v in item.items() if v is not None}
+    item.update({'event_created': event_created, 'synced_at': int(time.time())})
+    try:
+        dynamodb.Table(STATE_TABLE).put_item(
+            Item=item,
+            ConditionExpression='attribute_not_exists(event_created) OR event_created <= :created',
+            ExpressionAttributeValues={':created': event_created}
+        )
+    except dynamodb.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    _cache.pop(item['user_id'], None)
+    return True
+
+def is_stale(item, now=None):
+    now = now or time.time()
+    if now - int(item.get('synced_at', 0)) > MAX_AGE_SECONDS:
+        return True
+    # An active period that ended without a renewal event means we missed one
+    period_end = item.get('current_period_end')
+    return bool(item.get('active') and period_end and int(period_end) + RENEWAL_GRACE_SECONDS < now)
+
+def get_state(dynamodb, user_id):
+    """Cached point read; None if the user has no fresh projection"""
+    cached = _cache.get(user_id)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    item = dynamodb.Table(STATE_TABLE).get_item(Key={'user_id': user_id}).get('Item')
+    if item is None or is_stale(item):
+        return None
+    _cache[user_id] = (time.time() + CACHE_TTL_SECONDS, item)
+    return item
+
+def forget(user_id):
+    _cache.pop(user_id, None)
+
+def status_body(item):
+    """The /subscription/status payload for a projection item"""
+    if not item.get('active'):
+        return {
+            'active': False,
+            'plan': item.get('plan', 'free'),
+            'status': item.get('status'),
+            'message': 'No active subscription'
+        }
+    return {
+        'active': True,
+        'plan': item.get('plan'),
+        'status': item.get('status'),
+        'current_period_end': int(item['current_period_end']) if item.get('current_period_end') else None,
+        'cancel_at_period_end': bool(item.get('cancel_at_period_end'))
+    }
+
+def cache_checkout_session(dynamodb, session):
+    """Called by the webhook on checkout.session.completed"""
+    item = {field: session.get(field) for field in SESSION_FIELDS if session.get(field) is not None}
+    item.update({
+        'event_id': f"checkout#{session['id']}",
+        'expires_at': int(time.time()) + SESSION_TTL_SECONDS
+    })
+    dynamodb.Table(SESSIONS_TABLE).put_item(Item=item)
+
+def cached_checkout_session(dynamodb, session_id):
+    """The session as the webhook saw it, or None"""
+    item = dynamodb.Table(SESSIONS_TABLE).get_item(Key={'event_id': f'checkout#{session_id}'}).get('Item')
+    if not item or int(item.get('expires_at', 0)) < time.time():
+        return None
+    return {field: item.get(field) for field in SESSION_FIELDS}
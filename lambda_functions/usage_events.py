@@ -0,0 +1,215 @@
+"""
+Usage events for every metered endpoint.
+
+Handlers call record() once the work has succeeded and flush() just before
+returning. Each event is written with one transaction: a conditional put
+on ThreatalyticsUsage (user_id/timestamp, the shape usage_tracker reads)
+plus ADDs on its user-month item in ThreatalyticsUsageCounters, which
+quota checks read. An event already stored fails the condition and changes
+nothing, so re-sending one is safe, even after a timeout that left it
+unclear whether the first attempt landed.
+
+Nothing is retried on the request path: the writer's client gives up after
+one attempt, and events that could not be written go to a spill file in
+/tmp and are sent with the next flush from the same container.
+
+Events stored before the counters existed carry no `counted` attribute.
+The first read of a user-month adds them to its counter once, see
+current_month_total.
+"""
+import base64
+import json
+import os
+import threading
+from datetime import datetime
+
+from lambda_functions.etags import bump_version
+
+USAGE_TABLE = os.environ.get('USAGE_TABLE', 'ThreatalyticsUsage')
+COUNTERS_TABLE = os.environ.get('USAGE_COUNTERS_TABLE', 'ThreatalyticsUsageCounters')
+SPILL_PATH = os.environ.get('USAGE_SPILL_PATH', '/tmp/usage-spill.json')
+MAX_SPILL_EVENTS = 10000
+# Spilled events are replayed a slice at a time so one request does not pay for a backlog
+MAX_EVENTS_PER_FLUSH = 100
+
+def month_of(timestamp):
+    return timestamp[:7]
+
+def serialize(value):
+    """DynamoDB wire format for the only types usage events hold"""
+    return {'N': str(value)} if isinstance(value, int) else {'S': str(value)}
+
+def event_transaction(event):
+    """Put the event unless it is stored already, and count it on its user-month"""
+    usage = int(event.get('usage', 1))
+    return [
+        {'Put': {
+            'TableName': USAGE_TABLE,
+            'Item': {k: serialize(v) for k, v in {**event, 'counted': 1}.items()},
+            'ConditionExpression': 'attribute_not_exists(#ts)',
+            'ExpressionAttributeNames': {'#ts': 'timestamp'}
+        }},
+        {'Update': {
+            'TableName': COUNTERS_TABLE,
+            'Key': {'user_id': serialize(event['user_id']), 'month': serialize(month_of(event['timestamp']))},
+            'UpdateExpression': 'ADD #total :n, #endpoint :n',
+            'ExpressionAttributeNames': {'#total': 'total', '#endpoint': f"endpoint#{event['endpoint']}"},
+            'ExpressionAttributeValues': {':n': serialize(usage)}
+        }}
+    ]
+
+def write_event(client, event):
+    """Store and count one event. Returns False if it was already stored."""
+    try:
+        client.transact_write_items(TransactItems=event_transaction(event))
+    except client.exceptions.TransactionCanceledException as e:
+        reasons = e.response.get('CancellationReasons') or []
+        if reasons and reasons[0].get('Code') == 'ConditionalCheckFailed':
+            return False
+        raise
+    return True
+
+def usage_user_id(event):
+    """Cognito sub from the Authorization header; API-key callers are metered per key"""
+    headers = event.get('headers') or {}
+    try:
+        claims = event.get('requestContext', {}).get('authorizer', {}).get('claims')
+        if claims and claims.get('sub'):
+            return claims['sub']
+        auth_header = headers.get('Authorization') or headers.get('authorization') or ''
+        if auth_header.startswith('Bearer '):
+            payload = auth_header[7:].split('.')[1]
+            payload += '=' * (4 - len(payload) % 4)
+            sub = json.loads(base64.urlsafe_b64decode(payload)).get('sub')
+            if sub:
+                return sub
+    except Exception as e:
+        print(f"Error extracting user_id for usage: {str(e)}")
+    api_key = headers.get('X-API-Key') or headers.get('x-api-key')
+    return f"api-key-user-{api_key[:8]}" if api_key else None
+
+class UsageWriter:
+    def __init__(self, dynamodb, spill_path=SPILL_PATH):
+        self.dynamodb = dynamodb
+        self.spill_path = spill_path
+        self.lock = threading.Lock()
+        self.events = []
+        self._load_spill()
+
+    def record(self, user_id, endpoint, **attributes):
+        if not user_id:
+            return
+        with self.lock:
+            self.events.append({
+                **attributes,
+                'user_id': user_id,
+                'timestamp': datetime.utcnow().isoformat(),
+                'endpoint': endpoint,
+                'usage': 1
+            })
+
+    def flush(self):
+        """Write buffered events with their counters; returns the number of events stored"""
+        with self.lock:
+            # Newest events first, so a replayed backlog never holds back the current request's
+            events, self.events = self.events[-MAX_EVENTS_PER_FLUSH:], self.events[:-MAX_EVENTS_PER_FLUSH]
+
+        client = self.dynamodb.meta.client
+        stored, users, failed = 0, set(), []
+        for i, event in enumerate(events):
+            try:
+                if write_event(client, event):
+                    stored += 1
+                    users.add(event['user_id'])
+            except Exception as e:
+                # Stop at the first failure; the client already gave up once, the rest would too
+                print(f"Usage events spilled ({len(events) - i}): {str(e)}")
+                failed = events[i:]
+                break
+
+        for user_id in users:
+            bump_version(self.dynamodb, user_id, 'usage')
+
+        with self.lock:
+            self.events = (self.events + failed)[-MAX_SPILL_EVENTS:]
+            self._save_spill()
+        return stored
+
+    def _load_spill(self):
+        try:
+            with open(self.spill_path) as f:
+                self.events = json.load(f).get('events', [])
+        except (OSError, ValueError):
+            pass
+
+    def _save_spill(self):
+        try:
+            if not self.events:
+                if os.path.exists(self.spill_path):
+                    os.remove(self.spill_path)
+                return
+            spill = {'events': self.events}
+            with open(self.spill_path + '.tmp', 'w') as f:
+                json.dump(spill, f)
+            os.replace(self.spill_path + '.tmp', self.spill_path)
+        except OSError as e:
+            print(f"Error saving usage spill: {str(e)}")
+
+_writer = None
+
+def get_writer():
+    """One writer per container, on a client that fails fast instead of retrying"""
+    global _writer
+    if _writer is None:
+        import boto3
+        from botocore.config import Config
+        dynamodb = boto3.resource('dynamodb', config=Config(
+            retries={'max_attempts': 1, 'mode': 'standard'}, connect_timeout=1, read_timeout=2
+        ))
+        _writer = UsageWriter(dynamodb)
+    return _writer
+
+def uncounted_events(dynamodb, user_id, month):
+    """Number of the user's events in `month` stored before they were counted"""
+    kwargs = {
+        'KeyConditionExpression': 'user_id = :uid AND begins_with(#ts, :month)',
+        'FilterExpression': 'attribute_not_exists(counted)',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':uid': user_id, ':month': month},
+        'Select': 'COUNT'
+    }
+    table = dynamodb.Table(USAGE_TABLE)
+    total = 0
+    while True:
+        response = table.query(**kwargs)
+        total += response.get('Count', 0)
+        if 'LastEvaluatedKey' not in response:
+            return total
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def current_month_total(dynamodb, user_id, now=None):
+    """
+    This month's call count. The first read of a user-month adds the events
+    stored before counting began to the counter, once, and marks it seeded.
+    """
+    month = (now or datetime.utcnow()).strftime('%Y-%m')
+    table = dynamodb.Table(COUNTERS_TABLE)
+    key = {'user_id': user_id, 'month': month}
+    item = table.get_item(Key=key).get('Item') or {}
+    if item.get('seeded'):
+        return int(item.get('total', 0))
+
+    earlier = uncounted_events(dynamodb, user_id, month)
+    try:
+        item = table.update_item(
+            Key=key,
+            UpdateExpression='ADD #total :earlier SET seeded = :one',
+            ConditionExpression='attribute_not_exists(seeded)',
+            ExpressionAttributeNames={'#total': 'total'},
+            ExpressionAttributeValues={':earlier': earlier, ':one': 1},
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # Another request seeded it first
+        item = table.get_item(Key=key).get('Item') or {}
+    return int(item.get('total', 0))
@@ -4,6 +4,8 @@ import os
 from datetime import datetime, timedelta
 from decimal import Decimal
 from boto3.dynamodb.conditions import Key, Attr
+from lambda_functions.etags import get_version, make_etag, etag_matches, cache_headers, not_modified
+from lambda_functions.usage_events import get_writer, current_month_total
 
 dynamodb = boto3.resource('dynamodb')
 usage_table = dynamodb.Table(os.environ.get('USAGE_TABLE', 'ThreatalyticsUsage'))
@@ -69,13 +71,10 @@ def get_user_from_token(event):
 def track_usage(user_id, endpoint):
     """Track API usage for a user"""
     try:
-        timestamp = datetime.utcnow().isoformat()
-        usage_table.put_item(Item={
-            'user_id': user_id,
-            'timestamp': timestamp,
-            'endpoint': endpoint,
-            'usage': 1
-        })
+        # Same writer the metered endpoints use: event, monthly counter and version bump
+        usage = get_writer()
+        usage.record(user_id, endpoint)
+        usage.flush()
         return True
     except Exception as e:
         print(f"Error tracking usage: {e}")
@@ -89,16 +88,8 @@ def get_user_usage(user_id):
         user = user_response.get('Item', {})
         plan = user.get('plan', 'free')
         
-        # Get current month's usage
-        now = datetime.utcnow()
-        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0).isoformat()
-        
-        response = usage_table.query(
-            KeyConditionExpression=Key('user_id').eq(user_id) & Key('timestamp').gte(month_start)
-        )
-        
-        usage_items = response.get('Items', [])
-        current_usage = len(usage_items)
+        # Get current month's usage from the monthly counter
+        current_usage = current_month_total(dynamodb, user_id)
         
         # Get plan limits
         plan_limits = PLAN_LIMITS.get(plan, PLAN_LIMITS['free'])
@@ -163,6 +154,10 @@ def check_usage_limit(user_id):
             'error': str(e)
         }
 
+def usage_etag(user_id):
+    """ETag for GET /usage; the month is included because counts reset on the 1st"""
+    return make_etag('usage', user_id, get_version(dynamodb, user_id, 'usage'), datetime.utcnow().strftime('%Y-%m'))
+
 def lambda_handler(event, context):
     """
     Usage Tracking Lambda
@@ -196,11 +191,16 @@ def lambda_handler(event, context):
             }
         
         if method == 'GET' and path.endswith('/usage'):
+            # Polled by the dashboard; answer 304 while nothing has changed
+            etag = usage_etag(user_id)
+            if etag_matches(event, etag):
+                return not_modified(headers, etag)
+
             # Get user's current usage
             usage_data = get_user_usage(user_id)
             return {
                 'statusCode': 200,
-                'headers': headers,
+                'headers': {**headers, **cache_headers(etag)},
                 'body': json.dumps({
                     'success': True,
                     'usage': usage_data
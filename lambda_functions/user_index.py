@@ -0,0 +1,127 @@
+"""
+Admin lookups on ThreatalyticsUsers without scans.
+
+auth.py writes three extra attributes at signup, and each feeds a sparse GSI:
+
+    signup_month  'YYYY-MM'           signup-month-index (signup_month, created_at)
+    email_initial first character     email-prefix-index (email_initial, email_lower)
+    email_lower   lower-cased email
+
+Newest signups are a Query per month, newest first, stopping once `limit`
+users are found. Email search uses the existing email-index for a full
+address. A prefix cannot be matched on a hash key, so prefixes go through
+email-prefix-index with begins_with.
+
+Users created before these attributes existed are backfilled with
+
+    python -m lambda_functions.user_index --backfill [--segments 4]
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+USERS_TABLE = os.environ.get('USERS_TABLE', 'ThreatalyticsUsers')
+SIGNUP_INDEX = 'signup-month-index'
+EMAIL_INDEX = 'email-index'
+EMAIL_PREFIX_INDEX = 'email-prefix-index'
+MAX_MONTHS_BACK = 24
+
+def index_attributes(email, created_at):
+    """Attributes to store on a user item so the admin indexes pick it up"""
+    attributes = {'signup_month': created_at[:7]}
+    if email:
+        attributes.update({'email_initial': email[0].lower(), 'email_lower': email.lower()})
+    return attributes
+
+def previous_month(month):
+    year, number = int(month[:4]), int(month[5:7]) - 1
+    if number == 0:
+        year, number = year - 1, 12
+    return f'{year:04d}-{number:02d}'
+
+def recent_users(table, limit=10, now=None, months_back=MAX_MONTHS_BACK):
+    """Newest `limit` users, one bounded Query per month going back"""
+    month = (now or datetime.utcnow()).strftime('%Y-%m')
+    users = []
+    for _ in range(months_back):
+        response = table.query(
+            IndexName=SIGNUP_INDEX,
+            KeyConditionExpression='signup_month = :month',
+            ExpressionAttributeValues={':month': month},
+            ScanIndexForward=False,
+            Limit=limit - len(users)
+        )
+        users.extend(response.get('Items', []))
+        if len(users) >= limit:
+            break
+        month = previous_month(month)
+    return users
+
+def search_by_email(table, text, limit=20):
+    """Users whose email is `text` (full address) or starts with it"""
+    text = (text or '').strip()
+    if not text:
+        return []
+    if '@' in text and '.' in text.split('@', 1)[1]:
+        items = table.query(
+            IndexName=EMAIL_INDEX,
+            KeyConditionExpression='email = :email',
+            ExpressionAttributeValues={':email': text},
+            Limit=limit
+        ).get('Items', [])
+        if items:
+            return items
+    prefix = text.lower()
+    kwargs = {
+        'IndexName': EMAIL_PREFIX_INDEX,
+        'KeyConditionExpression': 'email_initial = :initial AND begins_with(email_lower, :prefix)',
+        'ExpressionAttributeValues': {':initial': prefix[0], ':prefix': prefix},
+        'Limit': limit
+    }
+    return table.query(**kwargs).get('Items', [])
+
+def backfill(table, segments=4):
+    """Add the index attributes to users that lack them; returns the number updated"""
+    def run_segment(segment):
+        kwargs = {
+            'ProjectionExpression': 'user_id, email, created_at',
+            'FilterExpression': 'attribute_exists(created_at) AND '
+                                '(attribute_not_exists(signup_month) OR attribute_not_exists(email_lower))',
+            'Segment': segment,
+            'TotalSegments': segments
+        }
+        updated = 0
+        while True:
+            response = table.scan(**kwargs)
+            for user in response.get('Items', []):
+                attributes = index_attributes(user.get('email'), user['created_at'])
+                names = {f'#a{i}': name for i, name in enumerate(attributes)}
+                table.update_item(
+                    Key={'user_id': user['user_id']},
+                    UpdateExpression='SET ' + ', '.join(f'{n} = :{n[1:]}' for n in names),
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues={f':{n[1:]}': attributes[a] for n, a in names.items()}
+                )
+                updated += 1
+            if 'LastEvaluatedKey' not in response:
+                return updated
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        return sum(executor.map(run_segment, range(segments)))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain the admin indexes on ThreatalyticsUsers')
+    parser.add_argument('--backfill', action='store_true', help='add index attributes to existing users')
+    parser.add_argument('--segments', type=int, default=4)
+    args = parser.parse_args(argv)
+    if not args.backfill:
+        parser.error('nothing to do (use --backfill)')
+
+    import boto3
+    updated = backfill(boto3.resource('dynamodb').Table(USERS_TABLE), args.segments)
+    print(f"Backfilled {updated} users")
+
+if __name__ == '__main__':
+    main()
@@ -361,12 +361,19 @@ const ChatInterface = ({
         }
 
         const endpoint = ENDPOINTS.analysis[analysisType as keyof typeof ENDPOINTS.analysis];
+        const headers: Record<string, string> = {
+          "Content-Type": "application/json",
+          "x-api-key": API_KEY
+        };
+        // Lets the endpoint meter the call against the signed-in user's plan
+        const tokensStr = localStorage.getItem('threatalytics_tokens');
+        const accessToken = tokensStr ? JSON.parse(tokensStr).access_token : null;
+        if (accessToken) {
+          headers["Authorization"] = `Bearer ${accessToken}`;
+        }
         const response = await fetch(`${API_CONFIG.API_BASE_URL}${endpoint}`, {
           method: "POST",
-          headers: { 
-            "Content-Type": "application/json",
-            "x-api-key": API_KEY
-          },
+          headers,
           body: JSON.stringify(requestBody),
         });
 
@@ -30,7 +30,8 @@ export const ENDPOINTS = {
 
     // ❌ Not Live - Conversation Management
     conversations: {
-        list: '/conversations',      // GET - List all user conversations
+        list: '/conversations',      // GET - List all user conversations (?view=summary&cursor= for paginated summaries)
+        get: (id: string) => `/conversations/${id}`, // GET - Single conversation with messages
         create: '/conversations',    // POST - Save new conversation
         delete: (id: string) => `/conversations/${id}` // DELETE - Delete conversation
     },
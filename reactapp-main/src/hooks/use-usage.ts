@@ -3,6 +3,9 @@ import { usageService, UsageData } from '@/lib/usage-service';
 import { subscriptionService, SubscriptionStatus } from '@/lib/subscription-service';
 import Swal from 'sweetalert2';
 
+// Endpoints that write their own usage events (lambda_functions/usage_events.py)
+const SERVER_METERED_ENDPOINTS = ['redact', 'report', 'drill'];
+
 export const useUsageTracking = () => {
     const [usage, setUsage] = useState<UsageData | null>(null);
     const [subscription, setSubscription] = useState<SubscriptionStatus | null>(null);
@@ -87,7 +90,10 @@ export const useUsageTracking = () => {
      */
     const trackApiUsage = async (endpoint: string) => {
         try {
-            await usageService.trackUsage(endpoint);
+            // These endpoints record their own usage server-side
+            if (!SERVER_METERED_ENDPOINTS.includes(endpoint)) {
+                await usageService.trackUsage(endpoint);
+            }
             // Immediately reload usage data to update UI
             const usageData = await usageService.getUsage();
             setUsage(usageData);
@@ -17,6 +17,36 @@ export interface ActivityEntry {
   updated_at?: string;
 }
 
+export interface ActivityPage {
+  activities: ActivityEntry[];
+  next_cursor: string | null;
+  count: number;
+}
+
+export interface ActivityImportReport {
+  rows: number;
+  imported: number;
+  failed: number;
+  elapsed_ms: number;
+  rows_per_sec: number;
+  errors: { row: number; error: string }[];
+  errors_truncated: boolean;
+}
+
+export interface NoteUpdateResult {
+  id: string | null;
+  ok: boolean;
+  error?: string;
+}
+
+export interface ActivityQuery {
+  clientId?: string;
+  from?: string;
+  to?: string;
+  limit?: number;
+  cursor?: string | null;
+}
+
 class ActivityService {
   private AUTH_BASE_URL = API_CONFIG.AUTH_BASE_URL;
 
@@ -44,11 +74,22 @@ class ActivityService {
   }
 
   async getActivities(clientId?: string): Promise<ActivityEntry[]> {
+    const page = await this.getActivityPage({ clientId });
+    return page.activities;
+  }
+
+  async getActivityPage(query: ActivityQuery = {}): Promise<ActivityPage> {
     try {
-      const url = clientId 
-        ? `${this.AUTH_BASE_URL}/admin/activity?client_id=${clientId}`
-        : `${this.AUTH_BASE_URL}/admin/activity`;
-      
+      const params = new URLSearchParams();
+      if (query.clientId) params.set('client_id', query.clientId);
+      if (query.from) params.set('from', query.from);
+      if (query.to) params.set('to', query.to);
+      if (query.limit) params.set('limit', String(query.limit));
+      if (query.cursor) params.set('cursor', query.cursor);
+
+      const qs = params.toString();
+      const url = `${this.AUTH_BASE_URL}/admin/activity${qs ? `?${qs}` : ''}`;
+
       const response = await fetch(url, {
         method: 'GET',
         headers: this.getAuthHeaders()
@@ -60,7 +101,11 @@ class ActivityService {
       }
 
       const data = await response.json();
-      return data || [];
+      return {
+        activities: data?.activities || [],
+        next_cursor: data?.next_cursor || null,
+        count: data?.count || 0
+      };
     } catch (error) {
       console.error('Error fetching activities:', error);
       throw error;
@@ -90,6 +135,41 @@ class ActivityService {
       throw error;
     }
   }
+
+  async importActivities(file: File): Promise<ActivityImportReport> {
+    const format = /\.(ndjson|jsonl)$/i.test(file.name) ? 'ndjson' : 'csv';
+    const response = await fetch(`${this.AUTH_BASE_URL}/admin/activity/import?format=${format}`, {
+      method: 'POST',
+      headers: {
+        ...this.getAuthHeaders(),
+        'Content-Type': format === 'ndjson' ? 'application/x-ndjson' : 'text/csv'
+      },
+      body: file
+    });
+
+    if (!response.ok) {
+      const errorText = await response.text();
+      throw new Error(`Failed to import activities: ${response.status} - ${errorText}`);
+    }
+
+    return response.json();
+  }
+
+  async updateNotes(updates: { id: string; note: string }[]): Promise<NoteUpdateResult[]> {
+    const response = await fetch(`${this.AUTH_BASE_URL}/admin/note/batch`, {
+      method: 'POST',
+      headers: this.getAuthHeaders(),
+      body: JSON.stringify({ updates })
+    });
+
+    if (!response.ok) {
+      const errorText = await response.text();
+      throw new Error(`Failed to update notes: ${response.status} - ${errorText}`);
+    }
+
+    const data = await response.json();
+    return data.results || [];
+  }
 }
 
 export const activityService = new ActivityService();
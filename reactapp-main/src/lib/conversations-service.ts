@@ -14,6 +14,22 @@ export interface Conversation {
   messages: ConversationMessage[];
   created_at: string;
   updated_at: string;
+  version?: number;
+}
+
+export interface ConversationSummary {
+  conversation_id: string;
+  mode: string;
+  title: string;
+  preview?: string;
+  message_count: number;
+  created_at?: string;
+  updated_at: string;
+}
+
+export interface ConversationSummaryPage {
+  conversations: ConversationSummary[];
+  next_cursor: string | null;
 }
 
 type StoredTokens = {
@@ -182,6 +198,16 @@ async function getValidAuthToken(): Promise<{ token: string; type: 'id_token' |
 class ConversationsService {
   private AUTH_BASE_URL = API_CONFIG.AUTH_BASE_URL;
 
+  // Last server version (= message count) seen per conversation, used for delta sync
+  private versions = new Map<string, number>();
+  // How many of this client's local messages have already been sent
+  private sentCounts = new Map<string, number>();
+
+  private markSynced(conversationId: string, version: number, sentCount: number) {
+    this.versions.set(conversationId, version);
+    this.sentCounts.set(conversationId, sentCount);
+  }
+
   // returns headers that include the valid token
   private async getAuthHeader(): Promise<HeadersInit> {
     const { token, type } = await getValidAuthToken();
@@ -216,6 +242,46 @@ class ConversationsService {
     }
   }
 
+  // Lightweight listing for the History page: titles and counts only, no message bodies
+  async listConversationSummaries(cursor?: string | null, limit = 20): Promise<ConversationSummaryPage> {
+    const params = new URLSearchParams({ view: 'summary', limit: String(limit) });
+    if (cursor) params.set('cursor', cursor);
+    const url = `${this.AUTH_BASE_URL}/conversations?${params.toString()}`;
+    try {
+      const res = await this.authedFetch(url, { method: 'GET' });
+      if (!res.ok) {
+        const txt = await res.text();
+        throw new Error(`Failed to fetch conversations: ${res.status} - ${txt}`);
+      }
+      const json = await res.json();
+      return {
+        conversations: json.conversations || [],
+        next_cursor: json.next_cursor ?? null,
+      };
+    } catch (err) {
+      console.error('Error in listConversationSummaries:', err);
+      throw err;
+    }
+  }
+
+  async getConversation(conversationId: string): Promise<Conversation> {
+    const url = `${this.AUTH_BASE_URL}/conversations/${conversationId}`;
+    try {
+      const res = await this.authedFetch(url, { method: 'GET' });
+      if (!res.ok) {
+        const txt = await res.text();
+        throw new Error(`Failed to fetch conversation: ${res.status} - ${txt}`);
+      }
+      const json = await res.json();
+      const conversation: Conversation = json.conversation;
+      this.markSynced(conversationId, conversation.version ?? conversation.messages.length, conversation.messages.length);
+      return conversation;
+    } catch (err) {
+      console.error('Error in getConversation:', err);
+      throw err;
+    }
+  }
+
   async createConversation(mode: string, title: string, messages: ConversationMessage[]): Promise<string | null> {
     const url = `${this.AUTH_BASE_URL}/conversations`;
     try {
@@ -229,6 +295,9 @@ class ConversationsService {
         return null;
       }
       const data = await res.json();
+      if (data.conversation_id) {
+        this.markSynced(data.conversation_id, data.version ?? messages.length, messages.length);
+      }
       return data.conversation_id ?? null;
     } catch (err) {
       console.error('Error createConversation:', err);
@@ -236,19 +305,47 @@ class ConversationsService {
     }
   }
 
+  // Fetch only the messages newer than `since` (the last version this client saw)
+  async syncConversation(conversationId: string, since: number): Promise<{ version: number; messages: ConversationMessage[]; has_more: boolean }> {
+    const url = `${this.AUTH_BASE_URL}/conversations/${conversationId}/sync?since=${since}`;
+    const res = await this.authedFetch(url, { method: 'GET' });
+    if (!res.ok) {
+      const txt = await res.text();
+      throw new Error(`Failed to sync conversation: ${res.status} - ${txt}`);
+    }
+    const json = await res.json();
+    this.versions.set(conversationId, since + json.messages.length);
+    return json;
+  }
+
+  /**
+   * Send only the messages the server hasn't seen yet. If another tab appended
+   * first (409), the server returns what we missed and we retry on top of it.
+   */
   async updateConversation(conversationId: string, messages: ConversationMessage[]): Promise<boolean> {
-    const url = `${this.AUTH_BASE_URL}/conversations/${conversationId}`;
+    const url = `${this.AUTH_BASE_URL}/conversations/${conversationId}/sync`;
+    let baseVersion = this.versions.get(conversationId) ?? 0;
+    const pending = messages.slice(this.sentCounts.get(conversationId) ?? 0);
     try {
-      const res = await this.authedFetch(url, {
-        method: 'PUT',
-        body: JSON.stringify({ messages }),
-      });
-      if (!res.ok) {
-        const txt = await res.text();
-        console.error('Failed to update conversation:', res.status, txt);
-        return false;
+      for (let attempt = 0; attempt < 3; attempt++) {
+        if (pending.length === 0) return true;
+        const res = await this.authedFetch(url, {
+          method: 'POST',
+          body: JSON.stringify({ base_version: baseVersion, messages: pending }),
+        });
+        const data = await res.json().catch(() => ({}));
+        if (res.ok) {
+          this.markSynced(conversationId, data.version, messages.length);
+          return true;
+        }
+        if (res.status !== 409) {
+          console.error('Failed to update conversation:', res.status, data);
+          return false;
+        }
+        console.warn('Conversation changed in another session, rebasing local messages');
+        baseVersion = data.version;
       }
-      return true;
+      return false;
     } catch (err) {
       console.error('Error updateConversation:', err);
       return false;
@@ -4,10 +4,130 @@ export interface FeedbackData {
   question: string;
   helpful: boolean;
   comments: string;
+  mode?: string;
 }
 
+export interface FeedbackEvent extends FeedbackData {
+  id: string;
+  timestamp: string;
+}
+
+export interface FeedbackBatchResult {
+  status: string;
+  accepted: number;
+  duplicates: number;
+  rejected: { index: number; id: string | null; error: string }[];
+}
+
+const BUFFER_KEY = 'threatalytics_feedback_buffer';
+const FLUSH_INTERVAL_MS = 30000;
+const MAX_BUFFERED = 20;
+const MAX_BATCH = 100;
+
 class FeedbackService {
   private AUTH_BASE_URL = API_CONFIG.AUTH_BASE_URL;
+  // Events wait here (and in localStorage) until the next flush
+  private buffer: FeedbackEvent[] = this.loadBuffer();
+  private flushTimer: ReturnType<typeof setTimeout> | null = null;
+  private flushing: Promise<void> | null = null;
+  private flushListeners = new Set<() => void>();
+
+  constructor() {
+    if (typeof window !== 'undefined') {
+      // Deliver whatever is buffered when the tab goes away
+      window.addEventListener('pagehide', () => this.flush(true));
+      document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') this.flush(true);
+      });
+      if (this.buffer.length) this.scheduleFlush();
+    }
+  }
+
+  private loadBuffer(): FeedbackEvent[] {
+    try {
+      return JSON.parse(localStorage.getItem(BUFFER_KEY) || '[]');
+    } catch {
+      return [];
+    }
+  }
+
+  private saveBuffer() {
+    localStorage.setItem(BUFFER_KEY, JSON.stringify(this.buffer));
+  }
+
+  private scheduleFlush() {
+    if (this.flushTimer) return;
+    this.flushTimer = setTimeout(() => {
+      this.flushTimer = null;
+      this.flush();
+    }, FLUSH_INTERVAL_MS);
+  }
+
+  /** Called after each successful flush, e.g. to refresh metrics */
+  onFlush(listener: () => void): () => void {
+    this.flushListeners.add(listener);
+    return () => this.flushListeners.delete(listener);
+  }
+
+  /** Buffer a feedback event; it is sent with the next batch */
+  queueFeedback(feedback: FeedbackData): FeedbackEvent {
+    const event: FeedbackEvent = {
+      ...feedback,
+      id: crypto.randomUUID(),
+      timestamp: new Date().toISOString()
+    };
+    this.buffer.push(event);
+    this.saveBuffer();
+
+    if (this.buffer.length >= MAX_BUFFERED) {
+      this.flush();
+    } else {
+      this.scheduleFlush();
+    }
+    return event;
+  }
+
+  /**
+   * Send buffered events. Events stay buffered until the server has
+   * accepted them; the server drops ids it has already stored, so a
+   * retry after a lost response is safe.
+   */
+  flush(keepalive = false): Promise<void> {
+    if (this.flushing) return this.flushing;
+    if (!this.buffer.length) return Promise.resolve();
+
+    const batch = this.buffer.slice(0, MAX_BATCH);
+    this.flushing = (async () => {
+      try {
+        const response = await fetch(`${this.AUTH_BASE_URL}/feedback/batch`, {
+          method: 'POST',
+          headers: this.getAuthHeaders(),
+          body: JSON.stringify({ events: batch }),
+          keepalive
+        });
+
+        if (!response.ok) {
+          throw new Error(`Failed to flush feedback: ${response.status}`);
+        }
+
+        const result: FeedbackBatchResult = await response.json();
+        if (result.rejected.length) {
+          console.warn('Feedback events rejected:', result.rejected);
+        }
+
+        const sent = new Set(batch.map(e => e.id));
+        this.buffer = this.buffer.filter(e => !sent.has(e.id));
+        this.saveBuffer();
+        this.flushListeners.forEach(listener => listener());
+      } catch (error) {
+        console.error('Error flushing feedback:', error);
+      } finally {
+        this.flushing = null;
+        if (this.buffer.length) this.scheduleFlush();
+      }
+    })();
+    return this.flushing;
+  }
 
   private getAuthHeaders(): HeadersInit {
     const tokensStr = localStorage.getItem('threatalytics_tokens');
@@ -1,11 +1,26 @@
 import { API_CONFIG } from '@/config/api';
 
-export interface MetricsData {
+export interface ModeMetrics {
+  total: number;
+  helpful: number;
+  not_helpful: number;
+  helpful_rate_percent: number;
+}
+
+export interface MetricsSummary {
   total_feedback: number;
   helpful: number;
   not_helpful: number;
   helpful_rate_percent: number;
+  by_mode?: Record<string, ModeMetrics>;
+}
+
+export interface MetricsData extends MetricsSummary {
   sample_comments: string[];
+  windows?: {
+    '7d': MetricsSummary;
+    '30d': MetricsSummary;
+  };
 }
 
 class MetricsService {
@@ -17,8 +17,22 @@ export interface RoadmapData {
   };
 }
 
+export interface RoadmapStatusUpdate {
+  category: string;
+  index: number;
+  status: 'pending' | 'complete';
+}
+
+export class RoadmapConflictError extends Error {
+  constructor(public version: number) {
+    super('Roadmap was modified by someone else');
+  }
+}
+
 class RoadmapService {
   private AUTH_BASE_URL = API_CONFIG.AUTH_BASE_URL;
+  // Version of the roadmap this client last saw; sent with updates
+  private version: number | null = null;
 
   private getAuthHeaders(): HeadersInit {
     const tokensStr = localStorage.getItem('threatalytics_tokens');
@@ -55,6 +69,9 @@ class RoadmapService {
         throw new Error(`Failed to fetch roadmap: ${response.status} - ${errorText}`);
       }
 
+      const version = response.headers.get('X-Roadmap-Version');
+      this.version = version !== null ? Number(version) : null;
+
       const data = await response.json();
       return data;
     } catch (error) {
@@ -64,23 +81,35 @@ class RoadmapService {
   }
 
   async updateTaskStatus(category: string, index: number, status: 'pending' | 'complete'): Promise<boolean> {
+    return this.updateTaskStatuses([{ category, index, status }]);
+  }
+
+  async updateTaskStatuses(updates: RoadmapStatusUpdate[]): Promise<boolean> {
     try {
       const response = await fetch(`${this.AUTH_BASE_URL}/admin/roadmap/update`, {
         method: 'POST',
         headers: this.getAuthHeaders(),
         body: JSON.stringify({
-          category,
-          index,
-          status
+          updates,
+          ...(this.version !== null ? { version: this.version } : {})
         })
       });
 
+      if (response.status === 409) {
+        const conflict = await response.json();
+        this.version = conflict.version;
+        throw new RoadmapConflictError(conflict.version);
+      }
+
       if (!response.ok) {
         const errorText = await response.text();
         throw new Error(`Failed to update status: ${response.status} - ${errorText}`);
       }
 
       const data = await response.json();
+      if (typeof data.version === 'number') {
+        this.version = data.version;
+      }
       return data.ok === true;
     } catch (error) {
       console.error('Error updating task status:', error);
@@ -1,6 +1,6 @@
 import { useState, useEffect, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
-import { roadmapService, RoadmapData, RoadmapTask } from "@/lib/roadmap-service";
+import { roadmapService, RoadmapData, RoadmapTask, RoadmapConflictError } from "@/lib/roadmap-service";
 import { Card, CardContent } from "@/components/ui/card";
 import { Checkbox } from "@/components/ui/checkbox";
 import { Button } from "@/components/ui/button";
@@ -83,11 +83,19 @@ const AdminLaunchDashboard = () => {
       });
     } catch (error) {
       console.error('Failed to update status:', error);
+
+      // Another admin changed the roadmap; show their version before retrying
+      const conflict = error instanceof RoadmapConflictError;
+      if (conflict) {
+        loadRoadmap();
+      }
       
       // Error notification
       Swal.fire({
         title: 'Error',
-        text: 'Failed to update task status. Please try again.',
+        text: conflict
+          ? 'The roadmap was updated by someone else. It has been refreshed; please try again.'
+          : 'Failed to update task status. Please try again.',
         icon: 'error',
         confirmButtonColor: '#f97316',
         background: '#1a1a1a',
@@ -43,6 +43,8 @@ const ClientAssistant = () => {
     }
   };
 
+  useEffect(() => feedbackService.onFlush(() => loadMetrics()), []);
+
   useEffect(() => {
     loadMetrics();
   }, []);
@@ -161,13 +163,14 @@ const ClientAssistant = () => {
 
   const sendFeedback = async () => {
     try {
-      await feedbackService.submitFeedback({
+      // Buffered and sent in batches; metrics refresh after the flush
+      feedbackService.queueFeedback({
         question,
         helpful,
-        comments
+        comments,
+        mode
       });
       setFeedbackSent(true);
-      loadMetrics();
       
       // Success notification
       Swal.fire({
@@ -1,6 +1,6 @@
 import { useState, useEffect, useCallback } from "react";
 import { useNavigate } from "react-router-dom";
-import { conversationsService, Conversation } from "@/lib/conversations-service";
+import { conversationsService, Conversation, ConversationSummary } from "@/lib/conversations-service";
 import { Button } from "@/components/ui/button";
 import { Trash2, MessageSquare, ArrowLeft } from "lucide-react";
 import { cn } from "@/lib/utils";
@@ -8,15 +8,18 @@ import Swal from 'sweetalert2';
 
 const History = () => {
   const navigate = useNavigate();
-  const [conversations, setConversations] = useState<Conversation[]>([]);
+  const [conversations, setConversations] = useState<ConversationSummary[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
   const [selectedConversation, setSelectedConversation] = useState<Conversation | null>(null);
 
   const loadConversations = useCallback(async () => {
     try {
       setIsLoading(true);
-      const data = await conversationsService.listConversations();
-      setConversations(data);
+      const page = await conversationsService.listConversationSummaries();
+      setConversations(page.conversations);
+      setNextCursor(page.next_cursor);
     } catch (error) {
       console.error('Failed to load conversations:', error);
       
@@ -47,6 +50,30 @@ const History = () => {
     loadConversations();
   }, [loadConversations]);
 
+  const loadMore = async () => {
+    if (!nextCursor) return;
+    try {
+      setIsLoadingMore(true);
+      const page = await conversationsService.listConversationSummaries(nextCursor);
+      setConversations(prev => [...prev, ...page.conversations]);
+      setNextCursor(page.next_cursor);
+    } catch (error) {
+      console.error('Failed to load more conversations:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
+  // Messages are only fetched for the conversation the user opens
+  const handleSelect = async (conversationId: string) => {
+    try {
+      const conversation = await conversationsService.getConversation(conversationId);
+      setSelectedConversation(conversation);
+    } catch (error) {
+      console.error('Failed to load conversation:', error);
+    }
+  };
+
   const handleDelete = async (conversationId: string, e: React.MouseEvent) => {
     e.stopPropagation();
     
@@ -180,7 +207,7 @@ const History = () => {
               {conversations.map((conversation) => (
                 <div
                   key={conversation.conversation_id}
-                  onClick={() => setSelectedConversation(conversation)}
+                  onClick={() => handleSelect(conversation.conversation_id)}
                   className={cn(
                     "p-4 rounded-lg cursor-pointer transition-all group",
                     "hover:bg-muted",
@@ -201,7 +228,7 @@ const History = () => {
                         {conversation.title}
                       </p>
                       <p className="text-xs text-muted-foreground">
-                        {formatDate(conversation.updated_at)} • {conversation.messages.length} messages
+                        {formatDate(conversation.updated_at)} • {conversation.message_count} messages
                       </p>
                     </div>
                     <Button
@@ -215,6 +242,16 @@ const History = () => {
                   </div>
                 </div>
               ))}
+              {nextCursor && (
+                <Button
+                  variant="ghost"
+                  className="w-full"
+                  disabled={isLoadingMore}
+                  onClick={loadMore}
+                >
+                  {isLoadingMore ? 'Loading...' : 'Load more'}
+                </Button>
+              )}
             </div>
           )}
         </div>
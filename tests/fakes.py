@@ -0,0 +1,90 @@
+"""boto3 stand-ins shared by the Lambda tests; module-specific queries and conditions stay in each test file"""
+from types import SimpleNamespace
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+class TransactionCanceledException(Exception):
+    def __init__(self, reasons):
+        self.response = {'CancellationReasons': reasons}
+
+def plain(attribute):
+    """Value of a low-level {'S': ...} or {'N': ...} attribute"""
+    return int(attribute['N']) if 'N' in attribute else attribute['S']
+
+def client_meta(client=None):
+    """A `meta` whose client exposes the exception classes the code catches"""
+    client = client if client is not None else SimpleNamespace()
+    client.exceptions = SimpleNamespace(
+        ConditionalCheckFailedException=ConditionalCheckFailedException,
+        TransactionCanceledException=TransactionCanceledException
+    )
+    return SimpleNamespace(client=client)
+
+class FakeBatch:
+    """batch_writer(); requests go straight to the table"""
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def put_item(self, Item):
+        self.table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self.table.delete_item(Key=Key)
+
+class FakeTable:
+    """Items keyed by `key_names`; a one-attribute key is stored bare, not as a tuple"""
+    def __init__(self, *key_names, items=None):
+        self.key_names = key_names or ('user_id',)
+        self.items = {} if items is None else items
+        self.reads = self.writes = 0
+        self.meta = client_meta()
+
+    def key(self, item):
+        key = tuple(item[name] for name in self.key_names)
+        return key[0] if len(key) == 1 else key
+
+    def get_item(self, Key, **kwargs):
+        self.reads += 1
+        item = self.items.get(self.key(Key))
+        return {'Item': dict(item)} if item else {}
+
+    def put_item(self, Item, **kwargs):
+        self.writes += 1
+        self.items[self.key(Item)] = dict(Item)
+
+    def delete_item(self, Key, **kwargs):
+        self.items.pop(self.key(Key), None)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatch(self)
+
+class FakeVersions:
+    """ThreatalyticsVersions as lambda_functions.etags bumps and reads it"""
+    def __init__(self):
+        self.versions = {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        versions = self.versions.setdefault(Key['user_id'], {})
+        for name in ExpressionAttributeNames.values():
+            versions[name] = versions.get(name, 0) + 1
+
+    def get_item(self, Key, ProjectionExpression, ExpressionAttributeNames):
+        name = ExpressionAttributeNames['#r']
+        versions = self.versions.get(Key['user_id'], {})
+        return {'Item': {name: versions[name]}} if name in versions else {}
+
+class FakeDynamoDB:
+    """The boto3 resource: Table(name) from `tables`, plus meta.client"""
+    def __init__(self, tables=None, client=None):
+        self.tables = {} if tables is None else tables
+        self.meta = client_meta(client)
+
+    def Table(self, name):
+        return self.tables[name]
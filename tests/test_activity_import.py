@@ -0,0 +1,105 @@
+import io
+import json
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+from lambda_functions import search_index
+from lambda_functions.activity_import import import_activities, iter_rows, normalize_timestamp, BatchWriter
+
+class FakeDynamoDB:
+    """Records BatchWriteItem calls; optionally leaves items unprocessed the first time"""
+    def __init__(self, unprocessed_first=0):
+        self.items = {}
+        self.calls = []
+        self.unprocessed_first = unprocessed_first
+        self.lock = threading.Lock()
+
+    def batch_write_item(self, RequestItems):
+        name, requests = next(iter(RequestItems.items()))
+        with self.lock:
+            self.calls.append(len(requests))
+            keys = [r['PutRequest']['Item']['activity_id'] for r in requests]
+            assert len(keys) == len(set(keys)), 'duplicate keys in one batch'
+            skipped = requests[:self.unprocessed_first]
+            self.unprocessed_first = 0
+            for r in requests[len(skipped):]:
+                item = r['PutRequest']['Item']
+                self.items[item['activity_id']] = item
+        return {'UnprocessedItems': {name: skipped} if skipped else {}}
+
+def run_import(dynamodb, text, fmt, on_written=None):
+    writer = BatchWriter(dynamodb, 'ThreatalyticsActivityLog', sleep=lambda s: None, on_written=on_written)
+    return import_activities(dynamodb, 'ThreatalyticsActivityLog', 'user-1', io.StringIO(text), fmt, writer=writer)
+
+class TestActivityImport(unittest.TestCase):
+    def test_csv_import_chunks_and_reports_errors(self):
+        lines = ['client_id,timestamp,note,trs_score']
+        lines += [f'c{i % 3},2025-01-{i % 28 + 1:02d}T10:00:00,note {i},{i}' for i in range(60)]
+        lines += ['c1,not-a-date,bad,1', ',2025-01-01,missing client,1']
+        dynamodb = FakeDynamoDB()
+
+        report = run_import(dynamodb, '\n'.join(lines), 'csv')
+
+        self.assertEqual(report['rows'], 62)
+        self.assertEqual(report['imported'], 60)
+        self.assertEqual(report['failed'], 2)
+        self.assertEqual([e['row'] for e in report['errors']], [62, 63])
+        self.assertTrue(all(n <= 25 for n in dynamodb.calls))
+        item = next(iter(dynamodb.items.values()))
+        self.assertEqual(item['user_client'], f"user-1#{item['client_id']}")
+
+    def test_timestamps_are_stored_as_naive_utc(self):
+        self.assertEqual(normalize_timestamp('2025-02-01T00:00:00Z'), '2025-02-01T00:00:00')
+        self.assertEqual(normalize_timestamp('2025-02-01T02:30:00+02:00'), '2025-02-01T00:30:00')
+        self.assertEqual(normalize_timestamp('2025-02-01'), '2025-02-01T00:00:00')
+
+    def test_ndjson_rows(self):
+        text = '\n'.join([
+            json.dumps({'client_id': 'c1', 'timestamp': '2025-02-01T00:00:00Z', 'activity_id': 'a1'}),
+            '',
+            '{broken',
+            '[1, 2]'
+        ])
+        rows = list(iter_rows(io.StringIO(text), 'ndjson'))
+        self.assertEqual([r[0] for r in rows], [1, 3, 4])
+        self.assertIsNone(rows[0][2])
+        self.assertIsNotNone(rows[1][2])
+
+        report = run_import(FakeDynamoDB(), text, 'ndjson')
+        self.assertEqual((report['imported'], report['failed']), (1, 2))
+
+    def test_unprocessed_items_are_retried(self):
+        lines = ['client_id,timestamp'] + [f'c1,2025-03-01T00:00:{i:02d}' for i in range(30)]
+        dynamodb = FakeDynamoDB(unprocessed_first=10)
+
+        report = run_import(dynamodb, '\n'.join(lines), 'csv')
+
+        self.assertEqual(report['imported'], 30)
+        self.assertEqual(len(dynamodb.items), 30)
+        self.assertEqual(len(dynamodb.calls), 3)
+
+    def test_written_chunks_are_queued_for_search(self):
+        lines = ['activity_id,client_id,timestamp,note'] + [f'a{i},c1,2025-03-01,note {i}' for i in range(30)]
+        sent = []
+        sqs = SimpleNamespace(send_message_batch=lambda QueueUrl, Entries: sent.append(Entries) or {})
+        on_written = lambda ids: search_index.queue_reindex_batch(sqs, 'user-1', 'activity', ids)
+
+        with mock.patch.object(search_index, 'SEARCH_INDEX_QUEUE_URL', 'https://sqs/search.fifo'):
+            report = run_import(FakeDynamoDB(unprocessed_first=10), '\n'.join(lines), 'csv', on_written)
+
+        self.assertEqual(report['imported'], 30)
+        self.assertTrue(all(len(entries) <= 10 for entries in sent))
+        queued = [json.loads(e['MessageBody']) for entries in sent for e in entries]
+        self.assertEqual(sorted(m['doc_id'] for m in queued), sorted(f'a{i}' for i in range(30)))
+        self.assertEqual({(m['user_id'], m['doc_type']) for m in queued}, {('user-1', 'activity')})
+
+    def test_duplicate_ids_split_batches(self):
+        lines = ['activity_id,client_id,timestamp', 'a1,c1,2025-01-01', 'a1,c1,2025-01-02']
+        dynamodb = FakeDynamoDB()
+        report = run_import(dynamodb, '\n'.join(lines), 'csv')
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual(dynamodb.calls, [1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import os
+import unittest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions.activity_log import query_activities, CLIENT_INDEX, TIMESTAMP_INDEX
+
+class FakeActivityTable:
+    """Returns one item per page and records the index each query used"""
+    def __init__(self):
+        self.queries = []
+
+    def query(self, IndexName, ExclusiveStartKey=None, **kwargs):
+        self.queries.append((IndexName, ExclusiveStartKey))
+        key = {'user_id': 'u1', 'activity_id': 'a1', 'timestamp': '2026-10-01T00:00:00'}
+        if IndexName == CLIENT_INDEX:
+            key['user_client'] = 'u1#c1'
+        return {'Items': [dict(key)], 'LastEvaluatedKey': key}
+
+class TestActivityCursors(unittest.TestCase):
+    def test_cursor_only_resumes_the_query_it_came_from(self):
+        table = FakeActivityTable()
+        first = query_activities(table, 'u1', limit=1)
+        query_activities(table, 'u1', limit=1, cursor=first['next_cursor'])
+        self.assertEqual(table.queries[1][0], TIMESTAMP_INDEX)
+        self.assertEqual(table.queries[1][1]['activity_id'], 'a1')
+
+        for kwargs in ({'client_id': 'c1'}, {'date_from': '2026-01-01'}):
+            with self.assertRaises(ValueError):
+                query_activities(table, 'u1', limit=1, cursor=first['next_cursor'], **kwargs)
+        with self.assertRaises(ValueError):
+            query_activities(table, 'u2', limit=1, cursor=first['next_cursor'])
+        with self.assertRaises(ValueError):
+            query_activities(table, 'u1', limit=1, cursor='bm90IGEgY3Vyc29y')
+
+        by_client = query_activities(table, 'u1', client_id='c1', limit=1)
+        with self.assertRaises(ValueError):
+            query_activities(table, 'u1', limit=1, cursor=by_client['next_cursor'])
+        self.assertEqual(len(table.queries), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from datetime import datetime
+from lambda_functions.admin_listings import list_users, list_subscriptions, InvalidCursor
+from lambda_functions.user_index import index_attributes
+
+class FakeTable:
+    """Pages through index queries the way DynamoDB does: sorted, Limit, LastEvaluatedKey"""
+    def __init__(self, items, key_names):
+        self.items = items
+        self.key_names = key_names
+
+    def _page(self, items, Limit, ExclusiveStartKey=None):
+        keys = [{k: item[k] for k in self.key_names} for item in items]
+        start = keys.index(ExclusiveStartKey) + 1 if ExclusiveStartKey else 0
+        page = items[start:start + Limit]
+        response = {'Items': page}
+        if start + Limit < len(items):
+            response['LastEvaluatedKey'] = keys[start + Limit - 1]
+        return response
+
+    def query(self, IndexName, ExpressionAttributeValues, Limit, ScanIndexForward=True,
+              ExclusiveStartKey=None, FilterExpression=None, **kwargs):
+        values = ExpressionAttributeValues
+        if IndexName == 'signup-month-index':
+            hash_name, hash_value = 'signup_month', values[':month']
+        elif IndexName == 'status-index':
+            hash_name, hash_value = 'status', values[':status']
+        else:
+            hash_name, hash_value = 'plan', values[':plan']
+        items = sorted((i for i in self.items if i.get(hash_name) == hash_value),
+                       key=lambda i: i['created_at'], reverse=not ScanIndexForward)
+        response = self._page(items, Limit, ExclusiveStartKey)
+        if FilterExpression:
+            response['Items'] = [i for i in response['Items'] if i.get('plan') == values[':plan']]
+        return response
+
+def user(n, created_at, plan='free'):
+    return {'user_id': f'u{n}', 'email': f'u{n}@example.com', 'plan': plan, 'created_at': created_at,
+            **index_attributes(f'u{n}@example.com', created_at)}
+
+class AdminListingsTests(unittest.TestCase):
+    def test_users_page_newest_first_across_months(self):
+        table = FakeTable([
+            user(1, '2026-10-03T00:00:00'), user(2, '2026-10-01T00:00:00'),
+            user(3, '2026-08-20T00:00:00', 'pro'), user(4, '2026-08-10T00:00:00'),
+            user(5, '2025-06-01T00:00:00', 'pro'),
+        ], ['user_id', 'signup_month', 'created_at'])
+        now = datetime(2026, 10, 18)
+
+        seen, cursor = [], None
+        while True:
+            page = list_users(table, limit=2, cursor=cursor, now=now)
+            seen.extend(u['user_id'] for u in page['users'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['u1', 'u2', 'u3', 'u4', 'u5'])
+
+        pro = list_users(table, limit=5, plan='pro')
+        self.assertEqual([u['user_id'] for u in pro['users']], ['u3', 'u5'])
+        self.assertIsNone(pro['next_cursor'])
+
+    def test_subscription_cursor_is_bound_to_its_filters(self):
+        table = FakeTable([
+            {'user_id': f'u{n}', 'subscription_id': f's{n}', 'status': status, 'plan': plan,
+             'created_at': f'2026-10-0{n}T00:00:00'}
+            for n, status, plan in [(1, 'active', 'pro'), (2, 'active', 'enterprise'),
+                                    (3, 'cancelled', 'pro'), (4, 'active', 'pro')]
+        ], ['user_id', 'subscription_id', 'status', 'created_at'])
+
+        first = list_subscriptions(table, limit=2, status='active')
+        self.assertEqual([s['subscription_id'] for s in first['subscriptions']], ['s4', 's2'])
+        rest = list_subscriptions(table, limit=2, status='active', cursor=first['next_cursor'])
+        self.assertEqual([s['subscription_id'] for s in rest['subscriptions']], ['s1'])
+        self.assertIsNone(rest['next_cursor'])
+
+        both = list_subscriptions(table, limit=5, status='active', plan='pro')
+        self.assertEqual([s['subscription_id'] for s in both['subscriptions']], ['s4', 's1'])
+        with self.assertRaises(InvalidCursor):
+            list_subscriptions(table, limit=2, status='cancelled', cursor=first['next_cursor'])
+        with self.assertRaises(InvalidCursor):
+            list_subscriptions(table, limit=2, cursor='not-a-cursor')
+
+    def test_unfiltered_subscriptions_are_newest_first_across_statuses(self):
+        rows = [(1, 'active'), (2, 'cancelled'), (3, 'active'), (4, 'payment_failed'), (5, 'cancelled'),
+                (6, 'active'), (7, 'paused')]
+        table = FakeTable([
+            {'user_id': f'u{n}', 'subscription_id': f's{n}', 'status': status, 'plan': 'pro',
+             'created_at': f'2026-10-0{n}T00:00:00'}
+            for n, status in rows
+        ], ['user_id', 'subscription_id', 'status', 'created_at'])
+
+        seen, cursor = [], None
+        while True:
+            page = list_subscriptions(table, limit=3, cursor=cursor)
+            seen.extend(s['subscription_id'] for s in page['subscriptions'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(seen, ['s7', 's6', 's5', 's4', 's3', 's2', 's1'])
+
+if __name__ == '__main__':
+    unittest.main()
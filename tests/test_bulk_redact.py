@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+import zipfile
+from lambda_functions.bulk_redact import run_job, open_store, within, MANIFEST_KEY
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+class TestBulkRedact(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.input = os.path.join(self.dir.name, 'in')
+        self.output = os.path.join(self.dir.name, 'out')
+        write(os.path.join(self.input, 'a.txt'), b'Sarah Okafor called 555-123-4567. Okafor left.')
+        write(os.path.join(self.input, 'cases/b.md'), b'Email james@example.org about it.')
+        docx = io.BytesIO()
+        with zipfile.ZipFile(docx, 'w') as z:
+            z.writestr('word/document.xml', '<w:body><w:p><w:r><w:t>Mr. Brooks met Jane.</w:t></w:r></w:p></w:body>')
+        write(os.path.join(self.input, 'c.docx'), docx.getvalue())
+        write(os.path.join(self.input, 'd.png'), b'\x89PNG')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read_output(self, key):
+        with open(os.path.join(self.output, key), encoding='utf-8') as f:
+            return f.read()
+
+    def test_redacts_files_and_writes_manifest(self):
+        manifest = run_job(open_store(self.input), open_store(self.output), workers=2, checkpoint_every=1)
+
+        self.assertEqual(self.read_output('a.txt'), '[PERSON_1] called [PHONE_1]. [PERSON_1] left.')
+        self.assertEqual(self.read_output('cases/b.md'), 'Email [EMAIL_1] about it.')
+        self.assertEqual(self.read_output('c.docx.txt'), 'Mr. [PERSON_1] met [PERSON_2].')
+        self.assertEqual(manifest['totals']['ok'], 3)
+        self.assertEqual(manifest['totals']['skipped'], 1)
+        entry = next(e for e in manifest['files'] if e['key'] == 'a.txt')
+        self.assertEqual(entry['entities'], {'PERSON': 1, 'PHONE': 1})
+        self.assertIn('redact_ms', entry)
+        with open(os.path.join(self.output, MANIFEST_KEY)) as f:
+            self.assertTrue(json.load(f)['complete'])
+
+    def test_resume_skips_finished_files(self):
+        run_job(open_store(self.input), open_store(self.output), workers=2)
+        write(os.path.join(self.input, 'e.txt'), b'Call Liam at 555-987-6543.')
+
+        manifest = run_job(open_store(self.input), open_store(self.output), workers=2)
+
+        self.assertEqual(manifest['runs'], 2)
+        self.assertEqual(manifest['last_run']['skipped_as_done'], 3)
+        # The unsupported file is retried along with the new one
+        self.assertEqual(manifest['last_run']['processed'], 2)
+        self.assertEqual(self.read_output('e.txt'), 'Call [PERSON_1] at [PHONE_1].')
+
+    def test_output_inside_input_is_not_reprocessed(self):
+        output = os.path.join(self.input, 'redacted')
+        run_job(open_store(self.input), open_store(output), workers=2)
+        manifest = run_job(open_store(self.input), open_store(output), workers=2)
+        self.assertFalse(any(e['key'].startswith('redacted/') for e in manifest['files']))
+
+    def test_exclusion_compares_whole_path_components(self):
+        # An input folder that only shares a name prefix with the output is still read
+        write(os.path.join(self.input, 'redacted-notes/f.txt'), b'Call 555-987-6543.')
+        manifest = run_job(open_store(self.input), open_store(os.path.join(self.input, 'redacted')), workers=2)
+        self.assertIn('redacted-notes/f.txt', [e['key'] for e in manifest['files']])
+
+        self.assertFalse(within('s3://bucket/in-redacted/a.txt', 's3://bucket/in/'))
+        self.assertTrue(within('s3://bucket/in/out/', 's3://bucket/in/'))
+        self.assertFalse(within(self.input + '-redacted', self.input))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import base64
+import gzip
+import json
+import os
+import random
+import re
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions import conversations
+from lambda_functions.conversations import (
+    encode_messages, decode_messages, append_messages, get_messages_since,
+    COMPRESS_THRESHOLD, OFFLOAD_THRESHOLD
+)
+from tests.fakes import ConditionalCheckFailedException, FakeDynamoDB
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        body = self.objects[(Bucket, Key)]
+        return {'Body': SimpleNamespace(read=lambda: body)}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+class FakeConversationsTable:
+    """Applies append_messages' conditional update and get_messages_since's projection"""
+    def __init__(self):
+        self.items = {}
+
+    def update_item(self, Key, ConditionExpression, ExpressionAttributeValues, **kwargs):
+        values = ExpressionAttributeValues
+        key = (Key['user_id'], Key['conversation_id'])
+        item = self.items.get(key)
+        if item is None:
+            if not ConditionExpression.startswith('attribute_not_exists(message_count)'):
+                raise ConditionalCheckFailedException()
+            item = {**Key, 'messages': [], 'message_count': 0, 'created_at': values[':now']}
+        elif item['message_count'] != values[':base']:
+            raise ConditionalCheckFailedException()
+        item['messages'] = item['messages'] + values[':new']
+        item['message_count'] += values[':n']
+        item['updated_at'] = values[':now']
+        self.items[key] = item
+        return {'Attributes': {'message_count': item['message_count']}}
+
+    def get_item(self, Key, ProjectionExpression, ExpressionAttributeNames):
+        item = self.items.get((Key['user_id'], Key['conversation_id']))
+        if item is None:
+            return {}
+        indexes = [int(i) for i in re.findall(r'#m\[(\d+)\]', ProjectionExpression)]
+        messages = [item['messages'][i] for i in indexes if i < len(item['messages'])]
+        projected = {'message_count': item['message_count']}
+        if messages:
+            projected['messages'] = messages
+        return {'Item': projected}
+
+def noise(size, seed=1):
+    """Text that gzip cannot shrink much"""
+    return base64.b64encode(random.Random(seed).randbytes(size))[:size].decode()
+
+class TestConversationStorage(unittest.TestCase):
+    def test_round_trip_through_every_storage_form(self):
+        s3 = FakeS3()
+        messages = [
+            {'role': 'user', 'content': 'short question'},
+            {'role': 'assistant', 'content': 'long answer ' * 200},
+            {'role': 'assistant', 'content': noise(120000)},
+            {'role': 'system', 'content': None}
+        ]
+        stored, raw_bytes, stored_bytes = encode_messages(s3, 'u1', 'c1', messages)
+
+        self.assertNotIn('encoding', stored[0])
+        self.assertIn('content_z', stored[1])
+        self.assertIn('content_ref', stored[2])
+        self.assertNotIn('content', stored[2])
+        self.assertEqual(len(s3.objects), 1)
+        self.assertLess(stored_bytes, raw_bytes)
+        self.assertEqual(decode_messages(s3, stored), messages)
+
+    def test_compress_and_offload_boundaries(self):
+        s3 = FakeS3()
+        at, over = 'a' * COMPRESS_THRESHOLD, 'a' * (COMPRESS_THRESHOLD + 1)
+        stored, _, _ = encode_messages(s3, 'u1', 'c1', [{'content': at}, {'content': over}])
+        self.assertEqual(stored[0], {'content': at})
+        self.assertEqual(stored[1]['encoding'], 'gzip')
+
+        text = noise(OFFLOAD_THRESHOLD)
+        compressed_size = len(gzip.compress(text.encode('utf-8')))
+        with mock.patch.object(conversations, 'OFFLOAD_THRESHOLD', compressed_size):
+            inline, _, _ = encode_messages(s3, 'u1', 'c1', [{'content': text}])
+        with mock.patch.object(conversations, 'OFFLOAD_THRESHOLD', compressed_size - 1):
+            offloaded, _, _ = encode_messages(s3, 'u1', 'c1', [{'content': text}], start_index=7, write_id='w1')
+        self.assertIn('content_z', inline[0])
+        self.assertEqual(offloaded[0]['content_ref']['key'], 'conversations/u1/c1/7-w1.gz')
+        self.assertEqual(decode_messages(s3, offloaded)[0]['content'], text)
+
+class TestDeltaSync(unittest.TestCase):
+    def setUp(self):
+        self.table, self.s3 = FakeConversationsTable(), FakeS3()
+        self.dynamodb = FakeDynamoDB()
+        for patch in (mock.patch.object(conversations, 'bump_version'),
+                      mock.patch.object(conversations, 'update_search_index'),
+                      mock.patch.object(conversations, 'log_storage_metrics')):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def append(self, base_version, messages):
+        response = append_messages(self.dynamodb, self.table, self.s3, 'u1', 'c1',
+                                   {'base_version': base_version, 'messages': messages})
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_appends_advance_the_version_and_since_reads_only_the_tail(self):
+        self.assertEqual(self.append(0, [{'role': 'user', 'content': 'hi'}])[1]['version'], 1)
+        self.assertEqual(self.append(1, [{'role': 'assistant', 'content': 'hello'},
+                                         {'role': 'user', 'content': 'more'}])[1]['version'], 3)
+
+        tail = get_messages_since(self.table, self.s3, 'u1', 'c1', 1)
+        self.assertEqual([m['content'] for m in tail['messages']], ['hello', 'more'])
+        self.assertEqual((tail['version'], tail['has_more']), (3, False))
+        self.assertEqual(get_messages_since(self.table, self.s3, 'u1', 'c1', 3)['messages'], [])
+        self.assertIsNone(get_messages_since(self.table, self.s3, 'u1', 'missing', 0))
+
+    def test_losing_append_gets_409_and_leaves_no_objects(self):
+        self.append(0, [{'role': 'user', 'content': 'hi'}])
+        self.append(1, [{'role': 'assistant', 'content': 'winner'}])
+
+        status, body = self.append(1, [{'role': 'assistant', 'content': noise(OFFLOAD_THRESHOLD * 2)}])
+        self.assertEqual(status, 409)
+        self.assertEqual(body['version'], 2)
+        self.assertEqual([m['content'] for m in body['messages']], ['winner'])
+        self.assertEqual(self.s3.objects, {})
+        self.assertEqual(self.table.items[('u1', 'c1')]['message_count'], 2)
+
+        self.assertEqual(self.append(-1, [])[0], 400)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions import customer_provisioning, stripe_customers
+from lambda_functions.customer_provisioning import provision_customer, worker_handler, backfill
+from tests import fakes
+from tests.fakes import ConditionalCheckFailedException
+
+class FakeUsers:
+    def __init__(self, db):
+        self.db = db
+
+    def get_item(self, Key):
+        item = self.db.users.get(Key['user_id'])
+        return {'Item': dict(item)} if item else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression, ExpressionAttributeValues):
+        with self.db.lock:
+            user = self.db.users[Key['user_id']]
+            if 'stripe_customer_id' in user:
+                raise ConditionalCheckFailedException()
+            user['stripe_customer_id'] = ExpressionAttributeValues[':cid']
+
+    def put_item(self, Item):
+        self.db.customers[Item['customer_id']] = Item['user_id']
+
+    def scan(self, FilterExpression, Segment, TotalSegments, **kwargs):
+        users = sorted(self.db.users.values(), key=lambda u: u['user_id'])
+        return {'Items': [{'user_id': u['user_id'], 'email': u['email']}
+                          for i, u in enumerate(users) if i % TotalSegments == Segment
+                          and 'stripe_customer_id' not in u and 'email' in u]}
+
+class FakeDynamoDB(fakes.FakeDynamoDB):
+    def __init__(self, users):
+        super().__init__()
+        self.users = {u['user_id']: u for u in users}
+        self.customers = {}
+        self.lock = threading.Lock()
+
+    def Table(self, name):
+        return FakeUsers(self)
+
+class FakeCustomers:
+    """stripe.Customer.create honouring idempotency keys"""
+    def __init__(self):
+        self.created = {}
+
+    def create(self, idempotency_key, **kwargs):
+        if idempotency_key not in self.created:
+            self.created[idempotency_key] = SimpleNamespace(id=f'cus_{len(self.created) + 1}', **kwargs)
+        return self.created[idempotency_key]
+
+class TestCustomerProvisioning(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDynamoDB([
+            {'user_id': 'u1', 'email': 'a@example.com'},
+            {'user_id': 'u2', 'email': 'b@example.com', 'stripe_customer_id': 'cus_existing'},
+            {'user_id': 'u3', 'email': 'c@example.com'},
+            {'user_id': 'u4'}
+        ])
+        self.customers = FakeCustomers()
+        for patch in (mock.patch.object(customer_provisioning, 'dynamodb', self.db),
+                      mock.patch.object(customer_provisioning.stripe, 'Customer', self.customers),
+                      mock.patch.object(customer_provisioning.stripe, 'api_key', 'sk_test'),
+                      mock.patch.dict(stripe_customers._users, clear=True)):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_customer_is_stored_once(self):
+        self.assertEqual(provision_customer('u1'), 'cus_1')
+        self.assertEqual(self.db.users['u1']['stripe_customer_id'], 'cus_1')
+        self.assertEqual(self.db.customers, {'cus_1': 'u1'})
+        self.assertEqual(self.customers.created['customer-u1'].metadata, {'user_id': 'u1'})
+        # Already provisioned: no Stripe call
+        self.assertEqual(provision_customer('u2'), 'cus_existing')
+        self.assertEqual(len(self.customers.created), 1)
+
+    def test_losing_the_conditional_store_keeps_the_same_customer(self):
+        # Another caller stored the id between our read and our write
+        original = FakeUsers.get_item
+        def stale_read(table, Key):
+            item = original(table, Key)
+            self.db.users['u1']['stripe_customer_id'] = 'cus_1'
+            item['Item'].pop('stripe_customer_id', None)
+            return item
+        with mock.patch.object(FakeUsers, 'get_item', stale_read):
+            self.customers.create(idempotency_key='customer-u1')
+            self.assertEqual(provision_customer('u1'), 'cus_1')
+        self.assertEqual(self.db.users['u1']['stripe_customer_id'], 'cus_1')
+        self.assertEqual(len(self.customers.created), 1)
+
+    def test_worker_drops_deleted_users_and_fails_only_bad_messages(self):
+        records = [
+            {'messageId': 'm1', 'body': json.dumps({'user_id': 'gone', 'email': 'x@example.com'})},
+            {'messageId': 'm2', 'body': json.dumps({'user_id': 'u4'})},
+            {'messageId': 'm3', 'body': json.dumps({'user_id': 'u3', 'email': 'c@example.com'})}
+        ]
+        self.assertEqual(worker_handler({'Records': records}, None), {'batchItemFailures': [{'itemIdentifier': 'm2'}]})
+        self.assertEqual(self.db.users['u3']['stripe_customer_id'], 'cus_1')
+        self.assertEqual(len(self.customers.created), 1)
+
+    def test_backfill_provisions_users_without_a_customer(self):
+        self.assertEqual(backfill(segments=2, dry_run=True), (2, 0))
+        self.assertEqual(self.customers.created, {})
+
+        self.assertEqual(backfill(segments=2), (2, 0))
+        self.assertEqual(sorted(self.customers.created), ['customer-u1', 'customer-u3'])
+        self.assertEqual(self.db.users['u2']['stripe_customer_id'], 'cus_existing')
+        self.assertEqual(backfill(segments=2), (0, 0))
+
+if __name__ == '__main__':
+    unittest.main()
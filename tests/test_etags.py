@@ -0,0 +1,43 @@
+import unittest
+from lambda_functions.etags import (
+    bump_version, get_version, make_etag, etag_matches, query_fingerprint, not_modified, VERSIONS_TABLE
+)
+from tests.fakes import FakeDynamoDB, FakeVersions
+
+class TestEtags(unittest.TestCase):
+    def test_etag_changes_with_version_and_query(self):
+        base = make_etag('conversations', 'u1', 3, '/conversations', 'view=summary')
+        self.assertEqual(base, make_etag('conversations', 'u1', 3, '/conversations', 'view=summary'))
+        self.assertNotEqual(base, make_etag('conversations', 'u1', 4, '/conversations', 'view=summary'))
+        self.assertNotEqual(base, make_etag('conversations', 'u1', 3, '/conversations', 'view=full'))
+
+    def test_if_none_match_parsing(self):
+        etag = make_etag('usage', 'u1', 1)
+        self.assertTrue(etag_matches({'headers': {'If-None-Match': etag}}, etag))
+        self.assertTrue(etag_matches({'headers': {'if-none-match': f'"other", W/{etag}'}}, etag))
+        self.assertTrue(etag_matches({'headers': {'If-None-Match': '*'}}, etag))
+        self.assertFalse(etag_matches({'headers': {'If-None-Match': '"other"'}}, etag))
+        self.assertFalse(etag_matches({'headers': None}, etag))
+
+    def test_query_fingerprint_is_order_independent(self):
+        a = query_fingerprint({'queryStringParameters': {'limit': '20', 'view': 'summary'}})
+        b = query_fingerprint({'queryStringParameters': {'view': 'summary', 'limit': '20', 'token': 'x'}})
+        self.assertEqual(a, b)
+
+    def test_versions_bump_and_not_modified(self):
+        dynamodb = FakeDynamoDB({VERSIONS_TABLE: FakeVersions()})
+        self.assertEqual(get_version(dynamodb, 'u1', 'usage'), 0)
+        bump_version(dynamodb, 'u1', 'usage', 'feedback')
+        self.assertEqual(get_version(dynamodb, 'u1', 'usage'), 1)
+
+        response = not_modified({'Access-Control-Allow-Origin': '*'}, '"abc"')
+        self.assertEqual(response['statusCode'], 304)
+        self.assertEqual(response['body'], '')
+        self.assertEqual(response['headers']['ETag'], '"abc"')
+
+    def test_not_modified_keeps_exposed_headers(self):
+        response = not_modified({'Access-Control-Expose-Headers': 'X-Roadmap-Version'}, '"abc"')
+        self.assertEqual(response['headers']['Access-Control-Expose-Headers'], 'ETag,X-Roadmap-Version')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions import feedback
+from lambda_functions.feedback import store_batch
+from tests.fakes import ConditionalCheckFailedException, client_meta
+
+class FakeFeedbackTable:
+    """Evaluates attribute_not_exists on (user_id, timestamp); ids in `failing` raise"""
+    def __init__(self):
+        self.items = {}
+        self.failing = set()
+        self.lock = threading.Lock()
+        self.meta = client_meta()
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeNames):
+        if Item['feedback_id'] in self.failing:
+            raise RuntimeError('ProvisionedThroughputExceededException')
+        key = (Item['user_id'], Item['timestamp'])
+        with self.lock:
+            if key in self.items:
+                raise ConditionalCheckFailedException()
+            self.items[key] = dict(Item)
+
+def event(feedback_id, minutes_ago=10, **fields):
+    timestamp = (datetime.utcnow() - timedelta(minutes=minutes_ago)).isoformat() + 'Z'
+    return {'id': feedback_id, 'timestamp': timestamp, 'question': 'q', 'helpful': True, **fields}
+
+class TestFeedbackBatch(unittest.TestCase):
+    def setUp(self):
+        self.table = FakeFeedbackTable()
+        self.counted = []
+        patches = (mock.patch.object(feedback, 'record_feedback',
+                                     side_effect=lambda dynamodb, user_id, rows: self.counted.extend(rows)),
+                   mock.patch.object(feedback, 'bump_version'))
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def store(self, events):
+        return store_batch(None, self.table, 'u1', events)
+
+    def test_in_batch_duplicates_and_rejected_rows(self):
+        a = event('a')
+        accepted, duplicates, rejected = self.store([
+            a, dict(a), 'not an object', event('b', timestamp='yesterday'),
+            event('c', minutes_ago=-60), {'timestamp': a['timestamp']}, event('d')
+        ])
+        self.assertEqual((accepted, duplicates), (2, 1))
+        self.assertEqual([(r['index'], r['error']) for r in rejected], [
+            (2, 'event must be an object'), (3, 'timestamp must be ISO 8601'),
+            (4, 'timestamp is in the future'), (5, 'id required')
+        ])
+        self.assertEqual(len(self.table.items), 2)
+        self.assertEqual(len(self.counted), 2)
+
+    def test_resent_batch_is_all_duplicates_and_not_counted_again(self):
+        events = [event('a'), event('b')]
+        self.assertEqual(self.store(events), (2, 0, []))
+        self.assertEqual(self.store([dict(e) for e in events]), (0, 2, []))
+        self.assertEqual(len(self.counted), 2)
+
+    def test_write_error_is_raised_after_the_winners_are_counted(self):
+        events = [event('a'), event('b'), event('c')]
+        self.table.failing.add('b')
+        with self.assertRaises(RuntimeError):
+            self.store(events)
+        self.assertEqual(len(self.counted), 2)
+
+        # The client re-sends the whole batch; only the failed event is new
+        self.table.failing.clear()
+        self.assertEqual(self.store(events), (1, 2, []))
+        self.assertEqual(len(self.counted), 3)
+        self.assertEqual(len(self.table.items), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import numpy as np
+from lambda_functions.feedback_clusters import cluster_comments, tfidf_matrix
+
+THEMES = [
+    ('redaction left student names visible', False),
+    ('drill scenario unrealistic for elementary grades', False),
+    ('detailed threat assessment helped the team', True),
+]
+
+def records(n):
+    for i in range(n):
+        text, helpful = THEMES[i % len(THEMES)]
+        yield {'comments': f'{text} case{i % 7}', 'helpful': helpful}
+
+class TestFeedbackClusters(unittest.TestCase):
+    def test_tfidf_rows_are_normalized(self):
+        X, terms = tfidf_matrix([t for t, _ in THEMES] * 5, min_df=2)
+        norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        self.assertTrue(np.allclose(norms, 1.0, atol=1e-5))
+        self.assertIn('redaction', list(terms))
+
+    def test_clusters_recover_themes(self):
+        report = cluster_comments(records(300), k=3, min_df=2)
+        self.assertEqual(report['comments'], 300)
+        self.assertEqual(sorted(c['size'] for c in report['clusters']), [100, 100, 100])
+
+        by_term = {c['top_terms'][0]: c for c in report['clusters']}
+        helpful = [c for c in report['clusters'] if c['helpful_rate_percent'] == 100.0]
+        self.assertEqual(len(helpful), 1)
+        self.assertIn('assessment', helpful[0]['top_terms'])
+        # Unhelpful clusters are listed first
+        self.assertEqual(report['clusters'][-1]['helpful_rate_percent'], 100.0)
+        self.assertTrue(all(len(c['representative_comments']) <= 5 for c in by_term.values()))
+
+    def test_unhelpful_only(self):
+        report = cluster_comments(records(300), k=2, min_df=2, unhelpful_only=True)
+        self.assertEqual(report['comments'], 200)
+
+    def test_empty_and_tiny_inputs(self):
+        empty = cluster_comments([], k=5)
+        self.assertEqual((empty['comments'], empty['k'], empty['clusters']), (0, 0, []))
+
+        # Every term filtered out by min_df leaves no rows either
+        self.assertEqual(cluster_comments([{'comments': 'one off remark'}], k=5)['clusters'], [])
+
+    def test_k_is_capped_at_the_number_of_comments(self):
+        rows = [{'comments': text, 'helpful': helpful} for text, helpful in THEMES] * 2
+        report = cluster_comments(rows, k=50, min_df=1, max_df=1.0)
+        self.assertEqual(report['k'], 6)
+        self.assertEqual(sum(c['size'] for c in report['clusters']), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from datetime import date
+from lambda_functions.feedback_metrics import record_feedback, read_metrics, normalize_mode, GLOBAL_SCOPE
+
+class FakeTable:
+    def __init__(self, items):
+        self.items = items
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        item = self.items.setdefault((Key['scope'], Key['bucket']), dict(Key))
+        for clause in UpdateExpression.replace('ADD ', '').split(', '):
+            name, value = clause.split()
+            attribute = ExpressionAttributeNames[name]
+            item[attribute] = item.get(attribute, 0) + ExpressionAttributeValues[value]
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.items = {}
+
+    def Table(self, name):
+        return FakeTable(self.items)
+
+    def batch_get_item(self, RequestItems):
+        name, request = next(iter(RequestItems.items()))
+        found = [self.items[(k['scope'], k['bucket'])] for k in request['Keys'] if (k['scope'], k['bucket']) in self.items]
+        return {'Responses': {name: found}}
+
+class TestFeedbackMetrics(unittest.TestCase):
+    def test_windows_and_modes(self):
+        dynamodb = FakeDynamoDB()
+        record_feedback(dynamodb, 'u1', [
+            (True, 'policy_audit', '2025-06-30T09:00:00'),
+            (False, 'policy_audit', '2025-06-28T09:00:00'),
+            (True, 'threat_assessment', '2025-06-10T09:00:00'),
+            (True, None, '2025-01-01T09:00:00')
+        ])
+        record_feedback(dynamodb, 'u2', [(False, 'policy_audit', '2025-06-30T10:00:00')])
+
+        metrics = read_metrics(dynamodb, 'u1', today=date(2025, 6, 30))
+        self.assertEqual(metrics['all_time']['total_feedback'], 4)
+        self.assertEqual(metrics['all_time']['helpful'], 3)
+        self.assertEqual(metrics['7d']['total_feedback'], 2)
+        self.assertEqual(metrics['7d']['helpful_rate_percent'], 50.0)
+        self.assertEqual(metrics['30d']['total_feedback'], 3)
+        self.assertEqual(metrics['all_time']['by_mode']['unknown']['total'], 1)
+        self.assertEqual(metrics['30d']['by_mode']['policy_audit']['not_helpful'], 1)
+
+        overall = read_metrics(dynamodb, GLOBAL_SCOPE, today=date(2025, 6, 30))
+        self.assertEqual(overall['all_time']['total_feedback'], 5)
+        self.assertEqual(overall['7d']['by_mode']['policy_audit']['total'], 3)
+
+    def test_mode_normalization(self):
+        self.assertEqual(normalize_mode(' Policy_Audit '), 'policy_audit')
+        self.assertEqual(normalize_mode('a#b'), 'other')
+        self.assertEqual(normalize_mode(''), 'unknown')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import json
+import unittest
+from lambda_functions.image_validator import KeywordPolicy, lambda_handler, APPROVED_KEYWORDS, RESTRICTED_KEYWORDS
+
+class TestKeywordPolicy(unittest.TestCase):
+    def setUp(self):
+        self.policy = KeywordPolicy(APPROVED_KEYWORDS, RESTRICTED_KEYWORDS)
+
+    def test_whole_words_only(self):
+        self.assertEqual(self.policy.check('Threat grid for the withdrawing team'), (None, ['threat grid']))
+        self.assertEqual(self.policy.check('risk  matrix with two logos')[0], 'logo')
+        self.assertEqual(self.policy.check('Risk-Matrices')[1], [])
+        self.assertEqual(self.policy.check('escalation charts, then a threat\ngrid')[1], ['escalation chart', 'threat grid'])
+
+    def test_unicode_separators_and_obfuscation(self):
+        # En dash, curly quotes and a no-break space separate words like ASCII punctuation
+        self.assertEqual(self.policy.check('risk matrix\u2013cartoon')[0], 'cartoon')
+        self.assertEqual(self.policy.check('\u201ccute\u201d threat\u00a0grid')[0], 'cute')
+        # Zero-width characters and full-width letters do not hide a keyword
+        self.assertEqual(self.policy.check('threat grid car\u200btoon')[0], 'cartoon')
+        self.assertEqual(self.policy.check('threat grid \uff4c\uff4f\uff47\uff4f')[0], 'logo')
+        self.assertEqual(self.policy.check('Flow\u00adchart of the caf\u00e9 exits')[1], ['flowchart'])
+
+    def test_batch_endpoint(self):
+        event = {
+            'path': '/image/validate/batch',
+            'body': json.dumps({'descriptions': ['security diagram of the lobby', 'cute mascot', 'a chart', '']})
+        }
+        response = lambda_handler(event, None)
+        body = json.loads(response['body'])
+        self.assertEqual(response['statusCode'], 200)
+        self.assertEqual([r['approved'] for r in body['results']], [True, False, False, False])
+        self.assertEqual(body['results'][1]['restricted_term'], 'cute')
+        self.assertIn('suggestion', body['results'][2])
+        self.assertEqual(body['approved'], 1)
+
+    def test_single_endpoint_shape(self):
+        response = lambda_handler({'path': '/image/validate', 'body': json.dumps({'description': 'playful flowchart'})}, None)
+        self.assertEqual(response['statusCode'], 400)
+        self.assertEqual(json.loads(response['body'])['restricted_term'], 'playful')
+
+if __name__ == '__main__':
+    unittest.main()
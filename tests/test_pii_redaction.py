@@ -0,0 +1,55 @@
+import unittest
+from lambda_functions.pii_redaction import (
+    redact_local, redact_hybrid, redact_chunked, find_entities, chunk_text, sentence_spans, needs_model
+)
+
+SAMPLE = ("Officer Daniel Reyes met Mr. O'Brien at 1420 N Maple Avenue, Apt 3B. "
+          "Reach john.smith@school.org or (555) 123-4567; SSN 123-45-6789, card 4111 1111 1111 1111. "
+          "Will said Grace Hopper logged in from 10.0.0.12. May is busy.")
+
+class TestPiiRedaction(unittest.TestCase):
+    def test_structured_and_gazetteer_names(self):
+        redacted, counts = redact_local(SAMPLE)
+        self.assertEqual(redacted, (
+            "Officer [PERSON] met Mr. [PERSON] at [ADDRESS]. "
+            "Reach [EMAIL] or [PHONE]; SSN [SSN], card [CARD]. "
+            "Will said [PERSON] logged in from [IP_ADDRESS]. May is busy."
+        ))
+        self.assertEqual(counts['PERSON'], 3)
+
+    def test_card_needs_luhn(self):
+        self.assertEqual(redact_local('order 1234 5678 9012 3456')[1], {})
+
+    def test_hybrid_sends_only_residual_sentences(self):
+        text = "Sarah called at 555-123-4567. The student, Kwame Adjei, was absent. Nothing else happened."
+        sent = []
+        def model(segments):
+            sent.extend(segments)
+            return [s.replace('Kwame Adjei', '[PERSON]') for s in segments]
+
+        redacted, counts, segments = redact_hybrid(text, model)
+        self.assertEqual(sent, ['The student, Kwame Adjei, was absent. '])
+        self.assertEqual(segments, 1)
+        self.assertEqual(redacted, "[PERSON] called at [PHONE]. The student, [PERSON], was absent. Nothing else happened.")
+
+    def test_sentences_cover_text(self):
+        text = "Met Dr. Lee today.  Next steps?\n\nNone"
+        spans = sentence_spans(text)
+        self.assertEqual(''.join(text[a:b] for a, b in spans), text)
+        self.assertEqual(len(spans), 3)
+        self.assertFalse(needs_model('The SSN was [SSN] on Monday.'))
+
+    def test_chunked_placeholders_are_consistent(self):
+        text = "Sarah Okafor emailed a@b.org. Later Sarah called Mr. Brooks. Okafor wrote to a@b.org again. " * 20
+        chunks = chunk_text(text, 120)
+        self.assertTrue(all(len(c) <= 120 for c in chunks))
+        self.assertEqual(''.join(chunks), text)
+
+        redacted, counts, n = redact_chunked(text, find_entities, max_chars=120, concurrency=4)
+        self.assertEqual(n, len(chunks))
+        self.assertEqual(counts, {'PERSON': 2, 'EMAIL': 1})
+        self.assertEqual(redacted, "[PERSON_1] emailed [EMAIL_1]. Later [PERSON_1] called Mr. [PERSON_2]. "
+                                   "[PERSON_1] wrote to [EMAIL_1] again. " * 20)
+
+if __name__ == '__main__':
+    unittest.main()
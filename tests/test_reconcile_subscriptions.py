@@ -0,0 +1,143 @@
+import unittest
+from lambda_functions.reconcile_subscriptions import FixtureStripe, reconcile, fetch_all, PLANS_TABLE, USERS_TABLE
+from lambda_functions.stripe_customers import CUSTOMERS_TABLE
+from tests import fakes
+from tests.fakes import ConditionalCheckFailedException
+
+class FakeTable(fakes.FakeTable):
+    KEYS = {PLANS_TABLE: ('user_id', 'subscription_id'), CUSTOMERS_TABLE: ('customer_id',)}
+
+    def __init__(self, db, name):
+        super().__init__(*self.KEYS.get(name, ('user_id',)))
+        self.db, self.name = db, name
+
+    def scan(self, Segment, TotalSegments, **kwargs):
+        keys = sorted(self.items)
+        return {'Items': [dict(self.items[k]) for i, k in enumerate(keys) if i % TotalSegments == Segment]}
+
+    def update_item(self, Key, ConditionExpression=None, ExpressionAttributeValues=None, **kwargs):
+        if self.name == PLANS_TABLE:
+            return self.update_plans_row(Key, ConditionExpression, ExpressionAttributeValues, **kwargs)
+        if self.name != USERS_TABLE:
+            return
+        user = self.items[self.key(Key)]
+        if ':seen' in ExpressionAttributeValues and user.get('plan') != ExpressionAttributeValues[':seen']:
+            raise ConditionalCheckFailedException()
+        user.update({'plan': ExpressionAttributeValues[':plan'], 'subscription_status': ExpressionAttributeValues[':status']})
+        if ':sid' in ExpressionAttributeValues:
+            user['stripe_subscription_id'] = ExpressionAttributeValues[':sid']
+
+    def update_plans_row(self, Key, ConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames,
+                         UpdateExpression):
+        values = ExpressionAttributeValues
+        row = self.items.get(self.key(Key))
+        if ConditionExpression == 'attribute_not_exists(user_id)':
+            if row is not None:
+                raise ConditionalCheckFailedException()
+        elif row is None or any(row.get(field) != values.get(f':seen_{field}') for field in ExpressionAttributeNames.values()):
+            raise ConditionalCheckFailedException()
+        self.db.writes += 1
+        row = self.items.setdefault(self.key(Key), dict(Key))
+        row.update({k[5:]: v for k, v in values.items() if k.startswith(':set_')})
+        row.update({'updated_at': values[':now'], 'reconciled_at': values[':now']})
+        row.setdefault('created_at', values[':now'])
+        row.setdefault('api_key', values[':api_key'])
+
+    def put_item(self, Item, **kwargs):
+        self.db.writes += 1
+        super().put_item(Item=Item)
+
+class FakeDynamoDB(fakes.FakeDynamoDB):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def Table(self, name):
+        return self.tables.setdefault(name, FakeTable(self, name))
+
+def subscription(sub_id, customer, status, created, plan='professional'):
+    return {'id': sub_id, 'customer': customer, 'status': status, 'created': created,
+            'items': {'data': [{'plan': {'id': f'price_{plan}'}, 'price': {'metadata': {'plan': plan}}}]}}
+
+class TestReconcileSubscriptions(unittest.TestCase):
+    def setUp(self):
+        self.stripe = FixtureStripe(
+            customers=[{'id': f'cus_{i}', 'created': 1000 + i, 'metadata': {'user_id': f'u{i}'}} for i in range(1, 5)],
+            subscriptions=[
+                subscription('sub_1', 'cus_1', 'active', 2001),
+                subscription('sub_2', 'cus_2', 'canceled', 2002),
+                subscription('sub_3', 'cus_3', 'active', 2003, plan='starter')
+            ]
+        )
+        self.db = FakeDynamoDB()
+        users = self.db.Table(USERS_TABLE).items
+        # u1: webhook missed entirely; u2: cancellation missed; u3: in sync; u4: activation Stripe never saw
+        users['u1'] = {'user_id': 'u1', 'plan': 'free', 'stripe_customer_id': 'cus_1'}
+        users['u2'] = {'user_id': 'u2', 'plan': 'professional', 'subscription_status': 'active',
+                          'stripe_subscription_id': 'sub_2', 'stripe_customer_id': 'cus_2'}
+        users['u3'] = {'user_id': 'u3', 'plan': 'starter', 'subscription_status': 'active',
+                          'stripe_subscription_id': 'sub_3', 'stripe_customer_id': 'cus_3'}
+        users['u4'] = {'user_id': 'u4', 'plan': 'professional', 'subscription_status': 'active'}
+        self.db.Table(PLANS_TABLE).items[('u3', 'sub_3')] = {
+            'user_id': 'u3', 'subscription_id': 'sub_3', 'plan': 'starter', 'price_id': 'price_starter', 'status': 'active',
+            'stripe_customer_id': 'cus_3', 'api_key': 'ta_live_keep'}
+        self.db.Table(PLANS_TABLE).items[('u3', 'sub_old')] = {
+            'user_id': 'u3', 'subscription_id': 'sub_old', 'status': 'active'}
+
+    def test_dry_run_reports_without_writing(self):
+        report = reconcile(self.stripe, self.db, since=0, until=5000, dry_run=True, workers=2, windows=3, segments=2)
+        self.assertEqual(report['corrections']['users'], 3)
+        self.assertEqual(report['corrections']['plans_rows'], 2)
+        self.assertEqual(report['corrections']['mappings'], 4)
+        self.assertEqual(report['corrections']['orphan_plans_rows'], 1)
+        self.assertEqual(self.db.writes, 0)
+        self.assertEqual(self.db.Table(USERS_TABLE).items['u1']['plan'], 'free')
+
+    def test_apply_fixes_users_rows_and_mapping(self):
+        report = reconcile(self.stripe, self.db, since=0, until=5000, dry_run=False, workers=2, windows=3, segments=2)
+        users = self.db.Table(USERS_TABLE).items
+        self.assertEqual(report['applied']['users'], 3)
+        self.assertEqual(users['u1']['plan'], 'professional')
+        self.assertEqual((users['u2']['plan'], users['u2']['subscription_status']), ('free', 'canceled'))
+        self.assertEqual(users['u4']['plan'], 'free')
+        self.assertEqual(self.db.Table(PLANS_TABLE).items[('u2', 'sub_2')]['status'], 'cancelled')
+        self.assertEqual(self.db.Table(PLANS_TABLE).items[('u1', 'sub_1')]['plan'], 'professional')
+        self.assertEqual(self.db.Table(PLANS_TABLE).items[('u3', 'sub_3')]['api_key'], 'ta_live_keep')
+        self.assertEqual(self.db.Table(CUSTOMERS_TABLE).items['cus_1']['user_id'], 'u1')
+
+        self.assertTrue(self.db.Table(PLANS_TABLE).items[('u2', 'sub_2')]['api_key'].startswith('ta_live_'))
+
+        second = reconcile(self.stripe, self.db, since=0, until=5000, dry_run=True, workers=2, windows=3, segments=2)
+        self.assertEqual(sum(second['corrections'][k] for k in ('users', 'plans_rows', 'mappings')), 0)
+
+    def test_plans_row_changed_since_scan_is_left_alone(self):
+        plans = self.db.Table(PLANS_TABLE).items
+        plans[('u1', 'sub_1')] = {'user_id': 'u1', 'subscription_id': 'sub_1', 'status': 'payment_failed',
+                                  'webhook_note': 'keep'}
+        original_scan = FakeTable.scan
+
+        def scan_then_webhook(table, **kwargs):
+            items = original_scan(table, **kwargs)
+            if table.name == PLANS_TABLE and kwargs['Segment'] == kwargs['TotalSegments'] - 1:
+                # The webhook writes u2's row and updates u1's after the scan has read them
+                plans[('u2', 'sub_2')] = {'user_id': 'u2', 'subscription_id': 'sub_2', 'status': 'cancelled'}
+                plans[('u1', 'sub_1')]['status'] = 'active'
+            return items
+
+        FakeTable.scan = scan_then_webhook
+        try:
+            report = reconcile(self.stripe, self.db, since=0, until=5000, dry_run=False, workers=2, windows=3, segments=2)
+        finally:
+            FakeTable.scan = original_scan
+        self.assertEqual(report['applied']['plans_rows'], 0)
+        self.assertEqual(report['applied']['plans_rows_changed_since_scan'], 2)
+        self.assertEqual(plans[('u2', 'sub_2')], {'user_id': 'u2', 'subscription_id': 'sub_2', 'status': 'cancelled'})
+        self.assertEqual(plans[('u1', 'sub_1')]['webhook_note'], 'keep')
+
+    def test_windows_page_every_object_once(self):
+        stripe = FixtureStripe(customers=[{'id': f'cus_{i}', 'created': i // 3} for i in range(1000)])
+        customers = fetch_all(stripe.Customer, 0, 400, workers=4, windows=7)
+        self.assertEqual(sorted(c['id'] for c in customers), sorted(f'cus_{i}' for i in range(1000)))
+
+if __name__ == '__main__':
+    unittest.main()
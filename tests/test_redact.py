@@ -1,6 +1,17 @@
 import json
+import os
+import tempfile
 import unittest
+from types import SimpleNamespace
 from lambda_functions.redact import lambda_handler
+from lambda_functions.bulk_redact import model_finder, run_job, open_store
+
+class StubOpenAI:
+    """Answers every entity-list request with the same entities"""
+    def __init__(self, entities):
+        content = json.dumps({'entities': entities})
+        response = SimpleNamespace(choices=[SimpleNamespace(finish_reason='stop', message=SimpleNamespace(content=content))])
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=lambda **kwargs: response))
 
 class TestRedact(unittest.TestCase):
     def test_lambda_handler(self):
@@ -13,5 +24,22 @@ class TestRedact(unittest.TestCase):
         self.assertEqual(response['statusCode'], 200)
         # Check redaction
 
+    def test_bulk_model_finder_records_unmatched_per_file(self):
+        client = StubOpenAI([{'text': 'Okafor', 'type': 'person'}, {'text': 'Nobody Here', 'type': 'PERSON'}])
+        with tempfile.TemporaryDirectory() as root:
+            os.makedirs(os.path.join(root, 'in'))
+            with open(os.path.join(root, 'in', 'a.txt'), 'w') as f:
+                f.write('Okafor called about the incident.')
+            manifest = run_job(open_store(os.path.join(root, 'in')), open_store(os.path.join(root, 'out')),
+                               finder=model_finder('llm', client_openai=client), mode='llm', workers=1)
+            with open(os.path.join(root, 'out', 'a.txt')) as f:
+                redacted = f.read()
+
+        entry = manifest['files'][0]
+        self.assertEqual(entry['status'], 'ok', entry.get('error'))
+        self.assertEqual(entry['unmatched_entities'], 1)
+        self.assertEqual(manifest['totals']['unmatched_entities'], 1)
+        self.assertNotIn('Okafor', redacted)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
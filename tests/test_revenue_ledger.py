@@ -0,0 +1,108 @@
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from lambda_functions.revenue_ledger import record_charge, sync, daily_totals, monthly_totals
+from tests import fakes
+from tests.fakes import TransactionCanceledException, plain
+
+class FakeTable(fakes.FakeTable):
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        pk, since = ExpressionAttributeValues[':pk'], ExpressionAttributeValues[':since']
+        return {'Items': [dict(v) for (p, s), v in sorted(self.items.items()) if p == pk and s >= since]}
+
+class FakeClient:
+    def __init__(self, items):
+        self.items = items
+
+    def transact_write_items(self, TransactItems):
+        put = TransactItems[0]['Put']
+        key = (plain(put['Item']['pk']), plain(put['Item']['sk']))
+        if key in self.items:
+            raise TransactionCanceledException([{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}, {'Code': 'None'}])
+        self.items[key] = {k: plain(v) for k, v in put['Item'].items()}
+        for op in TransactItems[1:]:
+            update = op['Update']
+            key = (plain(update['Key']['pk']), plain(update['Key']['sk']))
+            item = self.items.setdefault(key, {'pk': key[0], 'sk': key[1]})
+            values = update['ExpressionAttributeValues']
+            item['amount'] = item.get('amount', 0) + plain(values[':amount'])
+            item['count'] = item.get('count', 0) + plain(values[':one'])
+
+class FakeDynamoDB(fakes.FakeDynamoDB):
+    def __init__(self):
+        self.items = {}
+        super().__init__(client=FakeClient(self.items))
+
+    def Table(self, name):
+        return FakeTable('pk', 'sk', items=self.items)
+
+class FakeStripe:
+    def __init__(self, transactions):
+        self.transactions = transactions
+        self.calls = []
+        self.fail_at = None
+        self.BalanceTransaction = SimpleNamespace(list=self.list)
+
+    def list(self, created, **kwargs):
+        self.calls.append(created['gte'])
+        if self.fail_at is not None and created['gte'] <= self.fail_at < created['lt']:
+            raise RuntimeError('Stripe unavailable')
+        found = [t for t in self.transactions if created['gte'] <= t['created'] < created['lt']]
+        return SimpleNamespace(auto_paging_iter=lambda: iter(sorted(found, key=lambda t: -t['created'])))
+
+def ts(text):
+    return int((datetime.strptime(text, '%Y-%m-%d %H:%M') - datetime(1970, 1, 1)).total_seconds())
+
+class TestRevenueLedger(unittest.TestCase):
+    def test_webhook_and_sync_count_a_charge_once(self):
+        db = FakeDynamoDB()
+        self.assertTrue(record_charge(db, 'ch_1', 1900, ts('2026-10-01 09:00'), source='webhook'))
+        self.assertFalse(record_charge(db, 'ch_1', 1900, ts('2026-10-01 09:00')))
+
+        stripe = FakeStripe([
+            {'id': 'txn_1', 'source': 'ch_1', 'amount': 1900, 'created': ts('2026-10-01 09:00')},
+            {'id': 'txn_2', 'source': 'ch_2', 'amount': 4900, 'created': ts('2026-10-02 12:00')},
+            {'id': 'txn_3', 'source': 'ch_3', 'amount': 500, 'created': ts('2026-09-30 23:00')}
+        ])
+        result = sync(db, stripe, now=ts('2026-10-03 00:00'))
+        self.assertEqual((result['seen'], result['recorded']), (3, 2))
+
+        now = datetime(2026, 10, 3)
+        self.assertEqual(monthly_totals(db, 2, now), {'2026-09': 5.0, '2026-10': 68.0})
+        self.assertEqual(daily_totals(db, 7, now)[0], {'date': '2026-10-02', 'revenue': 49.0, 'subscriptions': 1})
+
+    def test_sync_resumes_from_cursor(self):
+        db = FakeDynamoDB()
+        stripe = FakeStripe([{'id': 'txn_1', 'source': 'ch_1', 'amount': 100, 'created': ts('2026-10-01 09:00')}])
+        sync(db, stripe, now=ts('2026-10-02 00:00'))
+        first_run = len(stripe.calls)
+        stripe.transactions.append({'id': 'txn_2', 'source': 'ch_2', 'amount': 200, 'created': ts('2026-10-02 08:00')})
+        result = sync(db, stripe, now=ts('2026-10-03 00:00'))
+
+        self.assertGreater(stripe.calls[first_run], ts('2026-10-01 08:00'))
+        self.assertEqual((result['seen'], result['recorded']), (1, 1))
+        self.assertEqual(monthly_totals(db, 1, datetime(2026, 10, 3)), {'2026-10': 3.0})
+
+    def test_interrupted_backfill_resumes_from_its_last_window(self):
+        db = FakeDynamoDB()
+        stripe = FakeStripe([
+            {'id': f'txn_{day}', 'source': f'ch_{day}', 'amount': 100, 'created': ts(f'2026-09-{day:02d} 12:00')}
+            for day in range(1, 29)
+        ])
+        stripe.fail_at = ts('2026-09-20 12:00')
+        with self.assertRaises(RuntimeError):
+            sync(db, stripe, now=ts('2026-10-01 00:00'), initial_days=30)
+        self.assertEqual(monthly_totals(db, 1, datetime(2026, 9, 30)), {'2026-09': 19.0})
+
+        stripe.fail_at, stripe.calls = None, []
+        result = sync(db, stripe, now=ts('2026-10-01 00:00'), initial_days=30)
+        self.assertLess(len(stripe.calls), 13)
+        self.assertTrue(result['complete'])
+        self.assertEqual(monthly_totals(db, 1, datetime(2026, 9, 30)), {'2026-09': 28.0})
+
+        # A deadline already passed stops before the first window and keeps the cursor
+        self.assertFalse(sync(db, stripe, now=ts('2026-10-05 00:00'), deadline=1)['complete'])
+        self.assertEqual(db.items[('cursor', 'balance_transactions')]['created'], result['cursor'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import json
+import unittest
+from unittest import mock
+from lambda_functions import search_index
+from lambda_functions.search_index import (
+    SearchIndex, encode_postings, decode_postings, build_snippet, query_terms
+)
+from lambda_functions.search_indexer import worker_handler
+from tests import fakes
+
+class FakeTable(fakes.FakeTable):
+    """Just enough of the boto3 Table API for SearchIndex"""
+    def __init__(self):
+        super().__init__('user_id', 'sk')
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues=None,
+                    ExpressionAttributeNames=None, ReturnValues=None):
+        item = self.items.setdefault(self.key(Key), dict(Key))
+        names = ExpressionAttributeNames or {}
+        action, clauses = UpdateExpression.split(' ', 1)
+        for clause in clauses.split(','):
+            if action == 'ADD':
+                name, value = clause.split()
+                item[name] = item.get(name, 0) + ExpressionAttributeValues[value]
+            elif action == 'SET':
+                name, value = [part.strip() for part in clause.split('=')]
+                item[names.get(name, name)] = ExpressionAttributeValues[value]
+            else:
+                item.pop(names.get(clause.strip(), clause.strip()), None)
+        return {'Attributes': dict(item)}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues, **kwargs):
+        prefix = ExpressionAttributeValues.get(':prefix', '')
+        return {'Items': [dict(item) for (uid, sk), item in sorted(self.items.items())
+                          if uid == ExpressionAttributeValues[':uid'] and sk.startswith(prefix)]}
+
+class FakeDynamoDB:
+    def __init__(self):
+        self.table = FakeTable()
+
+    def Table(self, name):
+        return self.table
+
+    def batch_get_item(self, RequestItems):
+        name, request = next(iter(RequestItems.items()))
+        found = [self.table.items[self.table.key(k)] for k in request['Keys'] if self.table.key(k) in self.table.items]
+        return {'Responses': {name: found}}
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = SearchIndex(FakeDynamoDB(), 'user-1')
+
+    def test_postings_round_trip(self):
+        entries = [(1, 0, 3, [2, 9, 300]), (7, 1, 40, [0]), (1000, 0, 2, [4, 5])]
+        self.assertEqual(decode_postings(encode_postings(entries)), entries)
+
+    def test_query_terms_drop_stopwords(self):
+        self.assertEqual(query_terms('The threat AND the threat score'), ['threat', 'score'])
+
+    def test_search_ranks_and_snippets(self):
+        self.index.index_document('conversation', 'c1', 'Bus stop incident', 'Student made a threat near the bus stop.')
+        self.index.index_document('activity', 'a1', 'Case 12', 'Follow-up meeting with parents scheduled.')
+
+        results = self.index.search('bus threat')
+        self.assertEqual([r['doc_id'] for r in results], ['c1'])
+        self.assertIn('bus', results[0]['snippet'].lower())
+
+        self.assertEqual(self.index.search('threat', doc_type='activity'), [])
+
+    def test_reindex_and_remove(self):
+        self.index.index_document('activity', 'a1', 'Case 12', 'weapon mentioned')
+        self.index.index_document('activity', 'a1', 'Case 12', 'resolved calmly')
+        self.assertEqual(self.index.search('weapon'), [])
+        self.assertEqual(len(self.index.search('resolved')), 1)
+
+        self.index.remove_document('activity', 'a1')
+        self.assertEqual(self.index.search('resolved'), [])
+
+    def test_reindex_grown_document(self):
+        self.index.index_document('conversation', 'c1', 'Drill', 'lockdown drill planning')
+        self.index.index_document('conversation', 'c1', 'Drill', 'lockdown drill planning\nevacuation route review')
+        results = self.index.search('evacuation')
+        self.assertEqual(len(results), 1)
+        self.assertIn('evacuation', results[0]['snippet'])
+
+    def test_postings_are_sharded_and_lengths_stay_current(self):
+        with mock.patch.object(search_index, 'SHARD_DOCS', 2):
+            for n in range(5):
+                self.index.index_document('activity', f'a{n}', '', 'threat ' + 'word ' * n)
+            term_items = [sk for (_, sk) in self.index.table.items if sk.startswith('term#threat#')]
+            self.assertEqual(len(term_items), 3)
+            self.assertEqual(len(self.index.search('threat')), 5)
+
+            # Growing a0 leaves its 'threat' posting untouched but must still lower its score
+            self.index.index_document('activity', 'a0', '', 'threat ' + 'word ' * 50)
+            ranked = [r['doc_id'] for r in self.index.search('threat')]
+            self.assertEqual(ranked[-1], 'a0')
+
+    def test_worker_fails_the_rest_of_a_users_group(self):
+        dynamodb = FakeDynamoDB()
+        def get_item(Key):
+            if Key.get('activity_id') == 'm1':
+                raise RuntimeError('throttled')
+            return {}
+        dynamodb.table.get_item = get_item
+        record = lambda mid, user: {'messageId': mid, 'attributes': {'MessageGroupId': user},
+                                    'body': json.dumps({'user_id': user, 'doc_type': 'activity', 'doc_id': mid})}
+        records = [record('m1', 'u1'), record('m2', 'u1'), record('m3', 'u2')]
+        result = worker_handler({'Records': records}, None, dynamodb, None)
+        self.assertEqual([f['itemIdentifier'] for f in result['batchItemFailures']], ['m1', 'm2'])
+
+    def test_snippet_window(self):
+        text = ' '.join(f'w{i}' for i in range(100))
+        snippet = build_snippet(text, [50], radius=2)
+        self.assertEqual(snippet, '...w48 w49 w50 w51 w52...')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+from lambda_functions import stripe_customers
+from lambda_functions.stripe_customers import (
+    remember_customer, user_for_customer, forget_customer, find_subscription, SUBSCRIPTION_INDEX, CUSTOMERS_TABLE
+)
+from tests.fakes import FakeDynamoDB, FakeTable
+
+class FakePlans(FakeTable):
+    def __init__(self):
+        super().__init__('user_id', 'subscription_id')
+        self.queries = []
+
+    def query(self, IndexName, KeyConditionExpression, ExpressionAttributeValues, Limit):
+        self.queries.append(IndexName)
+        found = [s for s in self.items.values() if s['subscription_id'] == ExpressionAttributeValues[':sid']]
+        return {'Items': found[:Limit]}
+
+class TestStripeCustomers(unittest.TestCase):
+    def setUp(self):
+        patch = mock.patch.dict(stripe_customers._users, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.customers, self.plans = FakeTable('customer_id'), FakePlans()
+        self.db = FakeDynamoDB({CUSTOMERS_TABLE: self.customers, 'ThreatalyticsPlans': self.plans})
+
+    def test_lookup_hit_is_cached_and_miss_is_not(self):
+        self.customers.items['cus_1'] = {'customer_id': 'cus_1', 'user_id': 'u1'}
+        self.assertEqual(user_for_customer(self.db, 'cus_1'), 'u1')
+        self.assertEqual(user_for_customer(self.db, 'cus_1'), 'u1')
+        self.assertEqual(self.customers.reads, 1)
+
+        self.assertIsNone(user_for_customer(self.db, 'cus_2'))
+        self.assertIsNone(user_for_customer(self.db, None))
+        # A miss is read again, so a mapping written later is picked up
+        self.customers.items['cus_2'] = {'customer_id': 'cus_2', 'user_id': 'u2'}
+        self.assertEqual(user_for_customer(self.db, 'cus_2'), 'u2')
+
+    def test_remember_backfills_the_mapping_once(self):
+        remember_customer(self.db, 'cus_3', 'u3')
+        remember_customer(self.db, 'cus_3', 'u3')
+        remember_customer(self.db, 'cus_4', None)
+        self.assertEqual(self.customers.writes, 1)
+        self.assertEqual(self.customers.items['cus_3']['user_id'], 'u3')
+        self.assertEqual(user_for_customer(self.db, 'cus_3'), 'u3')
+        self.assertEqual(self.customers.reads, 0)
+
+        forget_customer(self.db, 'cus_3')
+        self.assertIsNone(user_for_customer(self.db, 'cus_3'))
+
+    def test_find_subscription_uses_the_index(self):
+        self.plans.put_item(Item={'user_id': 'u1', 'subscription_id': 'sub_1', 'status': 'active'})
+        self.assertEqual(find_subscription(self.db.Table('ThreatalyticsPlans'), 'sub_1')['user_id'], 'u1')
+        self.assertIsNone(find_subscription(self.db.Table('ThreatalyticsPlans'), 'sub_2'))
+        self.assertEqual(self.plans.queries, [SUBSCRIPTION_INDEX, SUBSCRIPTION_INDEX])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import json
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions import stripe_webhook, stripe_customers, usage_tracker
+from lambda_functions.etags import VERSIONS_TABLE
+from lambda_functions.stripe_webhook import record_event, worker_handler, lambda_handler, resolve_user_id, EVENTS_TABLE
+from lambda_functions.stripe_customers import CUSTOMERS_TABLE
+from tests import fakes
+from tests.fakes import ConditionalCheckFailedException, FakeTable, FakeVersions
+
+class FakeLedger:
+    """ThreatalyticsStripeEvents, evaluating the two conditions the webhook uses"""
+    def __init__(self, db):
+        self.db = db
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        current = self.db.events.get(Item['event_id'])
+        if current and current['status'] != ExpressionAttributeValues[':received']:
+            raise ConditionalCheckFailedException()
+        self.db.events[Item['event_id']] = dict(Item)
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None):
+        item = self.db.events[Key['event_id']]
+        if ConditionExpression and item['status'] != ExpressionAttributeValues[':from']:
+            raise ConditionalCheckFailedException()
+        for name, value in zip(ExpressionAttributeNames.values(), (v for k, v in ExpressionAttributeValues.items() if k != ':from')):
+            item[name] = value
+
+    def get_item(self, Key, **kwargs):
+        item = self.db.events.get(Key['event_id'])
+        return {'Item': dict(item)} if item else {}
+
+class FakeWrites:
+    """Tables the handlers only write to; records each call"""
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+
+    def put_item(self, **kwargs):
+        self.db.writes.append((self.name, kwargs))
+
+    def update_item(self, **kwargs):
+        self.db.writes.append((self.name, kwargs))
+
+class FakeDynamoDB(fakes.FakeDynamoDB):
+    def __init__(self):
+        customers = FakeTable('customer_id')
+        super().__init__({
+            EVENTS_TABLE: FakeLedger(self),
+            CUSTOMERS_TABLE: customers,
+            VERSIONS_TABLE: FakeVersions(),
+            'ThreatalyticsPlans': FakeWrites(self, 'ThreatalyticsPlans'),
+            'ThreatalyticsPayments': FakeWrites(self, 'ThreatalyticsPayments')
+        })
+        self.events, self.customers, self.writes = {}, customers.items, []
+
+class FakeSQS:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, **kwargs):
+        self.messages.append(kwargs)
+
+def stripe_event(event_id, customer='cus_1', event_type='invoice.payment_failed'):
+    return {'id': event_id, 'type': event_type, 'created': 1760000000,
+            'data': {'object': {'object': 'invoice', 'customer': customer}}}
+
+def sqs_record(message_id, event):
+    return {'messageId': message_id, 'body': json.dumps(event),
+            'attributes': {'MessageGroupId': event['data']['object']['customer']}}
+
+class TestStripeWebhook(unittest.TestCase):
+    def setUp(self):
+        self.db, self.sqs = FakeDynamoDB(), FakeSQS()
+        for patch in (mock.patch.object(stripe_webhook, 'dynamodb', self.db),
+                      mock.patch.object(usage_tracker, 'dynamodb', self.db),
+                      mock.patch.object(stripe_webhook, 'sqs', self.sqs),
+                      mock.patch.object(stripe_webhook, 'EVENTS_QUEUE_URL', 'https://sqs/events.fifo')):
+            patch.start()
+            self.addCleanup(patch.stop)
+        patch = mock.patch.dict(stripe_customers._users, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def deliver(self, event):
+        with mock.patch.object(stripe_webhook.stripe.Webhook, 'construct_event', return_value=event):
+            response = lambda_handler({'body': json.dumps(event), 'headers': {'Stripe-Signature': 'sig'}}, None)
+        return response['statusCode'], json.loads(response['body'])
+
+    def test_record_event_admits_new_and_unqueued_events_only(self):
+        event = stripe_event('evt_1')
+        self.assertTrue(record_event(event))
+        # Still 'received': the earlier attempt never enqueued it
+        self.assertTrue(record_event(event))
+        self.db.events['evt_1']['status'] = 'queued'
+        self.assertFalse(record_event(event))
+        self.db.events['evt_1']['status'] = 'processed'
+        self.assertFalse(record_event(event))
+
+    def test_duplicate_delivery_is_acknowledged_without_work(self):
+        event = stripe_event('evt_2', customer='cus_9')
+        self.assertEqual(self.deliver(event), (200, {'received': True}))
+        self.assertEqual(len(self.sqs.messages), 1)
+        self.assertEqual(self.sqs.messages[0]['MessageGroupId'], 'cus_9')
+        self.assertEqual(self.sqs.messages[0]['MessageDeduplicationId'], 'evt_2')
+        self.assertEqual(self.db.events['evt_2']['status'], 'queued')
+
+        self.assertEqual(self.deliver(event), (200, {'received': True, 'duplicate': True}))
+        self.assertEqual(len(self.sqs.messages), 1)
+
+    def test_worker_fails_the_rest_of_a_customers_batch_after_an_error(self):
+        events = [stripe_event('evt_a1', 'cus_a'), stripe_event('evt_a2', 'cus_a'), stripe_event('evt_b1', 'cus_b')]
+        for event in events:
+            record_event(event)
+        applied = []
+
+        def apply(event):
+            if event['id'] == 'evt_a1':
+                raise RuntimeError('Stripe unavailable')
+            applied.append(event['id'])
+
+        with mock.patch.object(stripe_webhook, 'apply_event', side_effect=apply), self.assertLogs(level='ERROR'):
+            result = worker_handler({'Records': [sqs_record(f'm{i}', e) for i, e in enumerate(events)]}, None)
+
+        # evt_a2 is not applied ahead of evt_a1; the other customer is unaffected
+        self.assertEqual(result, {'batchItemFailures': [{'itemIdentifier': 'm0'}, {'itemIdentifier': 'm1'}]})
+        self.assertEqual(applied, ['evt_b1'])
+        self.assertEqual(self.db.events['evt_b1']['status'], 'processed')
+        self.assertEqual(self.db.events['evt_a2']['status'], 'received')
+
+        # A redelivered event that is already processed is skipped
+        with mock.patch.object(stripe_webhook, 'apply_event', side_effect=apply):
+            self.assertEqual(worker_handler({'Records': [sqs_record('m3', events[2])]}, None), {'batchItemFailures': []})
+        self.assertEqual(applied, ['evt_b1'])
+
+    def test_resolve_user_id_tries_mapping_then_metadata_then_customer(self):
+        self.db.customers['cus_1'] = {'customer_id': 'cus_1', 'user_id': 'u1'}
+        with mock.patch.object(stripe_webhook.stripe.Customer, 'retrieve') as retrieve:
+            retrieve.return_value = {'id': 'cus_3', 'metadata': {'user_id': 'u3'}}
+            # Mapping first, even when the object's metadata says otherwise
+            self.assertEqual(resolve_user_id({'customer': 'cus_1', 'metadata': {'user_id': 'other'}}), 'u1')
+            # Then the object's metadata, remembered for next time
+            self.assertEqual(resolve_user_id({'customer': 'cus_2', 'metadata': {'user_id': 'u2'}}), 'u2')
+            self.assertEqual(self.db.customers['cus_2']['user_id'], 'u2')
+            retrieve.assert_not_called()
+            # Then the customer's metadata from Stripe
+            self.assertEqual(resolve_user_id({'customer': 'cus_3'}), 'u3')
+            self.assertEqual(self.db.customers['cus_3']['user_id'], 'u3')
+            retrieve.assert_called_once_with('cus_3')
+
+            self.assertIsNone(resolve_user_id({'id': 'sub_1'}))
+
+    def test_plans_status_change_changes_the_usage_etag(self):
+        self.db.customers['cus_1'] = {'customer_id': 'cus_1', 'user_id': 'u1'}
+        before = usage_tracker.usage_etag('u1')
+        stripe_webhook.handle_payment_failed({'id': 'in_1', 'customer': 'cus_1', 'subscription': 'sub_1'})
+
+        plans_writes = [kwargs for name, kwargs in self.db.writes if name == 'ThreatalyticsPlans']
+        self.assertEqual(plans_writes[0]['ExpressionAttributeValues'], {':status': 'payment_failed'})
+        self.assertNotEqual(usage_tracker.usage_etag('u1'), before)
+
+if __name__ == '__main__':
+    unittest.main()
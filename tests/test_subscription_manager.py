@@ -0,0 +1,67 @@
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+from lambda_functions import subscription_manager
+from lambda_functions.subscription_manager import activation_transaction, verify_checkout
+from tests.fakes import FakeDynamoDB
+
+def session(session_id='cs_1', **overrides):
+    return {'id': session_id, 'created': 1760000000, 'customer': 'cus_1', 'subscription': 'sub_1',
+            'payment_status': 'paid', 'status': 'complete', 'amount_total': 2900, 'currency': 'usd',
+            'metadata': {'user_id': 'u1', 'plan': 'professional'}, **overrides}
+
+class TestActivation(unittest.TestCase):
+    def test_subscription_row_is_updated_not_replaced(self):
+        users, subscription = (op for op in activation_transaction('u1', 'professional', session())['TransactItems'])
+        self.assertIn('Update', users)
+        update = subscription['Update']
+        self.assertEqual(update['Key'], {'user_id': {'S': 'u1'}, 'subscription_id': {'S': 'sub_1'}})
+        # The webhook's api_key is left alone and created_at is only set once
+        self.assertIn('created_at = if_not_exists(created_at, :created)', update['UpdateExpression'])
+        self.assertNotIn('api_key', update['UpdateExpression'])
+        self.assertNotIn('api_key', update['ExpressionAttributeNames'].values())
+        fields = {name: update['ExpressionAttributeValues'][':' + key[1:]]
+                  for key, name in update['ExpressionAttributeNames'].items()}
+        self.assertEqual(fields['plan'], {'S': 'professional'})
+        self.assertEqual(fields['status'], {'S': 'active'})
+        self.assertEqual(fields['stripe_customer_id'], {'S': 'cus_1'})
+
+    def test_retries_share_a_client_request_token(self):
+        first = activation_transaction('u1', 'professional', session())
+        self.assertEqual(first, activation_transaction('u1', 'professional', session()))
+        self.assertLessEqual(len(first['ClientRequestToken']), 36)
+        self.assertNotEqual(first['ClientRequestToken'],
+                            activation_transaction('u1', 'professional', session('cs_2'))['ClientRequestToken'])
+
+class TestVerifyCheckout(unittest.TestCase):
+    def setUp(self):
+        self.transactions = []
+        db = FakeDynamoDB(client=SimpleNamespace(transact_write_items=lambda **kwargs: self.transactions.append(kwargs)))
+        for patch in (mock.patch.object(subscription_manager, 'dynamodb', db),
+                      mock.patch.object(subscription_manager, 'put_state'),
+                      mock.patch.object(subscription_manager, 'bump_version')):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_cached_session_skips_stripe(self):
+        with mock.patch.object(subscription_manager, 'cached_checkout_session', return_value=session()), \
+                mock.patch.object(subscription_manager.stripe.checkout.Session, 'retrieve') as retrieve:
+            status, body = verify_checkout('u1', 'cs_1', 'professional')
+        self.assertEqual((status, body['status']), (200, 'active'))
+        retrieve.assert_not_called()
+        self.assertEqual(self.transactions, [activation_transaction('u1', 'professional', session())])
+
+    def test_uncached_session_is_fetched_and_unpaid_is_refused(self):
+        with mock.patch.object(subscription_manager, 'cached_checkout_session', return_value=None), \
+                mock.patch.object(subscription_manager.stripe.checkout.Session, 'retrieve',
+                                  return_value=session(payment_status='unpaid')) as retrieve:
+            status, body = verify_checkout('u1', 'cs_1', 'professional')
+        retrieve.assert_called_once_with('cs_1', expand=['subscription'])
+        self.assertEqual((status, body['success']), (400, False))
+        self.assertEqual(self.transactions, [])
+
+if __name__ == '__main__':
+    unittest.main()
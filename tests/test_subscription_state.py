@@ -0,0 +1,58 @@
+import time
+import unittest
+from lambda_functions import subscription_state
+from lambda_functions.subscription_state import get_state, put_state, state_from_subscription, status_body, STATE_TABLE
+from tests.fakes import ConditionalCheckFailedException, FakeDynamoDB, FakeTable
+
+class FakeStateTable(FakeTable):
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeValues):
+        current = self.items.get(Item['user_id'])
+        if current and current['event_created'] > ExpressionAttributeValues[':created']:
+            raise ConditionalCheckFailedException()
+        super().put_item(Item=Item)
+
+def subscription(status='active', period_end=None, cancel=False):
+    return {
+        'id': 'sub_1',
+        'customer': 'cus_1',
+        'status': status,
+        'current_period_end': period_end or int(time.time()) + 30 * 86400,
+        'cancel_at_period_end': cancel,
+        'items': {'data': [{'price': {'metadata': {'plan': 'professional'}}}]},
+        'metadata': {'user_id': 'u1'}
+    }
+
+class TestSubscriptionState(unittest.TestCase):
+    def setUp(self):
+        subscription_state._cache.clear()
+        self.table = FakeStateTable()
+        self.db = FakeDynamoDB({STATE_TABLE: self.table})
+
+    def test_older_event_does_not_overwrite_newer_state(self):
+        self.assertTrue(put_state(self.db, state_from_subscription('u1', subscription(cancel=True)), event_created=200))
+        self.assertFalse(put_state(self.db, state_from_subscription('u1', subscription()), event_created=100))
+        self.assertTrue(self.table.items['u1']['cancel_at_period_end'])
+
+        self.assertTrue(put_state(self.db, state_from_subscription('u1', subscription('canceled')), event_created=300))
+        body = status_body(get_state(self.db, 'u1'))
+        self.assertFalse(body['active'])
+        self.assertEqual(body['plan'], 'free')
+
+    def test_reads_are_cached_and_writes_invalidate(self):
+        put_state(self.db, state_from_subscription('u1', subscription()), event_created=100)
+        self.assertEqual(status_body(get_state(self.db, 'u1'))['plan'], 'professional')
+        get_state(self.db, 'u1')
+        self.assertEqual(self.table.reads, 1)
+
+        put_state(self.db, state_from_subscription('u1', subscription(cancel=True)), event_created=200)
+        self.assertTrue(status_body(get_state(self.db, 'u1'))['cancel_at_period_end'])
+        self.assertEqual(self.table.reads, 2)
+
+    def test_missed_renewal_is_stale(self):
+        put_state(self.db, state_from_subscription('u1', subscription(period_end=int(time.time()) - 2 * 86400)),
+                  event_created=100)
+        self.assertIsNone(get_state(self.db, 'u1'))
+        self.assertIsNone(get_state(self.db, 'missing'))
+
+if __name__ == '__main__':
+    unittest.main()
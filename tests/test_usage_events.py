@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime
+from lambda_functions.usage_events import UsageWriter, event_transaction, current_month_total, COUNTERS_TABLE
+from tests import fakes
+from tests.fakes import ConditionalCheckFailedException, TransactionCanceledException, plain
+
+class FakeClient:
+    def __init__(self, db):
+        self.db = db
+
+    def transact_write_items(self, TransactItems):
+        put, update = TransactItems[0]['Put'], TransactItems[1]['Update']
+        event = {k: plain(v) for k, v in put['Item'].items()}
+        if self.db.throttle:
+            raise Exception('ThrottlingException')
+        if (event['user_id'], event['timestamp']) in self.db.events:
+            raise TransactionCanceledException([{'Code': 'ConditionalCheckFailed'}, {'Code': 'None'}])
+        self.db.events[(event['user_id'], event['timestamp'])] = event
+        counter = self.db.counters.setdefault((plain(update['Key']['user_id']), plain(update['Key']['month'])), {})
+        n = plain(update['ExpressionAttributeValues'][':n'])
+        for attribute in update['ExpressionAttributeNames'].values():
+            counter[attribute] = counter.get(attribute, 0) + n
+        if self.db.lose_reply:
+            self.db.lose_reply = False
+            raise Exception('ReadTimeoutError')
+
+class FakeTable:
+    def __init__(self, db, name):
+        self.db, self.name = db, name
+        self.meta = db.meta
+
+    def get_item(self, Key):
+        item = self.db.counters.get((Key['user_id'], Key['month']))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                    ConditionExpression=None, ReturnValues=None):
+        if self.name != COUNTERS_TABLE:
+            self.db.version_bumps += 1
+            return {}
+        item = self.db.counters.setdefault((Key['user_id'], Key['month']), {})
+        if ConditionExpression and 'seeded' in item:
+            raise ConditionalCheckFailedException()
+        item['total'] = item.get('total', 0) + ExpressionAttributeValues[':earlier']
+        item['seeded'] = 1
+        return {'Attributes': dict(item)}
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        values = ExpressionAttributeValues
+        count = sum(1 for (user_id, ts), e in self.db.events.items()
+                    if user_id == values[':uid'] and ts.startswith(values[':month']) and 'counted' not in e)
+        return {'Count': count}
+
+class FakeDynamoDB(fakes.FakeDynamoDB):
+    def __init__(self):
+        super().__init__(client=FakeClient(self))
+        self.events, self.counters = {}, {}
+        self.throttle = self.lose_reply = False
+        self.version_bumps = 0
+
+    def Table(self, name):
+        return FakeTable(self, name)
+
+class TestUsageEvents(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.spill = os.path.join(self.dir.name, 'spill.json')
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_flush_writes_events_and_monthly_counters(self):
+        db = FakeDynamoDB()
+        writer = UsageWriter(db, spill_path=self.spill)
+        writer.record('u1', 'redact', request_id='r1')
+        writer.record('u1', 'report')
+        writer.record(None, 'drill')
+
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual({e['endpoint'] for e in db.events.values()}, {'redact', 'report'})
+        counter = next(iter(db.counters.values()))
+        self.assertEqual(counter, {'total': 2, 'endpoint#redact': 1, 'endpoint#report': 1})
+        self.assertEqual(db.version_bumps, 1)
+        self.assertFalse(os.path.exists(self.spill))
+
+    def test_throttled_flush_spills_and_replays_once(self):
+        db = FakeDynamoDB()
+        db.throttle = True
+        writer = UsageWriter(db, spill_path=self.spill)
+        writer.record('u1', 'drill')
+        self.assertEqual(writer.flush(), 0)
+        self.assertTrue(os.path.exists(self.spill))
+
+        # A new container picks the spill up from /tmp
+        db.throttle = False
+        writer = UsageWriter(db, spill_path=self.spill)
+        writer.record('u1', 'drill')
+        self.assertEqual(writer.flush(), 2)
+        self.assertEqual(next(iter(db.counters.values()))['total'], 2)
+        self.assertFalse(os.path.exists(self.spill))
+
+    def test_replay_after_a_lost_reply_counts_once(self):
+        db = FakeDynamoDB()
+        db.lose_reply = True
+        writer = UsageWriter(db, spill_path=self.spill)
+        writer.record('u1', 'analyze')
+        self.assertEqual(writer.flush(), 0)
+
+        # The first attempt landed; the replay fails its condition and adds nothing
+        self.assertEqual(writer.flush(), 0)
+        self.assertEqual(next(iter(db.counters.values()))['total'], 1)
+        self.assertFalse(os.path.exists(self.spill))
+
+    def test_counter_is_seeded_once_from_earlier_events(self):
+        db = FakeDynamoDB()
+        for day in ('01', '02', '03'):
+            db.events[('u1', f'2026-10-{day}T00:00:00')] = {'user_id': 'u1', 'endpoint': 'redact'}
+        db.events[('u1', '2026-09-30T00:00:00')] = {'user_id': 'u1', 'endpoint': 'redact'}
+        db.meta.client.transact_write_items(TransactItems=event_transaction(
+            {'user_id': 'u1', 'timestamp': '2026-10-04T00:00:00', 'endpoint': 'drill', 'usage': 1}))
+
+        now = datetime(2026, 10, 18)
+        self.assertEqual(current_month_total(db, 'u1', now), 4)
+        self.assertEqual(current_month_total(db, 'u1', now), 4)
+        self.assertEqual(current_month_total(db, 'u2', now), 0)
+        self.assertEqual(event_transaction(
+            {'user_id': 'u1', 'timestamp': '2025-01-31T23:59:59', 'endpoint': 'redact'})[1]['Update']['Key']['month'],
+            {'S': '2025-01'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+from datetime import datetime
+from lambda_functions.user_index import index_attributes, previous_month, recent_users, search_by_email
+
+class FakeUsersTable:
+    """Evaluates the index queries user_index issues against a list of users"""
+    def __init__(self, users):
+        self.users = users
+        self.queries = []
+
+    def query(self, IndexName, ExpressionAttributeValues, Limit, ScanIndexForward=True, **kwargs):
+        self.queries.append(IndexName)
+        values = ExpressionAttributeValues
+        if IndexName == 'signup-month-index':
+            items = sorted((u for u in self.users if u.get('signup_month') == values[':month']),
+                           key=lambda u: u['created_at'], reverse=not ScanIndexForward)
+        elif IndexName == 'email-index':
+            items = [u for u in self.users if u.get('email') == values[':email']]
+        else:
+            items = sorted((u for u in self.users if u.get('email_initial') == values[':initial']
+                            and u['email_lower'].startswith(values[':prefix'])),
+                           key=lambda u: u['email_lower'])
+        return {'Items': items[:Limit]}
+
+def user(email, created_at):
+    return {'user_id': email, 'email': email, 'created_at': created_at, **index_attributes(email, created_at)}
+
+class UserIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.table = FakeUsersTable([
+            user('Alice@example.com', '2026-10-02T09:00:00'),
+            user('al@example.com', '2026-09-30T23:00:00'),
+            user('bob@example.com', '2026-10-05T12:00:00'),
+            user('carol@example.com', '2026-08-15T08:00:00'),
+        ])
+
+    def test_recent_users_walks_back_months_until_limit(self):
+        users = recent_users(self.table, limit=3, now=datetime(2026, 10, 18))
+        self.assertEqual([u['email'] for u in users], ['bob@example.com', 'Alice@example.com', 'al@example.com'])
+        self.assertEqual(len(self.table.queries), 2)
+        self.assertEqual(previous_month('2026-01'), '2025-12')
+
+    def test_email_search_prefix_and_exact(self):
+        self.assertEqual([u['email'] for u in search_by_email(self.table, 'AL')],
+                         ['al@example.com', 'Alice@example.com'])
+        self.assertEqual([u['email'] for u in search_by_email(self.table, 'bob@example.com')], ['bob@example.com'])
+        self.assertEqual(search_by_email(self.table, '  '), [])
+
+if __name__ == '__main__':
+    unittest.main()